@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from mailboxes import MailboxStore
+from journal import Journal, COMMIT_INTERVAL
+
+# Mailbox throughput with and without the journal.
+# `senders` coroutines each push a message and wait for it to be committed,
+# like the relay does before sending POSITIVEACK, while one consumer pops.
+# Also times rebuilding the mailboxes from the journal after a "restart".
+
+
+async def run(store, senders, messages, payload):
+    done = 0
+    receivers = list(range(256))
+
+    async def sender():
+        nonlocal done
+        while done < messages:
+            done += 1
+            receiver_id = random.choice(receivers)
+            if not store.push(receiver_id, 1, payload):
+                store.pop(receiver_id)
+                store.push(receiver_id, 1, payload)
+            if store.journal is not None:
+                commit = store.journal.commit()
+                if commit is not None:
+                    await commit
+            else:
+                await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(senders)))
+    return messages / (time.perf_counter() - start)
+
+
+def bench(args, journal_dir):
+    payload = b'x' * args.payload
+    memory = asyncio.run(run(MailboxStore(memory_limit=1 << 30), args.senders, args.messages, payload))
+
+    journal = Journal(journal_dir, args.commit_interval)
+    store = MailboxStore(memory_limit=1 << 30, journal=journal)
+    durable = asyncio.run(run(store, args.senders, args.messages, payload))
+    held = store.messages_held
+    journal.close()
+
+    start = time.perf_counter()
+    recovered = MailboxStore(memory_limit=1 << 30, journal=Journal(journal_dir)).recover()
+    recovery = time.perf_counter() - start
+    assert recovered == held, (recovered, held)
+    return {
+        "in_memory_msgs_per_sec": memory,
+        "journal_msgs_per_sec": durable,
+        "slowdown": memory / durable,
+        "commits": journal.commits,
+        "recovered_messages": recovered,
+        "recovery_sec": recovery,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mailbox store throughput, in memory vs journal")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--senders", type=int, default=256, help="concurrent pushers waiting for their commit")
+    parser.add_argument("--payload", type=int, default=64)
+    parser.add_argument("--commit-interval", type=float, default=COMMIT_INTERVAL)
+    parser.add_argument("--dir", help="journal directory (default: a temporary one)")
+    args = parser.parse_args()
+    journal_dir = args.dir or tempfile.mkdtemp(prefix="relay-journal-")
+    try:
+        print(json.dumps(bench(args, journal_dir), indent=2))
+    finally:
+        if not args.dir:
+            shutil.rmtree(journal_dir)
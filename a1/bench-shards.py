@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+import websockets
+
+# Throughput of the relay for 1..N worker processes.
+# Each run starts websocket-server.py with --workers k, then load processes
+# open one websocket per client id, associate, and loop: pipeline a window of
+# PUSHes to random ids, read the ACKs, drain their own mailbox with GETBATCH.
+# Reports acknowledged PUSHes per second and the speedup over one worker.
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "websocket-server.py")
+PORT = 12400
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not come up on port {port}")
+
+
+async def run_client(uri, client_id, ids, window, payload, deadline):
+    acked = 0
+    async with websockets.connect(uri, max_queue=None) as websocket:
+        await websocket.send(struct.pack('!BBB', 0, 0, client_id))
+        await websocket.recv()
+        get_batch = struct.pack('!BBBBH', 1, 5, client_id, 255, 65535)
+        while time.time() < deadline:
+            for _ in range(window):
+                receiver_id = random.choice(ids)
+                await websocket.send(struct.pack('!BBBBB', 2, 1, client_id, receiver_id, len(payload)) + payload)
+            for _ in range(window):
+                response = await websocket.recv()
+                if response[0] == 1 and response[1] == 2:  # POSITIVEACK
+                    acked += 1
+            await websocket.send(get_batch)
+            await websocket.recv()
+    return acked
+
+
+def load_process(port, client_ids, all_ids, window, payload_size, start_at, duration):
+    async def main():
+        await asyncio.sleep(max(0, start_at - time.time()))
+        deadline = start_at + duration
+        payload = b'x' * payload_size
+        uri = f"ws://127.0.0.1:{port}"
+        results = await asyncio.gather(*(run_client(uri, c, all_ids, window, payload, deadline) for c in client_ids))
+        return sum(results)
+    return asyncio.run(main())
+
+
+def bench(workers, args, port):
+    server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--port", str(port), "--workers", str(workers),
+                               "--memory-limit", str(1 << 30)], stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        time.sleep(0.5)  # let every worker bind
+        ids = list(range(args.clients))
+        slices = [ids[i::args.load_procs] for i in range(args.load_procs)]
+        start_at = time.time() + 1
+        with multiprocessing.Pool(args.load_procs) as pool:
+            acked = sum(pool.starmap(load_process, [(port, s, ids, args.window, args.payload, start_at, args.duration)
+                                                    for s in slices if s]))
+    finally:
+        server.terminate()
+        server.wait()
+    return acked / args.duration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relay throughput vs number of worker processes")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--clients", type=int, default=200, help="client ids, at most 256")
+    parser.add_argument("--load-procs", type=int, default=os.cpu_count(), help="processes generating load")
+    parser.add_argument("--window", type=int, default=16, help="PUSHes in flight per client")
+    parser.add_argument("--payload", type=int, default=32, help="payload bytes per message")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    args.clients = min(args.clients, 256)
+
+    results = []
+    for k in range(1, args.max_workers + 1):
+        rate = bench(k, args, PORT + k)
+        results.append({"workers": k, "msgs_per_sec": rate, "speedup": rate / results[0]["msgs_per_sec"] if results else 1.0})
+        if not args.json:
+            print(f"workers={k:3d}  {rate:10.0f} msg/s  speedup {results[-1]['speedup']:.2f}x", flush=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
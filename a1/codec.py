@@ -0,0 +1,165 @@
+import struct
+
+# Packet codes and builders/parsers shared by the relay and the client.
+# See the top of websocket-server.py for the packet layouts.
+# Parsers hand out memoryview slices of the received frame instead of copies,
+# builders write straight into one preallocated buffer.
+
+# Packet types
+MANAGEMENT = 0
+CONTROL = 1
+DATA = 2
+
+# MANAGEMENT messages
+ASSOCIATE = 0
+ASSOCIATIONSUCCESS = 1
+ASSOCIATIONFAILED = 2
+UNKNOWNERROR = 3
+
+# CONTROL messages
+GET = 0
+BUFFEREMPTY = 1
+POSITIVEACK = 2
+BUFFERFULL = 3
+SUBSCRIBE = 4
+GETBATCH = 5
+RATELIMITED = 6
+
+# DATA messages
+GETRESPONSE = 0
+PUSH = 1
+DELIVER = 2
+BATCHRESPONSE = 3
+TAGGEDPUSH = 4
+FRAGMENT = 5
+
+HEADER = struct.Struct('!BBB')  # type, message, id
+DATA_HEADER = struct.Struct('!BBBBB')  # type, message, id, id2, length
+BATCH_HEADER = struct.Struct('!BBBB')  # type, message, id, count
+GETBATCH_PACKET = struct.Struct('!BBBBH')  # type, message, id, max count, max bytes
+SUBSCRIBE_PACKET = struct.Struct('!BBBB')  # type, message, id, credits
+ENTRY_HEADER = struct.Struct('!BB')  # sender id, length
+TAGGED_HEADER = struct.Struct('!BBBBHB')  # type, message, id, id2, tag, length
+TAG = struct.Struct('!H')  # appended to the reply of a TAGGEDPUSH
+FRAGMENT_HEADER = struct.Struct('!BBBBHHHHB')  # type, message, id, id2, tag, message id, index, count, length
+FRAGMENT_INFO = struct.Struct('!HHHB')  # message id, index, count, length; starts a stored fragment
+
+FRAGMENT_LENGTH = 255  # length byte of a DATA frame / batch entry that carries a fragment
+FRAGMENT_FLAG = 0x100  # or-ed into the sender id of a mailbox entry that is a fragment
+FRAGMENT_DATA = 254  # data bytes per fragment
+NO_REPLY = 0xFFFF  # tag of a fragment the server does not answer
+NO_REPLY_TAG = TAG.pack(NO_REPLY)
+
+
+def _table(packet_type, message):
+    return tuple(HEADER.pack(packet_type, message, client_id) for client_id in range(256))
+
+
+# Every 3-byte packet, built once and indexed by client id
+ASSOCIATE_PACKETS = _table(MANAGEMENT, ASSOCIATE)
+ASSOCIATIONSUCCESS_REPLIES = _table(MANAGEMENT, ASSOCIATIONSUCCESS)
+ASSOCIATIONFAILED_REPLIES = _table(MANAGEMENT, ASSOCIATIONFAILED)
+UNKNOWNERROR_REPLIES = _table(MANAGEMENT, UNKNOWNERROR)
+GET_PACKETS = _table(CONTROL, GET)
+BUFFEREMPTY_REPLIES = _table(CONTROL, BUFFEREMPTY)
+POSITIVEACK_REPLIES = _table(CONTROL, POSITIVEACK)
+BUFFERFULL_REPLIES = _table(CONTROL, BUFFERFULL)
+RATELIMITED_REPLIES = _table(CONTROL, RATELIMITED)
+
+
+def entry_length(sender_id, payload):
+    # Length byte for a stored entry: fragments are marked, their payload
+    # (FRAGMENT_INFO + data) carries its own length
+    return FRAGMENT_LENGTH if sender_id & FRAGMENT_FLAG else len(payload)
+
+
+def data_frame(message, client_id, other_id, payload):
+    # PUSH / GETRESPONSE / DELIVER frame with the payload copied in once
+    frame = bytearray(DATA_HEADER.size + len(payload))
+    DATA_HEADER.pack_into(frame, 0, DATA, message, client_id, other_id & 0xFF, entry_length(other_id, payload))
+    frame[DATA_HEADER.size:] = payload
+    return frame
+
+
+def batch_frame(client_id, entries, size):
+    # BATCHRESPONSE from [(sender_id, payload)] whose payloads add up to `size`
+    frame = bytearray(BATCH_HEADER.size + ENTRY_HEADER.size * len(entries) + size)
+    BATCH_HEADER.pack_into(frame, 0, DATA, BATCHRESPONSE, client_id, len(entries))
+    offset = BATCH_HEADER.size
+    for sender_id, payload in entries:
+        ENTRY_HEADER.pack_into(frame, offset, sender_id & 0xFF, entry_length(sender_id, payload))
+        offset += ENTRY_HEADER.size
+        frame[offset:offset + len(payload)] = payload
+        offset += len(payload)
+    return frame
+
+
+def tagged_push(client_id, receiver_id, tag, payload):
+    frame = bytearray(TAGGED_HEADER.size + len(payload))
+    TAGGED_HEADER.pack_into(frame, 0, DATA, TAGGEDPUSH, client_id, receiver_id, tag, len(payload))
+    frame[TAGGED_HEADER.size:] = payload
+    return frame
+
+
+def fragment_packet(client_id, receiver_id, tag, message_id, index, count, data):
+    frame = bytearray(FRAGMENT_HEADER.size + len(data))
+    FRAGMENT_HEADER.pack_into(frame, 0, DATA, FRAGMENT, client_id, receiver_id, tag, message_id, index, count, len(data))
+    frame[FRAGMENT_HEADER.size:] = data
+    return frame
+
+
+def tagged(reply, tag):
+    # The 3-byte reply to a PUSH, with the raw tag bytes of a TAGGEDPUSH if any
+    return reply + tag if tag else reply
+
+
+def getbatch_packet(client_id, max_count, max_bytes):
+    return GETBATCH_PACKET.pack(CONTROL, GETBATCH, client_id, max_count, max_bytes)
+
+
+def subscribe_packet(client_id, credits):
+    return SUBSCRIBE_PACKET.pack(CONTROL, SUBSCRIBE, client_id, credits)
+
+
+def data_payload(frame):
+    # (id2, payload) of a DATA frame, the payload as a view into `frame`.
+    # For a fragment id2 has FRAGMENT_FLAG set and the payload is FRAGMENT_INFO + data.
+    view = memoryview(frame)
+    flag = FRAGMENT_FLAG if view[4] == FRAGMENT_LENGTH else 0
+    return view[3] | flag, view[DATA_HEADER.size:]
+
+
+def fragment_body(frame):
+    # (id2, tag, stored payload) of a FRAGMENT packet, the payload being
+    # FRAGMENT_INFO + data as a view into `frame`
+    view = memoryview(frame)
+    return view[3], bytes(view[4:6]), view[6:]
+
+
+def tagged_payload(frame):
+    # (id2, raw tag bytes, payload view) of a TAGGEDPUSH
+    view = memoryview(frame)
+    return view[3], bytes(view[4:6]), view[TAGGED_HEADER.size:]
+
+
+def reply_tag(frame):
+    # Tag of a reply to a TAGGEDPUSH or fragment, None for an untagged reply.
+    # Only CONTROL replies (and UNKNOWNERROR) carry one: a DATA frame of the
+    # same length is a message with an empty payload.
+    if frame[0] == DATA or len(frame) != HEADER.size + TAG.size:
+        return None
+    return TAG.unpack_from(frame, HEADER.size)[0]
+
+
+def batch_entries(frame):
+    # Yields (sender_id, payload view) from a BATCHRESPONSE
+    view = memoryview(frame)
+    offset = BATCH_HEADER.size
+    for _ in range(view[3]):
+        sender_id, length = view[offset], view[offset + 1]
+        offset += ENTRY_HEADER.size
+        if length == FRAGMENT_LENGTH:
+            sender_id |= FRAGMENT_FLAG
+            length = FRAGMENT_INFO.size + view[offset + FRAGMENT_INFO.size - 1]
+        yield sender_id, view[offset:offset + length]
+        offset += length
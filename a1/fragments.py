@@ -0,0 +1,80 @@
+import time
+from codec import FRAGMENT_INFO
+
+# Client side reassembly of messages sent as DATA/FRAGMENT packets.
+# The relay hands fragments out one by one as it got them; a message is
+# complete once all `count` fragments with its (sender, message id) are in.
+# Partial messages take up at most REASSEMBLY_BYTES: the one idle longest is
+# dropped to make room, and any that got no fragment for REASSEMBLY_TIMEOUT
+# seconds (its sender gave up, or a fragment was refused) is dropped as well.
+# A sender waiting for room in our mailbox keeps a message going for as long
+# as we keep draining it.
+
+REASSEMBLY_BYTES = 4 * 1024 * 1024
+REASSEMBLY_TIMEOUT = 30
+
+
+class Partial:
+    def __init__(self, count, now):
+        self.count = count
+        self.updated = now  # when its last fragment came in
+        self.parts = {}  # {index: data}
+        self.size = 0
+
+
+class Reassembly:
+    def __init__(self, limit=REASSEMBLY_BYTES, timeout=REASSEMBLY_TIMEOUT):
+        self.limit = limit
+        self.timeout = timeout
+        self.partial = {}  # {(sender id, message id): Partial}, least recently updated first
+        self.size = 0
+        self.completed = 0
+        self.dropped = 0
+
+    def drop(self, key):
+        self.size -= self.partial.pop(key).size
+        self.dropped += 1
+
+    def expire(self, now):
+        while self.partial:
+            key, partial = next(iter(self.partial.items()))
+            if now - partial.updated < self.timeout:
+                break
+            self.drop(key)
+
+    def add(self, sender_id, body, now=None):
+        # body is FRAGMENT_INFO + data. Returns the whole message once its last
+        # fragment is in, None until then.
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        message_id, index, count, length = FRAGMENT_INFO.unpack_from(body)
+        data = bytes(body[FRAGMENT_INFO.size:FRAGMENT_INFO.size + length])
+        key = (sender_id, message_id)
+        partial = self.partial.get(key)
+        if partial is not None and partial.count != count:
+            # Same id reused for a new message, the old one never completed
+            self.drop(key)
+            partial = None
+        if partial is None:
+            if count == 1:
+                self.completed += 1
+                return data
+            partial = self.partial[key] = Partial(count, now)
+        if index in partial.parts:
+            return None  # delivered twice (at-least-once after a relay restart)
+        while self.size + len(data) > self.limit and self.partial:
+            oldest = next(iter(self.partial))
+            self.drop(oldest)
+            if oldest == key:
+                return None
+        partial.parts[index] = data
+        partial.size += len(data)
+        self.size += len(data)
+        if len(partial.parts) < count:
+            partial.updated = now
+            self.partial[key] = self.partial.pop(key)  # to the end, as the most recent
+            return None
+        del self.partial[key]
+        self.size -= partial.size
+        self.completed += 1
+        return b''.join(partial.parts[i] for i in range(count))
@@ -0,0 +1,318 @@
+import asyncio
+import mmap
+import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Append-only message log for the relay so queued messages survive a restart.
+#
+# Each worker appends to one shared log, split into segments <n>.seg in the
+# journal directory. A record is (kind: 1 byte, flags: 1 byte, receiver id:
+# 1 byte, sender id: 1 byte, seq: 8 bytes, length: 2 bytes) + payload, flags
+# being the bits of the entry's sender above the id byte (fragments) and seq
+# numbering the messages of one receiver in mailbox order:
+#   APPEND   a message queued for the receiver
+#   CONSUME  message `seq` of the receiver was handed out
+#   DROP     everything logged for the receiver so far was evicted
+# Writes go to the active segment right away. A commit syncs everything
+# written since the previous one with a single fdatasync (group commit), off
+# the event loop; writes made while it runs join the next. CONSUME and DROP
+# are never waited for: delivery is at-least-once, and a message handed out
+# just before a crash may be handed out again after it.
+#
+# In memory every receiver has the (seq, segment, offset, size) of its
+# undelivered records in mailbox order, and every segment a count of them.
+# Once the oldest segments hold none they are deleted. When more than
+# MAX_SEGMENTS are kept and they hold more delivered bytes than undelivered
+# ones, the undelivered records of the oldest are copied to the end of the
+# log, so a mailbox nobody drains does not keep the whole log around; the log
+# stays within about twice the undelivered bytes, and every record is copied
+# a bounded number of times on average.
+
+COMMIT_INTERVAL = 0.0  # least seconds between the starts of two commits
+SEGMENT_BYTES = 4 << 20  # a new segment is started past this
+MAX_SEGMENTS = 4  # sealed segments kept before the oldest has its records moved
+RECORD = struct.Struct('!BBBBqH')
+APPEND, CONSUME, DROP = 0, 1, 2
+
+
+class Segment:
+    def __init__(self, root, number):
+        self.number = number
+        self.path = os.path.join(root, f"{number}.seg")
+        self.file = open(self.path, "a+b")  # readable too, for moving records
+        self.size = self.file.seek(0, os.SEEK_END)
+        self.live = 0  # undelivered records in it
+        self.live_bytes = 0  # and their size
+
+    def sync(self):
+        # Runs in the sync thread
+        self.file.flush()
+        os.fdatasync(self.file.fileno())
+
+    def read(self, offset):
+        # The record at `offset` as (flags, sender id, payload)
+        header = os.pread(self.file.fileno(), RECORD.size, offset)
+        _, flags, _, sender_id, _, length = RECORD.unpack(header)
+        return flags, sender_id, os.pread(self.file.fileno(), length, offset + RECORD.size)
+
+    def remove(self):
+        self.file.close()
+        os.unlink(self.path)
+
+
+class Journal:
+    def __init__(self, root, commit_interval=COMMIT_INTERVAL, segment_bytes=SEGMENT_BYTES):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.commit_interval = commit_interval
+        self.segment_bytes = segment_bytes
+        self.segments = deque()  # oldest first, the active one last
+        self.unsynced = []  # segments written since the last commit started
+        self.new_files = False  # segments created since then, for the directory sync
+        self.pending = {}  # {receiver_id: deque of (seq, segment, offset, size)}, mailbox order
+        self.next_seq = {}  # {receiver_id: seq of its next APPEND}
+        self.waiter = None  # future for the commit being gathered
+        self.in_flight = None  # future for the commit being written
+        self.last_commit = 0.0
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="journal")
+        self.commits = 0
+        self.records = 0
+
+    def active(self):
+        # The segment being appended to
+        if not self.segments or self.segments[-1].size >= self.segment_bytes:
+            number = self.segments[-1].number + 1 if self.segments else 0
+            self.segments.append(Segment(self.root, number))
+            self.new_files = True
+        return self.segments[-1]
+
+    def write(self, kind, flags, receiver_id, sender_id, seq, payload=b''):
+        # Returns the (segment, offset, size) of the record
+        segment = self.active()
+        offset = segment.size
+        segment.file.write(RECORD.pack(kind, flags, receiver_id, sender_id, seq, len(payload)))
+        if payload:
+            segment.file.write(payload)
+        segment.size += RECORD.size + len(payload)
+        if not self.unsynced or self.unsynced[-1] is not segment:
+            self.unsynced.append(segment)
+        return segment, offset, RECORD.size + len(payload)
+
+    def append(self, receiver_id, sender_id, payload):
+        seq = self.next_seq.get(receiver_id, 0)
+        self.next_seq[receiver_id] = seq + 1
+        record = self.write(APPEND, sender_id >> 8, receiver_id, sender_id & 0xFF, seq, payload)
+        self.hold(record)
+        queue = self.pending.get(receiver_id)
+        if queue is None:
+            queue = self.pending[receiver_id] = deque()
+        queue.append((seq, *record))
+        self.records += 1
+
+    def consume(self, receiver_id):
+        # The front message of the mailbox was handed out
+        queue = self.pending[receiver_id]
+        seq, *record = queue.popleft()
+        self.release(record)
+        if not queue:
+            del self.pending[receiver_id]
+        self.write(CONSUME, 0, receiver_id, 0, seq)
+
+    def push_front(self, receiver_id, sender_id, payload):
+        # A handed out message came back: log it again, numbered before the
+        # rest of the mailbox
+        queue = self.pending.get(receiver_id)
+        if queue is None:
+            queue = self.pending[receiver_id] = deque()
+        seq = (queue[0][0] if queue else self.next_seq.get(receiver_id, 0)) - 1
+        record = self.write(APPEND, sender_id >> 8, receiver_id, sender_id & 0xFF, seq, payload)
+        self.hold(record)
+        queue.appendleft((seq, *record))
+
+    @staticmethod
+    def hold(record):
+        segment, _, size = record
+        segment.live += 1
+        segment.live_bytes += size
+
+    @staticmethod
+    def release(record):
+        segment, _, size = record
+        segment.live -= 1
+        segment.live_bytes -= size
+
+    def drop(self, receiver_id):
+        for _, *record in self.pending.pop(receiver_id, ()):
+            self.release(record)
+        self.write(DROP, 0, receiver_id, 0, self.next_seq.get(receiver_id, 0))
+
+    def recover(self):
+        # Replays the segments in order. Yields (receiver_id, [(sender_id,
+        # payload)]) for everything undelivered, in mailbox order.
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.root)
+                         if name.endswith(".seg") and name[:-4].isdigit())
+        found = {}  # {receiver_id: {seq: (segment, offset, size, sender_id)}}
+        maps = {}  # {segment: mmap of it}
+        try:
+            for number in numbers:
+                segment = Segment(self.root, number)
+                self.segments.append(segment)
+                if not segment.size:
+                    continue
+                data = maps[segment] = mmap.mmap(segment.file.fileno(), 0, access=mmap.ACCESS_READ)
+                offset = 0
+                while offset + RECORD.size <= segment.size:
+                    kind, flags, receiver_id, sender_id, seq, length = RECORD.unpack_from(data, offset)
+                    size = RECORD.size + length
+                    if offset + size > segment.size or kind > DROP:
+                        break  # a torn write
+                    if seq >= self.next_seq.get(receiver_id, 0):
+                        self.next_seq[receiver_id] = seq + 1
+                    entries = found.get(receiver_id)
+                    if entries is None:
+                        entries = found[receiver_id] = {}
+                    if kind == APPEND:
+                        # A moved record replaces its older copy
+                        entries[seq] = (segment, offset, size, flags << 8 | sender_id)
+                    elif kind == CONSUME:
+                        entries.pop(seq, None)
+                    else:
+                        entries.clear()
+                    offset += size
+                if offset < segment.size:
+                    # Cut off a torn write. The map is only read below offset.
+                    segment.file.truncate(offset)
+                    segment.size = offset
+            for receiver_id, entries in sorted(found.items()):
+                if not entries:
+                    continue
+                queue = self.pending[receiver_id] = deque()
+                mailbox = []
+                for seq in sorted(entries):
+                    segment, offset, size, sender_id = record = entries[seq]
+                    self.hold(record[:3])
+                    queue.append((seq, segment, offset, size))
+                    mailbox.append((sender_id, maps[segment][offset + RECORD.size:offset + size]))
+                yield receiver_id, mailbox
+        finally:
+            for data in maps.values():
+                data.close()
+
+    def commit(self):
+        # Future that is done once everything written so far is on disk
+        if self.unsynced:
+            if self.waiter is None:
+                loop = asyncio.get_running_loop()
+                self.waiter = loop.create_future()
+                delay = max(self.last_commit + self.commit_interval - loop.time(), 0)
+                loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+            return self.waiter
+        if self.in_flight is not None:
+            return self.in_flight
+        return None
+
+    async def flush(self):
+        waiter = self.waiter
+        previous, self.in_flight = self.in_flight, waiter
+        if previous is not None:
+            await asyncio.wait([previous])
+        # Everything written while the previous commit ran goes in this one
+        loop = asyncio.get_running_loop()
+        self.waiter = None
+        self.last_commit = loop.time()
+        segments, self.unsynced = self.unsynced, []
+        new_files, self.new_files = self.new_files, False
+        try:
+            await loop.run_in_executor(self.executor, self.sync, segments, new_files)
+        except Exception as e:
+            waiter.set_exception(e)
+            raise
+        finally:
+            if self.in_flight is waiter:
+                self.in_flight = None
+        self.commits += 1
+        waiter.set_result(None)
+        self.clean()
+
+    def sync(self, segments, new_files):
+        for segment in segments:
+            segment.sync()
+        if new_files:
+            fd = os.open(self.root, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def clean(self):
+        # Deletes the oldest segments once nothing in them is undelivered,
+        # and moves the records out of the oldest when too much is delivered
+        while len(self.segments) > 1 and not self.segments[0].live and self.segments[0] not in self.unsynced:
+            self.segments.popleft().remove()
+        if len(self.segments) <= MAX_SEGMENTS + 1:
+            return
+        live = sum(segment.live_bytes for segment in self.segments)
+        if sum(segment.size for segment in self.segments) - live <= live:
+            return
+        oldest = self.segments[0]
+        for receiver_id, queue in self.pending.items():
+            if any(segment is oldest for _, segment, _, _ in queue):
+                moved = deque()
+                for seq, *record in queue:
+                    if record[0] is oldest:
+                        flags, sender_id, payload = oldest.read(record[1])
+                        self.release(record)
+                        record = self.write(APPEND, flags, receiver_id, sender_id, seq, payload)
+                        self.hold(record)
+                    moved.append((seq, *record))
+                self.pending[receiver_id] = moved
+        # It goes once the copies are synced
+        self.commit()
+
+    def close(self):
+        for segment in self.segments:
+            segment.sync()
+            segment.file.close()
+        self.executor.shutdown()
+
+
+class Outbox:
+    # Sends frames in order, holding each one back until the commit it depends
+    # on is on disk (e.g. a POSITIVEACK for a PUSH). Frames that depend on
+    # nothing go straight out unless something is already waiting. A reply
+    # still being worked out elsewhere can keep its place with put_pending().
+    def __init__(self, send):
+        self.send = send
+        self.queue = deque()  # [(commit future or None, frame)], or (reply future, None)
+        self.task = None
+
+    async def put(self, frame, after=None):
+        if after is None and not self.queue:
+            await self.send(frame)
+            return
+        self.queue.append((after, frame))
+        if self.task is None:
+            self.task = asyncio.create_task(self.drain())
+
+    def put_pending(self, reply):
+        # reply is a future for the frame to send here, or None to send nothing
+        self.queue.append((reply, None))
+        if self.task is None:
+            self.task = asyncio.create_task(self.drain())
+
+    async def drain(self):
+        try:
+            while self.queue:
+                after, frame = self.queue[0]
+                if after is not None:
+                    await after
+                    if frame is None:
+                        frame = after.result()
+                self.queue.popleft()
+                if frame is not None:
+                    await self.send(frame)
+        finally:
+            self.queue.clear()
+            self.task = None
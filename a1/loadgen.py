@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+import websockets
+
+# Headless load generator for the relay, speaking the same packets as main.py.
+# Every simulated client opens its own websocket, associates, and then sends
+# PUSHes at --rate messages/s, each to --fanout random receivers, while
+# receiving either by server push (SUBSCRIBE), GETBATCH or plain GET polling.
+# Payloads start with the send time so delivery latency can be measured.
+# Client ids are one byte, so at most 256 clients per relay.
+
+PUSH_WINDOW = 64  # SUBSCRIBE credits
+POLL_INTERVAL = 0.25  # seconds to wait after BUFFEREMPTY, like main.py used to
+STAMP = struct.Struct('!dI')  # send time, client id of the sender
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.buffer_full = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.delivered = 0
+        self.latencies = []
+        self.recording = False
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class LoadClient:
+    def __init__(self, uri, client_id, receivers, args, stats):
+        self.uri = uri
+        self.client_id = client_id
+        self.receivers = receivers
+        self.args = args
+        self.stats = stats
+        self.replies = asyncio.Queue()  # BUFFEREMPTY / GETRESPONSE / BATCHRESPONSE for the poller
+        self.consumed = 0
+
+    def received(self, payload):
+        if len(payload) >= STAMP.size:
+            sent_at, _ = STAMP.unpack_from(payload)
+            if self.stats.recording:
+                self.stats.delivered += 1
+                self.stats.latencies.append(time.time() - sent_at)
+
+    async def reader(self, websocket):
+        async for response in websocket:
+            kind = (response[0], response[1])
+            if kind == (1, 2):  # POSITIVEACK
+                if self.stats.recording:
+                    self.stats.acked += 1
+            elif kind == (1, 3):  # BUFFERFULL
+                if self.stats.recording:
+                    self.stats.buffer_full += 1
+            elif kind == (1, 6):  # RATELIMITED
+                if self.stats.recording:
+                    self.stats.rate_limited += 1
+            elif kind == (2, 2):  # DELIVER
+                self.received(response[5:])
+                self.consumed += 1
+                if self.consumed >= PUSH_WINDOW // 2:
+                    await websocket.send(struct.pack('!BBBB', 1, 4, self.client_id, self.consumed))
+                    self.consumed = 0
+            elif kind in ((1, 1), (2, 0), (2, 3)):  # BUFFEREMPTY, GETRESPONSE, BATCHRESPONSE
+                await self.replies.put(response)
+            elif self.stats.recording:
+                self.stats.errors += 1
+
+    async def poller(self, websocket):
+        if self.args.receive == "batch":
+            request = struct.pack('!BBBBH', 1, 5, self.client_id, 255, 65535)
+        else:
+            request = struct.pack('!BBB', 1, 0, self.client_id)
+        while True:
+            await websocket.send(request)
+            response = await self.replies.get()
+            if response[0] == 1:  # BUFFEREMPTY
+                await asyncio.sleep(self.args.poll_interval)
+            elif response[1] == 0:  # GETRESPONSE
+                self.received(response[5:])
+            else:  # BATCHRESPONSE
+                offset = 4
+                for _ in range(response[3]):
+                    length = response[offset + 1]
+                    self.received(response[offset + 2:offset + 2 + length])
+                    offset += 2 + length
+
+    async def sender(self, websocket):
+        padding = b'x' * max(0, self.args.payload - STAMP.size)
+        next_send = time.perf_counter() + random.random() / self.args.rate
+        while True:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            interval = random.expovariate(self.args.rate) if self.args.poisson else 1 / self.args.rate
+            next_send += interval
+            payload = STAMP.pack(time.time(), self.client_id) + padding
+            for receiver_id in random.sample(self.receivers, min(self.args.fanout, len(self.receivers))):
+                await websocket.send(struct.pack('!BBBBB', 2, 1, self.client_id, receiver_id, len(payload)) + payload)
+                if self.stats.recording:
+                    self.stats.sent += 1
+
+    async def run(self, ready, start):
+        async with websockets.connect(self.uri, max_queue=None) as websocket:
+            await websocket.send(struct.pack('!BBB', 0, 0, self.client_id))
+            response = await websocket.recv()
+            if response[1] != 1:
+                raise RuntimeError(f"client {self.client_id} could not associate: {response!r}")
+            ready()
+            tasks = [asyncio.create_task(self.reader(websocket))]
+            if self.args.receive == "push":
+                await websocket.send(struct.pack('!BBBB', 1, 4, self.client_id, PUSH_WINDOW))
+            else:
+                tasks.append(asyncio.create_task(self.poller(websocket)))
+            await start.wait()
+            tasks.append(asyncio.create_task(self.sender(websocket)))
+            try:
+                await asyncio.gather(*tasks)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+
+async def main(args):
+    stats = Stats()
+    ids = list(range(args.first_id, args.first_id + args.clients))
+    receivers = ids if args.receivers is None else list(range(args.receivers))
+    start = asyncio.Event()
+    connected = 0
+
+    def ready():
+        nonlocal connected
+        connected += 1
+        if connected == len(ids):
+            start.set()
+
+    clients = [LoadClient(args.uri, c, receivers, args, stats) for c in ids]
+    tasks = [asyncio.create_task(client.run(ready, start)) for client in clients]
+    await asyncio.wait_for(start.wait(), args.connect_timeout)
+    await asyncio.sleep(args.warmup)
+    stats.recording = True
+    began = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stats.recording = False
+    elapsed = time.perf_counter() - began
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    def ms(p):
+        value = stats.percentile(p)
+        return None if value is None else value * 1000
+
+    return {
+        "clients": len(ids),
+        "receive": args.receive,
+        "rate_per_client": args.rate,
+        "fanout": args.fanout,
+        "payload": args.payload,
+        "duration": elapsed,
+        "sent": stats.sent,
+        "acked": stats.acked,
+        "buffer_full": stats.buffer_full,
+        "rate_limited": stats.rate_limited,
+        "errors": stats.errors,
+        "delivered": stats.delivered,
+        "send_throughput": stats.sent / elapsed,
+        "ack_throughput": stats.acked / elapsed,
+        "delivery_throughput": stats.delivered / elapsed,
+        "latency_ms": {"p50": ms(50), "p99": ms(99), "p999": ms(99.9),
+                       "max": max(stats.latencies) * 1000 if stats.latencies else None},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for the messenger relay")
+    parser.add_argument("--uri", default="ws://localhost:12345")
+    parser.add_argument("--clients", type=int, default=100, help="simulated clients (ids are 1 byte, max 256)")
+    parser.add_argument("--first-id", type=int, default=0, help="id of the first client")
+    parser.add_argument("--receivers", type=int, help="send to ids 0..N-1 instead of the simulated clients")
+    parser.add_argument("--rate", type=float, default=10, help="messages per second per client")
+    parser.add_argument("--poisson", action="store_true", help="exponential gaps between messages instead of a fixed rate")
+    parser.add_argument("--fanout", type=int, default=1, help="receivers per message")
+    parser.add_argument("--payload", type=int, default=32, help="payload bytes (at least 12, at most 254)")
+    parser.add_argument("--receive", choices=("push", "batch", "get"), default="push", help="how clients pick up their messages")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="sleep after BUFFEREMPTY in batch/get mode")
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds before measuring")
+    parser.add_argument("--connect-timeout", type=float, default=30)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--max-p99", type=float, help="exit with status 1 if p99 latency (ms) is above this")
+    parser.add_argument("--min-throughput", type=float, help="exit with status 1 if delivered messages/s is below this")
+    args = parser.parse_args()
+    if not 0 < args.clients <= 256 - args.first_id:
+        parser.error("client ids must fit in one byte")
+    args.payload = min(max(args.payload, STAMP.size), 254)
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text, file=sys.stdout)
+
+    p99 = report["latency_ms"]["p99"]
+    if args.max_p99 is not None and (p99 is None or p99 > args.max_p99):
+        sys.exit(1)
+    if args.min_throughput is not None and report["delivery_throughput"] < args.min_throughput:
+        sys.exit(1)
@@ -0,0 +1,183 @@
+import time
+from collections import deque
+
+MAILBOX_LIMIT = 100  # messages queued per receiver before BUFFERFULL
+MEMORY_LIMIT = 16 * 1024 * 1024  # bytes held across all mailboxes
+IDLE_TIMEOUT = 300  # seconds before a mailbox nobody ever associated for is dropped
+# Rough cost of the tuple + deque slot + bytes header behind every message,
+# so a flood of tiny messages is still charged against MEMORY_LIMIT
+ENTRY_OVERHEAD = 96
+
+
+class MailboxStore:
+    # Per-receiver FIFO queues of (sender_id, payload).
+    # push/pop are O(1), empty mailboxes are dropped right away and mailboxes
+    # for ids that never associated are evicted oldest-first once idle or
+    # when the memory budget runs out.
+    # With a journal every change is also written to disk, see journal.py.
+    def __init__(self, mailbox_limit=MAILBOX_LIMIT, memory_limit=MEMORY_LIMIT, idle_timeout=IDLE_TIMEOUT, journal=None):
+        self.journal = journal
+        self.mailbox_limit = mailbox_limit
+        self.memory_limit = memory_limit
+        self.idle_timeout = idle_timeout
+        self.mailboxes = {}  # {receiver_id: deque([(sender_id, payload)])}
+        self.mailbox_bytes = {}  # {receiver_id: bytes held}
+        self.associated = set()  # receiver ids that have had a session at some point
+        self.orphans = {}  # {receiver_id: time of last push}, never associated, oldest first
+
+        # Counters
+        self.bytes_held = 0
+        self.messages_held = 0
+        self.pushed = 0
+        self.popped = 0
+        self.rejected_full = 0
+        self.rejected_memory = 0
+        self.evicted_mailboxes = 0
+        self.evicted_messages = 0
+
+    def entry_size(self, payload):
+        return len(payload) + ENTRY_OVERHEAD
+
+    def depth(self, receiver_id):
+        mailbox = self.mailboxes.get(receiver_id)
+        return len(mailbox) if mailbox else 0
+
+    def associate(self, receiver_id):
+        self.associated.add(receiver_id)
+        self.orphans.pop(receiver_id, None)
+
+    def push(self, receiver_id, sender_id, payload):
+        # Returns False if the message was not accepted (BUFFERFULL)
+        mailbox = self.mailboxes.get(receiver_id)
+        if mailbox is not None and len(mailbox) >= self.mailbox_limit:
+            self.rejected_full += 1
+            return False
+        size = self.entry_size(payload)
+        if self.bytes_held + size > self.memory_limit:
+            self.evict_orphans(self.bytes_held + size - self.memory_limit, keep=receiver_id)
+            if self.bytes_held + size > self.memory_limit:
+                self.rejected_memory += 1
+                return False
+        if mailbox is None:
+            mailbox = self.mailboxes[receiver_id] = deque()
+            self.mailbox_bytes[receiver_id] = 0
+        mailbox.append((sender_id, payload))
+        if self.journal is not None:
+            self.journal.append(receiver_id, sender_id, payload)
+        self.mailbox_bytes[receiver_id] += size
+        self.bytes_held += size
+        self.messages_held += 1
+        self.pushed += 1
+        if receiver_id not in self.associated:
+            # Move to the back of the eviction order
+            self.orphans.pop(receiver_id, None)
+            self.orphans[receiver_id] = time.monotonic()
+        return True
+
+    def peek(self, receiver_id):
+        mailbox = self.mailboxes.get(receiver_id)
+        return mailbox[0] if mailbox else None
+
+    def pop(self, receiver_id):
+        mailbox = self.mailboxes.get(receiver_id)
+        if not mailbox:
+            return None
+        entry = mailbox.popleft()
+        if self.journal is not None:
+            self.journal.consume(receiver_id)
+        size = self.entry_size(entry[1])
+        self.mailbox_bytes[receiver_id] -= size
+        self.bytes_held -= size
+        self.messages_held -= 1
+        self.popped += 1
+        if not mailbox:
+            self.drop(receiver_id)
+        return entry
+
+    def pushback(self, receiver_id, entry):
+        # Put a popped message back at the front, e.g. when delivery failed.
+        # Not subject to the limits since it was already accounted for once.
+        mailbox = self.mailboxes.get(receiver_id)
+        if mailbox is None:
+            mailbox = self.mailboxes[receiver_id] = deque()
+            self.mailbox_bytes[receiver_id] = 0
+        mailbox.appendleft(entry)
+        if self.journal is not None:
+            self.journal.push_front(receiver_id, *entry)
+        size = self.entry_size(entry[1])
+        self.mailbox_bytes[receiver_id] += size
+        self.bytes_held += size
+        self.messages_held += 1
+        self.popped -= 1
+
+    def drop(self, receiver_id):
+        mailbox = self.mailboxes.pop(receiver_id, None)
+        self.orphans.pop(receiver_id, None)
+        if mailbox is None:
+            return 0
+        if self.journal is not None and mailbox:
+            # Evicted: forget it on disk too
+            self.journal.drop(receiver_id)
+        self.bytes_held -= self.mailbox_bytes.pop(receiver_id)
+        self.messages_held -= len(mailbox)
+        return len(mailbox)
+
+    def evict(self, receiver_id):
+        self.evicted_messages += self.drop(receiver_id)
+        self.evicted_mailboxes += 1
+
+    def evict_orphans(self, needed, keep=None):
+        # Free at least `needed` bytes from the least recently pushed orphans
+        for receiver_id in list(self.orphans):
+            if needed <= 0:
+                break
+            if receiver_id == keep:
+                continue
+            needed -= self.mailbox_bytes.get(receiver_id, 0)
+            self.evict(receiver_id)
+
+    def evict_idle(self, now=None):
+        # Drop orphan mailboxes that have not been pushed to for idle_timeout
+        if now is None:
+            now = time.monotonic()
+        while self.orphans:
+            receiver_id, last_push = next(iter(self.orphans.items()))
+            if now - last_push < self.idle_timeout:
+                break
+            self.evict(receiver_id)
+
+    def recover(self):
+        # Load whatever the journal still holds, returns the number of messages
+        if self.journal is None:
+            return 0
+        recovered = 0
+        for receiver_id, entries in self.journal.recover():
+            mailbox = self.mailboxes.setdefault(receiver_id, deque())
+            self.mailbox_bytes.setdefault(receiver_id, 0)
+            for entry in entries:
+                size = self.entry_size(entry[1])
+                mailbox.append(entry)
+                self.mailbox_bytes[receiver_id] += size
+                self.bytes_held += size
+                self.messages_held += 1
+                recovered += 1
+            # Treat it as claimed so the idle sweep does not throw it away
+            self.associated.add(receiver_id)
+        return recovered
+
+    def stats(self):
+        return {
+            "mailboxes": len(self.mailboxes),
+            "orphan_mailboxes": len(self.orphans),
+            "messages_held": self.messages_held,
+            "bytes_held": self.bytes_held,
+            "memory_limit": self.memory_limit,
+            "pushed": self.pushed,
+            "popped": self.popped,
+            "rejected_full": self.rejected_full,
+            "rejected_memory": self.rejected_memory,
+            "evicted_mailboxes": self.evicted_mailboxes,
+            "evicted_messages": self.evicted_messages,
+            "journal_records": self.journal.records if self.journal else 0,
+            "journal_commits": self.journal.commits if self.journal else 0,
+        }
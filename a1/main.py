@@ -1,78 +1,263 @@
+import argparse
 import asyncio
+import sys
+import threading
+import time
 import websockets
-import struct
-from collections import defaultdict
+from codec import *
+from fragments import Reassembly
+from collections import defaultdict, deque
 from qtstyles import StylePicker
 from PySide6.QtWidgets import QApplication, QWidget, QBoxLayout,\
 QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QScrollArea, \
-QLabel, QStackedWidget, QGridLayout, QStyleFactory
+QLabel, QStackedWidget, QGridLayout, QStyleFactory, QTableView, \
+QHeaderView, QStyledItemDelegate, QAbstractItemView
 from PySide6.QtGui import QFont
-from PySide6.QtCore import Signal, QObject, Slot, QTimer, Qt
-from PySide6 import QtAsyncio
+from PySide6.QtCore import Signal, QObject, Slot, QTimer, Qt, \
+QAbstractListModel, QModelIndex, QSize
+
+# Messages the server may push before we have to grant more (SUBSCRIBE credits)
+PUSH_WINDOW = 32
+# Limits for each GETBATCH used to catch up on messages queued while offline
+BATCH_COUNT = 100
+BATCH_BYTES = 16384
+# Tagged PUSHes in flight before send_message waits for replies
+SEND_WINDOW = 64
+# Longer messages go out as fragments, with one reply per window of them.
+# The relay queues every fragment as a mailbox entry of its own, so a long
+# message to a receiver that is offline or slow fills its mailbox. A window
+# the mailbox had no room for, or that went over our rate limit, is held and
+# sent again at half the size after FRAGMENT_BACKOFF seconds, doubling up to
+# FRAGMENT_BACKOFF_MAX, until the receiver has made room; each window that
+# gets through doubles the size again, up to FRAGMENT_WINDOW. The message is
+# given up once no window got through for FRAGMENT_STALL seconds.
+FRAGMENT_WINDOW = 32
+FRAGMENT_BACKOFF = 0.05
+FRAGMENT_BACKOFF_MAX = 2.0
+FRAGMENT_STALL = 300
+MAX_MESSAGE = 1024 * 1024  # bytes of UTF-8
 
 class Backend(QObject):
-    update_user_list = Signal()
+    # The backend's coroutines run on an asyncio loop in its own thread, the
+    # GUI hands them over with submit(). Its signals are emitted from that
+    # thread, so Qt queues them to the widgets in the GUI thread.
+    update_user_list = Signal(int)  # index of the first new entry in users
     update_chat_window = Signal(str, int)
     connection_status = Signal(bool)
 
     def __init__(self):
         super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="network", daemon=True)
+        # With --measure-latency: {(peer id, row): receive time} until the row
+        # is painted, and the resulting delays in seconds
+        self.stamps = None
+        self.latencies = []
         self.websocket = None
         self.client_id = None
-        self.user_list = []
-        self.chat_logs = defaultdict(list)
+        # Every contact once, in the order they turned up. users only grows,
+        # so an index into it works as a version: update_user_list(i) means
+        # users[i:] are new.
+        self.users = []
+        self.known_users = set()
+        self.chat_logs = defaultdict(list)  # {peer id: [(sender id, text)]}
+        # Session: the connection is associated once, then every PUSH is
+        # tagged. read_frames() is the only task calling recv(): it hands a
+        # tagged reply to the future waiting on its tag, other replies to
+        # pending_replies in order, and queues incoming messages for
+        # get_responses()
+        self.associated = False
+        self.next_tag = 0
+        self.unacked = {}  # {tag: future for the reply}
+        self.pending_replies = deque()  # futures for untagged requests
+        self.incoming = None  # DELIVER / BATCHRESPONSE / BUFFEREMPTY frames, None once closed
+        self.send_window = None
+        self.next_message_id = 0  # for fragmented messages
+        self.reassembly = Reassembly()
+        self.tasks = set()
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, coro):
+        # Called from the GUI thread
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        if self.websocket is not None:
+            try:
+                self.submit(self.websocket.close()).result(1)
+            except Exception as e:
+                print(f"Close error: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
 
     async def connect_to_serverrr(self, uri, client_id):
         try:
             self.websocket = await websockets.connect(uri)
             self.client_id = client_id
-            associate_packet = struct.pack('!BBB', 0, 0, client_id)
-            await self.websocket.send(associate_packet)
-            response = await self.websocket.recv()
-            if response[0] == 0 and response[1] == 1:
+            self.incoming = asyncio.Queue()
+            self.spawn(self.read_frames())
+            response = await self.request(ASSOCIATE_PACKETS[client_id])
+            if response[0] == MANAGEMENT and response[1] == ASSOCIATIONSUCCESS:
+                self.associated = True
+                self.send_window = asyncio.Semaphore(SEND_WINDOW)
                 self.connection_status.emit(True)
-                asyncio.create_task(self.get_responses())
+                self.spawn(self.get_responses())
             else:
+                await self.websocket.close()
                 self.connection_status.emit(False)
         except Exception as e:
             print(f"Connection error: {e}")
             self.connection_status.emit(False)
 
+    async def request(self, packet):
+        # Send an untagged packet and wait for the server's reply to it
+        reply = asyncio.get_running_loop().create_future()
+        self.pending_replies.append(reply)
+        await self.websocket.send(packet)
+        return await reply
+
+    def take_tag(self):
+        # A fresh tag and the future its reply will resolve
+        tag = self.next_tag
+        self.next_tag = (tag + 1) % NO_REPLY
+        reply = asyncio.get_running_loop().create_future()
+        self.unacked[tag] = reply
+        return tag, reply
+
     async def send_message(self, receiver_id, message):
-        associate_packet = struct.pack('!BBB', 0, 0, self.client_id)
-        await self.websocket.send(associate_packet)
-        response = await self.websocket.recv()
-        payload = message.encode('ascii')
-        payload_length = len(payload)
-        if payload_length > 255:
+        # Up to SEND_WINDOW of these run at once, each waiting only for its own reply
+        if not self.associated:
+            return False
+        payload = message.encode('utf-8')
+        if len(payload) > MAX_MESSAGE:
+            print(f"Message not sent: {len(payload)} bytes, at most {MAX_MESSAGE}")
             return False
-        push_packet = struct.pack('!BBBBB', 2, 1, int(self.client_id), int(receiver_id), payload_length) + payload
-        await self.websocket.send(push_packet)
-        response = await self.websocket.recv()
-        self.chat_logs[int(receiver_id)].append(f"[{self.client_id}]: {message}")
-        self.update_chat_window.emit(str(receiver_id),len(self.chat_logs[int(receiver_id)])-1)
-        return response[0] == 1 and response[1] == 2
+        receiver_id = int(receiver_id)
+        async with self.send_window:
+            self.chat_logs[receiver_id].append((self.client_id, message))
+            self.update_chat_window.emit(str(receiver_id),len(self.chat_logs[receiver_id])-1)
+            if len(payload) <= FRAGMENT_DATA:
+                tag, reply = self.take_tag()
+                await self.websocket.send(tagged_push(self.client_id, receiver_id, tag, payload))
+                response = await reply
+                return response[0] == CONTROL and response[1] == POSITIVEACK
+            message_id = self.next_message_id
+            self.next_message_id = (message_id + 1) & 0xFFFF
+            count = -(-len(payload) // FRAGMENT_DATA)
+            view = memoryview(payload)
+            first = 0
+            window = FRAGMENT_WINDOW
+            backoff = FRAGMENT_BACKOFF
+            stalled = 0.0
+            while first < count:
+                last = min(first + window, count) - 1
+                for index in range(first, last + 1):
+                    tag, reply = self.take_tag() if index == last else (NO_REPLY, None)
+                    data = view[index * FRAGMENT_DATA:(index + 1) * FRAGMENT_DATA]
+                    await self.websocket.send(fragment_packet(self.client_id, receiver_id, tag, message_id, index, count, data))
+                response = await reply
+                if response[0] == CONTROL and response[1] == POSITIVEACK:
+                    first = last + 1
+                    window = min(window * 2, FRAGMENT_WINDOW)
+                    backoff = FRAGMENT_BACKOFF
+                    stalled = 0.0
+                    continue
+                if response[0] != CONTROL or response[1] not in (BUFFERFULL, RATELIMITED):
+                    return False
+                if stalled >= FRAGMENT_STALL:
+                    print(f"Message to {receiver_id} not sent: its mailbox on the relay "
+                          f"had no room for {FRAGMENT_STALL} s")
+                    return False
+                # Wait for the receiver to drain its mailbox, and send less at
+                # once in case the whole window never fits (--mailbox-limit
+                # below FRAGMENT_WINDOW). The receiver keeps fragments it
+                # already has only once.
+                window = max(window // 2, 1)
+                await asyncio.sleep(backoff)
+                stalled += backoff
+                backoff = min(backoff * 2, FRAGMENT_BACKOFF_MAX)
+            return True
+
+    def add_user(self, user_id):
+        # Runs on the network loop only, so users and known_users stay in step
+        if user_id not in self.known_users:
+            self.known_users.add(user_id)
+            self.users.append(user_id)
+            self.update_user_list.emit(len(self.users) - 1)
+
+    def handle_incoming(self, sender_id, payload):
+        if sender_id & FRAGMENT_FLAG:
+            sender_id &= 0xFF
+            payload = self.reassembly.add(sender_id, payload)
+            if payload is None:
+                return
+        payload = str(payload, 'utf-8', 'replace')
+        if sender_id != self.client_id:
+            log = self.chat_logs[sender_id]
+            log.append((sender_id, payload))
+            if self.stamps is not None:
+                self.stamps[(sender_id, len(log) - 1)] = time.perf_counter()
+            self.update_chat_window.emit(str(sender_id), len(log) - 1)
+        self.add_user(sender_id)
+
+    async def read_frames(self):
+        websocket, incoming = self.websocket, self.incoming
+        try:
+            async for frame in websocket:
+                if frame[0] == DATA or (frame[0] == CONTROL and frame[1] == BUFFEREMPTY):
+                    incoming.put_nowait(frame)
+                elif (tag := reply_tag(frame)) is not None:
+                    reply = self.unacked.pop(tag, None)
+                    if reply is not None and not reply.done():
+                        reply.set_result(frame)
+                elif self.pending_replies:
+                    reply = self.pending_replies.popleft()
+                    if not reply.done():
+                        reply.set_result(frame)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            incoming.put_nowait(None)
+            if self.websocket is websocket:  # not reconnected meanwhile
+                self.associated = False
+                for reply in (*self.unacked.values(), *self.pending_replies):
+                    reply.cancel()
+                self.unacked.clear()
+                self.pending_replies.clear()
 
     async def get_responses(self):
-        while True:
-            try:
-                get_packet = struct.pack('!BBB', 1, 0, self.client_id)
-                await self.websocket.send(get_packet)
-                response = await self.websocket.recv()
-                if response[0] == 2 and response[1] == 0:
-                    sender_id = struct.unpack("B", response[3:4])[0]
-                    payload = response[5:].decode('ascii')
-                    if (int(sender_id)!=int(self.client_id)):
-                        self.chat_logs[int(sender_id)].append(f"[{sender_id}]: {payload}")
-                        self.update_chat_window.emit(str(sender_id),len(self.chat_logs[sender_id])-1)
-                    if int(sender_id) not in self.user_list:
-                        self.user_list.append(str(sender_id))
-                elif response[0] == 1 and response[1] == 1:  # CONTROL, BUFFEREMPTY
-                    self.update_user_list.emit()
-                    await asyncio.sleep(0.25)
-            except websockets.exceptions.ConnectionClosedError:
-                break
-        
+        # First drain whatever queued up while we were offline in a few
+        # GETBATCH round trips, then ask the server to push the rest
+        get_batch = getbatch_packet(self.client_id, BATCH_COUNT, BATCH_BYTES)
+        subscribe = subscribe_packet(self.client_id, PUSH_WINDOW)
+        await self.websocket.send(get_batch)
+        consumed = 0
+        try:
+            while (response := await self.incoming.get()) is not None:
+                if response[0] == DATA and response[1] == BATCHRESPONSE:
+                    for sender_id, payload in batch_entries(response):
+                        self.handle_incoming(sender_id, payload)
+                    # After a short batch whatever is left is few enough to be pushed
+                    await self.websocket.send(get_batch if response[3] == BATCH_COUNT else subscribe)
+                elif response[0] == CONTROL and response[1] == BUFFEREMPTY:
+                    await self.websocket.send(subscribe)
+                elif response[0] == DATA and response[1] == DELIVER:
+                    self.handle_incoming(*data_payload(response))
+                    consumed += 1
+                    if consumed >= PUSH_WINDOW // 2:
+                        # Hand the credits back so the server keeps pushing
+                        await self.websocket.send(subscribe_packet(self.client_id, consumed))
+                        consumed = 0
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
 
 class UserList(QWidget):
     select_chat = Signal(str)
@@ -80,7 +265,9 @@ class UserList(QWidget):
     def __init__(self, parent=None, backend=None):
         super().__init__(parent)
         self.backend = backend
-        self.buttons = []
+        self.buttons = {}  # {user id: button}
+        self.seen = 0  # entries of backend.users already shown
+        self.selected = None
 
         # Main layout
         main_layout = QVBoxLayout(self)
@@ -111,74 +298,135 @@ class UserList(QWidget):
     @Slot()
     def add_user(self):
         user = self.rec_id_input.text()
-        if user:  # Check if the input is not empty
-            new_user = True
-            for button in self.buttons:
-                if user == button.text():
-                    new_user = False
-                    break
-            if new_user:
-                push_button = QPushButton(user, self)
-                push_button.setCheckable(True)
-                self.buttons.append(push_button)
-                self.layout.insertWidget(len(self.buttons) - 1, push_button)
-                push_button.clicked.connect(self.user_selected)
-                if(len(self.buttons) == 1):
-                    # default just select the lone user
-                    push_button.clicked.emit()
-            self.rec_id_input.clear()  # Clear the input field after adding
-
-    @Slot()
-    def update(self):
-        for user in self.backend.user_list:
-            new_user = True
-            for button in self.buttons:
-                if user == button.text():
-                    new_user = False
-                    break
-            if new_user:
-                push_button = QPushButton(str(user), self)
-                push_button.setCheckable(True)
-                self.buttons.append(push_button)
-                self.layout.insertWidget(len(self.buttons) - 1, push_button)
-                push_button.clicked.connect(self.user_selected)
-                if(len(self.buttons) == 1):
-                    # default just select the lone user
-                    push_button.clicked.emit()
+        if user.isdigit() and int(user) < 256:
+            # The backend owns the index, the button comes back through update()
+            self.backend.loop.call_soon_threadsafe(self.backend.add_user, int(user))
+        self.rec_id_input.clear()  # Clear the input field after adding
+
+    @Slot(int)
+    def update(self, new_from_index):
+        users = self.backend.users
+        for user in users[max(new_from_index, self.seen):len(users)]:
+            if user in self.buttons:
+                continue
+            push_button = QPushButton(str(user), self)
+            push_button.setCheckable(True)
+            self.buttons[user] = push_button
+            self.layout.insertWidget(len(self.buttons) - 1, push_button)
+            push_button.clicked.connect(self.user_selected)
+            if(len(self.buttons) == 1):
+                # default just select the lone user
+                push_button.clicked.emit()
+        self.seen = max(self.seen, len(users))
 
     @Slot()
     def user_selected(self):
-        for button in self.buttons:
-            button.setChecked(False)
-        self.sender().setChecked(True)
-        username = self.sender().text()
+        if self.selected is not None:
+            self.selected.setChecked(False)
+        self.selected = self.sender()
+        self.selected.setChecked(True)
+        username = self.selected.text()
         self.select_chat.emit(username)
 
-class ChatWindow(QWidget):
+
+class ChatModel(QAbstractListModel):
+    # Rows of one conversation, read straight from the backend's
+    # [(sender id, text)] list; the view only asks for the rows it shows
+    OutgoingRole = Qt.UserRole + 1
+
     def __init__(self, parent=None, backend=None):
         super().__init__(parent)
         self.backend = backend
+        self.peer = None
         self.messages = []
+        self.count = 0  # rows announced to the view so far
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.count:
+            return None
+        sender_id, text = self.messages[index.row()]
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return f"[{sender_id}]: {text}"
+        if role == ChatModel.OutgoingRole:
+            return sender_id == self.backend.client_id
+        return None
+
+    def set_conversation(self, peer, messages):
+        self.beginResetModel()
+        if self.backend.stamps is not None:
+            self.backend.stamps.clear()  # only time messages that arrive while shown
+        self.peer = peer
+        self.messages = messages
+        self.count = len(messages)
+        self.endResetModel()
+
+    def append_from(self, new_from_index):
+        # Announce rows new_from_index.. that the backend has already appended
+        first = max(new_from_index, self.count)
+        last = len(self.messages) - 1
+        if first > last:
+            return
+        self.beginInsertRows(QModelIndex(), first, last)
+        self.count = last + 1
+        self.endInsertRows()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    # One line per message, our own on the right. Every row has the same
+    # height so the view never measures rows it does not show; a message too
+    # long for the line is elided and shown whole in its tooltip.
+    MARGIN = 4
+
+    def paint(self, painter, option, index):
+        model = index.model()
+        if model.backend.stamps:
+            received = model.backend.stamps.pop((model.peer, index.row()), None)
+            if received is not None:
+                model.backend.latencies.append(time.perf_counter() - received)
+        align = Qt.AlignRight if index.data(ChatModel.OutgoingRole) else Qt.AlignLeft
+        rect = option.rect.adjusted(self.MARGIN, 0, -self.MARGIN, 0)
+        text = option.fontMetrics.elidedText(index.data(Qt.DisplayRole), Qt.ElideRight, rect.width())
+        painter.save()
+        painter.setFont(option.font)
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        painter.drawText(rect, align | Qt.AlignVCenter, text)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        return QSize(0, option.fontMetrics.lineSpacing() + 2 * self.MARGIN)
+
+
+class ChatWindow(QWidget):
+    def __init__(self, parent=None, backend=None):
+        super().__init__(parent)
+        self.backend = backend
         self.current_user = ""
         # Main layout
         main_layout = QVBoxLayout(self)
 
-        # Scroll area setup
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area_widget_contents = QWidget()
-        self.scroll_area.setWidget(self.scroll_area_widget_contents)
+        # Only the visible rows are ever painted. A one-column table with
+        # fixed row heights rather than a QListView, which would lay out
+        # every row again (calling into the model) on each append.
+        self.model = ChatModel(self, backend)
+        self.view = QTableView(self)
+        self.view.setModel(self.model)
+        self.view.setItemDelegate(MessageDelegate(self.view))
+        self.view.horizontalHeader().hide()
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.verticalHeader().hide()
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.verticalHeader().setDefaultSectionSize(self.fontMetrics().lineSpacing() + 2 * MessageDelegate.MARGIN)
+        self.view.setShowGrid(False)
+        self.view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.view.setFocusPolicy(Qt.NoFocus)
 
-        # Layout for messages inside scroll area
-        self.layout = QBoxLayout(QBoxLayout.BottomToTop, self.scroll_area_widget_contents)
-        self.layout.insertStretch(0,1)
-        # Add scroll area to main layout
         self.contact = QLabel(f"Welcome!", self)
         self.contact.setAlignment(Qt.AlignHCenter)
         main_layout.addWidget(self.contact)
-        main_layout.addWidget(self.scroll_area)
-
-        pass
+        main_layout.addWidget(self.view)
 
     def set_title(self, username):
         self.contact.setText(f"Welcome {username}!")
@@ -186,29 +434,18 @@ class ChatWindow(QWidget):
     @Slot()
     def change_current_user(self, username):
         self.current_user = username
-        for message in self.messages:
-            self.layout.removeWidget(message)
-            message.deleteLater()
-            message = None
-        self.messages.clear()
-        self.update(self.current_user, 0)
+        self.model.set_conversation(int(username), self.backend.chat_logs[int(username)])
+        self.view.scrollToBottom()
 
     @Slot()
     def update(self, sender_id, new_from_index):
         if(sender_id!=self.current_user):
             return
-        for i in range(new_from_index, len(self.backend.chat_logs[int(self.current_user)])):
-            label = QLabel(self.backend.chat_logs[int(self.current_user)][i], self)
-            msg = self.backend.chat_logs[int(self.current_user)][i]
-            curr_user = ""
-            for j in range(1, 4):
-                if(msg[j] == ']'):
-                    break
-                curr_user += msg[j]
-            if(curr_user != self.current_user):
-                label.setAlignment(Qt.AlignRight)
-            self.layout.insertWidget(0, label)
-            self.messages.append(label)
+        scrollbar = self.view.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.model.append_from(new_from_index)
+        if at_bottom:
+            self.view.scrollToBottom()
 
 
 class Chat(QWidget):
@@ -231,7 +468,7 @@ class Chat(QWidget):
             return
         payload = self.type_window.text()
         username = self.chat_window.current_user
-        asyncio.create_task(self.backend.send_message(username, payload))
+        self.backend.submit(self.backend.send_message(username, payload))
         self.type_window.clear()
 
 class ChatPage(QWidget):
@@ -273,7 +510,7 @@ class LoginPage(QWidget):
         self.connect_button.setEnabled(False)
         self.client_id_input.setEnabled(False)
         self.client_id = int(self.client_id_input.text())
-        asyncio.create_task(self.backend.connect_to_serverrr("ws://localhost:12345", self.client_id))
+        self.backend.submit(self.backend.connect_to_serverrr("ws://localhost:12345", self.client_id))
 
     @Slot(bool)
     def on_connection_status(self, status):
@@ -301,8 +538,21 @@ class MainWindow(QWidget):
         self.stack.setCurrentIndex(self.chat_page)
 
 
+def latency_report(latencies):
+    if not latencies:
+        return "no messages timed"
+    ordered = sorted(latencies)
+    def ms(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return f"message-to-screen latency over {len(ordered)} messages: p50 {ms(50):.2f} ms, p99 {ms(99):.2f} ms, max {ordered[-1] * 1000:.2f} ms"
+
+
 def main():
-    app = QApplication([])
+    parser = argparse.ArgumentParser(description="Messenger client")
+    parser.add_argument("--measure-latency", action="store_true",
+                        help="time each message in the open chat from arrival to paint, report on exit")
+    args, qt_args = parser.parse_known_args()
+    app = QApplication([sys.argv[0], *qt_args])
     # app.setStyleSheet("* { background-color: black;"
     #                 "color : white}"
     #                 "QLineEdit { selection-color : blue; border-width: 10px}"
@@ -317,17 +567,18 @@ def main():
     app.setStyleSheet(StylePicker('qdark').get_sheet())
     app.setFont(QFont("Hack", 14, QFont.Bold))
     client = Backend()
+    if args.measure_latency:
+        client.stamps = {}
+    client.start()
     window = MainWindow(client)
     window.show()
 
-    loop = asyncio.get_event_loop()
-    
-    def qt_event_loop():
-        app.processEvents()
-        loop.call_later(0.01, qt_event_loop)
-    
-    loop.call_soon(qt_event_loop)
-    loop.run_forever()
+    # Qt's own loop sleeps until there is input or a queued signal from
+    # the network thread, nothing polls
+    app.exec()
+    client.stop()
+    if args.measure_latency:
+        print(latency_report(client.latencies))
 
 if __name__ == "__main__":
-    QtAsyncio.run(main())
+    main()
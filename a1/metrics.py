@@ -0,0 +1,115 @@
+import asyncio
+import time
+from relaylog import log
+
+# Admission control and a metrics endpoint for the relay.
+#
+# RateLimiter keeps a token bucket per sender: every PUSH or fragment takes a
+# token, tokens come back at `rate` per second up to `burst`, and a sender
+# without one gets RATELIMITED instead of filling the receiver's mailbox.
+#
+# MetricsServer answers any HTTP request on its port with the current values
+# in the Prometheus text format (scrape http://host:port/metrics). Rates are
+# left to the scraper, the counters only ever go up.
+
+RATE_LIMIT = 0  # messages/s per sender, 0 turns the limiter off
+RATE_BURST = 200  # messages a sender may send at once after being quiet
+LAG_INTERVAL = 0.1  # seconds between event loop lag probes
+DEPTH_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 1000)  # upper bounds for the mailbox depth histogram
+
+
+class RateLimiter:
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.enabled = rate > 0
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # {sender_id: [tokens, time of last refill]}
+        self.limited = 0
+
+    def allow(self, sender_id, now=None):
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(sender_id)
+        if bucket is None:
+            bucket = self.buckets[sender_id] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.limited += 1
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+
+class LagProbe:
+    # How late a sleep of `interval` wakes up is how long callbacks had to
+    # wait for the loop
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0  # since the last scrape
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - start - self.interval)
+            self.max = max(self.max, self.last)
+
+
+class MetricsServer:
+    # collect() returns [(name, type, help, [(sample name, labels dict, value)])]
+    def __init__(self, port, collect):
+        self.port = port
+        self.collect = collect
+
+    async def start(self):
+        return await asyncio.start_server(self.serve, '', self.port)
+
+    async def serve(self, reader, writer):
+        try:
+            # The request itself does not matter, skip to the end of its headers
+            while (await reader.readline()).strip():
+                pass
+            body = self.render().encode()
+            writer.write(b"HTTP/1.0 200 OK\r\n"
+                         b"Content-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            log.info("Metrics request failed: %s", e)
+        finally:
+            writer.close()
+
+    def render(self):
+        lines = []
+        for name, kind, help_text, samples in self.collect():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{sample}{{{label_text}}} {value}" if label_text else f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def histogram(name, help_text, depths, labels):
+    # Prometheus histogram (cumulative buckets) of an iterable of depths
+    counts = [0] * len(DEPTH_BUCKETS)
+    total = count = 0
+    for depth in depths:
+        total += depth
+        count += 1
+        for i, bound in enumerate(DEPTH_BUCKETS):
+            if depth <= bound:
+                counts[i] += 1
+                break
+    samples = []
+    running = 0
+    for bound, n in zip(DEPTH_BUCKETS, counts):
+        running += n
+        samples.append((name + "_bucket", {**labels, "le": bound}, running))
+    samples.append((name + "_bucket", {**labels, "le": "+Inf"}, count))
+    samples.append((name + "_sum", labels, total))
+    samples.append((name + "_count", labels, count))
+    return (name, "histogram", help_text, samples)
@@ -0,0 +1,48 @@
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from collections import deque
+
+# Logging for the relay, kept off the event loop thread: records go through a
+# queue and a listener thread does the actual writes. Off by default, only
+# warnings get through unless a level is given.
+log = logging.getLogger("relay")
+
+LOG_LEVEL = "WARNING"
+TRACE_SIZE = 0  # packets kept in the trace ring buffer, 0 disables tracing
+TRACE_SAMPLE = 0.0  # fraction of traced packets also written to the log
+
+
+class PacketTrace:
+    # Keeps the last `size` packets in memory and logs a random sample of them.
+    # Callers check `enabled` before calling record() so the hot path costs a
+    # single attribute lookup when tracing is off.
+    def __init__(self, size=TRACE_SIZE, sample=TRACE_SAMPLE):
+        self.enabled = size > 0
+        self.sample = sample
+        self.ring = deque(maxlen=max(size, 1))
+
+    def record(self, direction, packet):
+        self.ring.append((time.time(), direction, bytes(packet)))
+        if self.sample and random.random() < self.sample:
+            log.debug("%s %s", direction, bytes(packet).hex())
+
+    def dump(self):
+        # Write out the ring buffer, e.g. on SIGUSR1 or after an error
+        for timestamp, direction, packet in list(self.ring):
+            log.warning("trace %.6f %s %s", timestamp, direction, packet.hex())
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    # Route the relay logger through a queue, returns the started listener
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(processName)s %(levelname)s %(message)s"))
+    listener = logging.handlers.QueueListener(records, handler)
+    log.handlers[:] = [logging.handlers.QueueHandler(records)]
+    log.setLevel(level.upper())
+    log.propagate = False
+    listener.start()
+    return listener
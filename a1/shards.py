@@ -0,0 +1,147 @@
+import asyncio
+import os
+import struct
+import tempfile
+from journal import Outbox
+
+# Links between the worker processes of a sharded relay.
+# Every worker listens on a unix socket and opens one connection to each peer
+# the first time it has something for it. Requests go out on that connection
+# and their replies come back on it, in order.
+#
+# Frame: (body length: 4 bytes, op: 1 byte, source worker: 1 byte, request id: 4 bytes) + body
+HEADER = struct.Struct('!IBBI')
+
+OP_REQUEST = 0  # body is a client packet for an id the peer owns, answered with OP_REPLY
+OP_REPLY = 1  # body is the frame to send back to the client, empty for none
+OP_NOTIFY = 2  # body is a client packet that needs no reply (SUBSCRIBE)
+OP_DISASSOCIATE = 3  # body is the id of a client that disconnected from the source worker
+OP_DELIVER = 4  # body is a DELIVER frame for a client connected to the peer
+OP_RETURN = 5  # body is a DELIVER frame the peer could not hand to its client
+
+CONNECT_ATTEMPTS = 100
+CONNECT_RETRY = 0.05  # seconds, peers may still be starting up
+BACKLOG_BYTES = 1 << 20  # unsent bytes on a link past which request_nowait() declines
+
+
+def shard_of(client_id, workers):
+    return client_id % workers
+
+
+def socket_path(port, worker_id):
+    return os.path.join(tempfile.gettempdir(), f"relay-{port}-{worker_id}.sock")
+
+
+class ShardLinks:
+    # on_message(op, source, body) is called for everything a peer sends us.
+    # It must not block; for OP_REQUEST its return value (bytes or None) is
+    # sent back as the reply, once the future returned by
+    # reply_after(body, reply) (if any) is done.
+    def __init__(self, port, worker_id, on_message, reply_after=None):
+        self.port = port
+        self.worker_id = worker_id
+        self.on_message = on_message
+        self.reply_after = reply_after
+        self.server = None
+        self.outbound = {}  # {worker_id: task resolving to the StreamWriter}
+        self.pending = {}  # {request id: future for the reply body}
+        self.next_request = 0
+        self.tasks = set()
+
+    async def start(self):
+        path = socket_path(self.port, self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self.serve_peer, path)
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def read_frame(self, reader):
+        length, op, source, request_id = HEADER.unpack(await reader.readexactly(HEADER.size))
+        body = await reader.readexactly(length) if length else b''
+        return op, source, request_id, body
+
+    async def serve_peer(self, reader, writer):
+        # Inbound connection: requests and notifications from one peer
+        async def send(frame):
+            writer.write(frame)
+            await writer.drain()
+        outbox = Outbox(send)
+        try:
+            while True:
+                op, source, request_id, body = await self.read_frame(reader)
+                reply = self.on_message(op, source, body)
+                if op == OP_REQUEST:
+                    after = self.reply_after(body, reply) if self.reply_after and reply else None
+                    reply = reply or b''
+                    await outbox.put(HEADER.pack(len(reply), OP_REPLY, self.worker_id, request_id) + reply, after)
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_replies(self, reader):
+        # Outbound connection: replies to our requests
+        try:
+            while True:
+                op, source, request_id, body = await self.read_frame(reader)
+                reply = self.pending.pop(request_id, None)
+                if reply is not None and not reply.done():
+                    reply.set_result(body or None)
+        except asyncio.IncompleteReadError:
+            for reply in self.pending.values():
+                if not reply.done():
+                    reply.set_exception(ConnectionError("peer worker went away"))
+
+    async def connect(self, worker_id):
+        path = socket_path(self.port, worker_id)
+        for _ in range(CONNECT_ATTEMPTS):
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(CONNECT_RETRY)
+        else:
+            raise ConnectionError(f"worker {worker_id} is not listening on {path}")
+        self.spawn(self.read_replies(reader))
+        return writer
+
+    async def writer(self, worker_id):
+        if worker_id not in self.outbound:
+            self.outbound[worker_id] = asyncio.ensure_future(self.connect(worker_id))
+        return await self.outbound[worker_id]
+
+    def send_request(self, writer, body):
+        request_id = self.next_request
+        self.next_request = (self.next_request + 1) & 0xFFFFFFFF
+        reply = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = reply
+        writer.write(HEADER.pack(len(body), OP_REQUEST, self.worker_id, request_id) + body)
+        return reply
+
+    async def request(self, worker_id, body):
+        writer = await self.writer(worker_id)
+        reply = self.send_request(writer, body)
+        await writer.drain()
+        return await reply
+
+    def request_nowait(self, worker_id, body):
+        # Sends the request before returning and returns the future for its
+        # reply, or None if the link is not up yet or has too much unsent
+        # (then use request(), which waits for both)
+        connected = self.outbound.get(worker_id)
+        if connected is None or not connected.done() or connected.cancelled() or connected.exception():
+            return None
+        writer = connected.result()
+        if writer.transport.get_write_buffer_size() > BACKLOG_BYTES:
+            return None
+        return self.send_request(writer, body)
+
+    async def notify(self, worker_id, op, body):
+        writer = await self.writer(worker_id)
+        writer.write(HEADER.pack(len(body), op, self.worker_id, 0) + body)
+        await writer.drain()
@@ -0,0 +1,62 @@
+import asyncio
+from codec import *
+from main import Backend
+
+# Regression checks for Backend.read_frames(): a frame from the relay has to
+# reach incoming or the future waiting for it, and never both.
+# Run with `python -m pytest test_read_frames.py`.
+
+
+class Frames:
+    # Stands in for the websocket: yields the given frames, then ends
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __aiter__(self):
+        return self.frames_iter()
+
+    async def frames_iter(self):
+        for frame in self.frames:
+            yield frame
+
+
+def read(frames, tags=()):
+    # Runs read_frames() over frames with replies pending for tags; returns
+    # what reached incoming and {tag: reply frame or None}
+    async def run():
+        backend = Backend()
+        backend.websocket = Frames(frames)
+        backend.incoming = asyncio.Queue()
+        replies = {}
+        for tag in tags:
+            replies[tag] = backend.unacked[tag] = asyncio.get_running_loop().create_future()
+        await backend.read_frames()
+        incoming = []
+        while (frame := backend.incoming.get_nowait()) is not None:
+            incoming.append(frame)
+        return incoming, {tag: reply.result() if reply.done() and not reply.cancelled() else None
+                          for tag, reply in replies.items()}
+    return asyncio.run(run())
+
+
+def test_empty_message_is_delivered():
+    # Five bytes like a tagged reply, with the "tag" 3 << 8 of its sender
+    deliver = data_frame(DELIVER, 7, 3, b'')
+    ack = tagged(POSITIVEACK_REPLIES[7], TAG.pack(3 << 8))
+    incoming, replies = read([deliver, ack], tags=[3 << 8])
+    assert incoming == [deliver]
+    assert replies == {3 << 8: ack}
+
+
+def test_empty_getresponse_is_delivered():
+    response = data_frame(GETRESPONSE, 7, 3, b'')
+    incoming, replies = read([response], tags=[3 << 8])
+    assert incoming == [response]
+    assert replies == {3 << 8: None}
+
+
+def test_tagged_error_reply():
+    error = tagged(UNKNOWNERROR_REPLIES[7], TAG.pack(5))
+    incoming, replies = read([error], tags=[5])
+    assert incoming == []
+    assert replies == {5: error}
@@ -1,114 +1,469 @@
 import asyncio
+import argparse
+import multiprocessing
+import os
+import signal
 import websockets
-from collections import defaultdict
-import struct
+from mailboxes import MailboxStore, MAILBOX_LIMIT, MEMORY_LIMIT, IDLE_TIMEOUT
+from codec import *
+from relaylog import log, setup_logging, PacketTrace, LOG_LEVEL, TRACE_SIZE, TRACE_SAMPLE
+from journal import Journal, Outbox, COMMIT_INTERVAL
+from shards import ShardLinks, shard_of, OP_REQUEST, OP_NOTIFY, OP_DISASSOCIATE, OP_DELIVER, OP_RETURN
+from metrics import RateLimiter, LagProbe, MetricsServer, histogram, RATE_LIMIT, RATE_BURST
+
+PORT = 12345
+SWEEP_INTERVAL = 30  # seconds between idle mailbox sweeps
+
+# Sharding: with --workers N the relay runs N processes accepting on the same
+# port (SO_REUSEPORT) and client id c is owned by worker c % N. The owner keeps
+# c's mailbox, push credits and which worker c is connected to. The worker that
+# holds c's websocket forwards c's packets to the owner over a unix socket (a
+# PUSH goes to the receiver's owner) and the owner sends DELIVER frames back.
+# With one worker everything below stays in-process.
+worker_id = 0
+workers = 1
+links = None  # ShardLinks to the other workers
 
 # Store client sessions and message buffers
-sessions = {}  # {client_id: websocket}
-buffers = defaultdict(list)  # {client_id: [messages]}
+sessions = {}  # {client_id: websocket}, clients connected to this worker
+registry = {}  # {client_id: worker it is connected to}, for ids this worker owns
+store = MailboxStore()  # {client_id: deque of (sender_id, payload)} with a global memory cap
+trace = PacketTrace()  # recent packets, disabled unless --trace-size is given
+credits = {}  # {client_id: push credits left}, only for clients that sent SUBSCRIBE
+delivering = {}  # {client_id: task running deliver()}
+background = set()  # other fire-and-forget tasks
+metrics_port = None  # --metrics-port
+refused = {}  # {(sender id, receiver id, message id): True} fragments refused since the last answered one
+limiter = RateLimiter()  # token bucket per sender, for senders connected to this worker
+lag = LagProbe()
+REFUSED_LIMIT = 4096  # oldest entries are forgotten past this
 
 # Packet structure:
 # MANAGEMENT packet: 3 bytes (type: 1 byte, message: 1 byte, id: client_id)
 # CONTROL packet: 3 bytes (type: 1 byte, message: 1 byte, id: client_id)
 # DATA packet: 5 bytes (type: 1 byte, message: 1 byte, id: 1 byte, id2: 1 byte, length: 1 byte) + variable-length payload
+#
+# Push delivery:
+# CONTROL/SUBSCRIBE (1, 4): 4 bytes (type, message, id, credits) grants the server
+# `credits` more messages it may push without being asked. The client sends it
+# again as it consumes messages, so a slow client is never flooded.
+# DATA/DELIVER (2, 2): same layout as GETRESPONSE, sent by the server as soon as
+# a message is buffered for a subscribed client.
+#
+# Batched GET:
+# CONTROL/GETBATCH (1, 5): 6 bytes (type, message, id, max count: 1 byte, max bytes: 2 bytes)
+# DATA/BATCHRESPONSE (2, 3): 4 bytes (type, message, id, count) followed by `count`
+# entries of (sender id: 1 byte, length: 1 byte) + payload. At least one message is
+# returned even if it alone is over the byte budget. BUFFEREMPTY if nothing is queued.
+#
+# Tagged PUSH:
+# DATA/TAGGEDPUSH (2, 4): 7 bytes (type, message, id, id2, tag: 2 bytes, length) + payload.
+# Handled like a PUSH, but its reply (POSITIVEACK, BUFFERFULL, ...) carries the
+# tag as 2 more bytes. Replies to tagged PUSHes may come back in any order, so a
+# client can keep many in flight and match each reply by its tag.
+#
+# Fragments (messages over 254 bytes):
+# DATA/FRAGMENT (2, 5): 13 bytes (type, message, id, id2, tag: 2 bytes, message id: 2 bytes,
+# index: 2 bytes, count: 2 bytes, length: 1 byte) + up to 254 bytes of data.
+# The server queues every fragment as a mailbox entry of its own, it never
+# reassembles. Only fragments whose tag is not 0xFFFF are answered, like a tagged
+# PUSH; the answer is BUFFERFULL if any fragment of that message was refused
+# since the last answered one, so a sender needs one reply per window of fragments.
+# A queued fragment goes out in GETRESPONSE / DELIVER / BATCHRESPONSE with the
+# length byte set to 255, followed by (message id: 2 bytes, index: 2 bytes,
+# count: 2 bytes, length: 1 byte) + data. The client reassembles.
+#
+# Rate limiting (--rate-limit):
+# CONTROL/RATELIMITED (1, 6) answers a PUSH, tagged PUSH or fragment from a
+# sender that is over its rate, with the tag appended for tagged packets. The
+# message is not queued. An unanswered fragment that is over the rate makes
+# the reply to the next answered fragment of the same message RATELIMITED, and
+# the fragments of that message in between are refused as well.
+
+
+async def send(websocket, frame):
+    if trace.enabled:
+        trace.record(">", frame)
+    await websocket.send(frame)
+
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background.add(task)
+    task.add_done_callback(background.discard)
+
+
+def start_delivery(client_id):
+    # Only one deliver() runs per client so messages go out in buffer order
+    if client_id not in delivering:
+        delivering[client_id] = asyncio.create_task(deliver(client_id))
+
+
+async def deliver(client_id):
+    # Push buffered messages to a subscribed client while it has credits left
+    try:
+        while credits.get(client_id, 0) > 0 and store.depth(client_id) and client_id in registry:
+            entry = store.pop(client_id)
+            credits[client_id] -= 1
+            sender_id, payload = entry
+            response = data_frame(DELIVER, client_id, sender_id, payload)
+            host = registry[client_id]
+            if host != worker_id:
+                await links.notify(host, OP_DELIVER, response)
+                continue
+            try:
+                await send(sessions[client_id], response)
+            except (KeyError, websockets.exceptions.ConnectionClosed):
+                # Receiver went away, keep the message for its next session
+                store.pushback(client_id, entry)
+                break
+    finally:
+        del delivering[client_id]
+
+
+async def deliver_local(source, frame):
+    # DELIVER frame from the owner of a client connected to this worker
+    try:
+        await send(sessions[frame[2]], frame)
+    except (KeyError, websockets.exceptions.ConnectionClosed):
+        await links.notify(source, OP_RETURN, frame)
+
+
+def disassociate(client_id, host):
+    if registry.get(client_id) == host:
+        del registry[client_id]
+        credits.pop(client_id, None)
+
+
+NEEDS_SESSION = {(CONTROL, GET), (CONTROL, SUBSCRIBE), (CONTROL, GETBATCH), (DATA, PUSH), (DATA, TAGGEDPUSH), (DATA, FRAGMENT)}
+DATA_HEADERS = {PUSH: DATA_HEADER.size, TAGGEDPUSH: TAGGED_HEADER.size, FRAGMENT: FRAGMENT_HEADER.size}
+
+
+def handle_packet(message, host):
+    # Runs on the worker owning the id the packet is about (the receiver for a
+    # PUSH). `host` is the worker the client sending it is connected to, and
+    # that worker has already checked the client is associated.
+    # Returns the reply frame for the client, or None.
+    packet_type = message[0]  # First byte is the packet type
+    packet_message = message[1]  # Second byte is the message type
+    client_id = message[2]  # Extract id (1 byte)
+
+    if packet_type == MANAGEMENT and packet_message == ASSOCIATE:
+        if client_id in registry:
+            return UNKNOWNERROR_REPLIES[client_id]
+        registry[client_id] = host
+        store.associate(client_id)
+        return ASSOCIATIONSUCCESS_REPLIES[client_id]
+
+    elif packet_type == CONTROL and packet_message == GET:
+        if not store.depth(client_id):
+            return BUFFEREMPTY_REPLIES[client_id]
+        sender_id, payload = store.pop(client_id)
+        return data_frame(GETRESPONSE, client_id, sender_id, payload)
+
+    elif packet_type == CONTROL and packet_message == GETBATCH:
+        if len(message) != GETBATCH_PACKET.size:
+            return UNKNOWNERROR_REPLIES[client_id]
+        if not store.depth(client_id):
+            return BUFFEREMPTY_REPLIES[client_id]
+        _, _, _, max_count, max_bytes = GETBATCH_PACKET.unpack(message)
+        entries = []
+        size = 0
+        while store.depth(client_id) and len(entries) < max(max_count, 1):
+            sender_id, payload = store.peek(client_id)
+            if entries and size + len(payload) + ENTRY_HEADER.size * (len(entries) + 1) > max_bytes:
+                break
+            entries.append(store.pop(client_id))
+            size += len(payload)
+        return batch_frame(client_id, entries, size)
+
+    elif packet_type == CONTROL and packet_message == SUBSCRIBE:
+        if len(message) != SUBSCRIBE_PACKET.size:
+            return UNKNOWNERROR_REPLIES[client_id]
+        credits[client_id] = credits.get(client_id, 0) + message[3]
+        start_delivery(client_id)
+        return None
+
+    elif packet_type == DATA and packet_message in (PUSH, TAGGEDPUSH):
+        if packet_message == PUSH:
+            receiver_id, payload = data_payload(message)  # payload is a view, no copy
+            tag = None
+            length = message[4]
+        else:
+            receiver_id, tag, payload = tagged_payload(message)
+            length = message[6]
+        if length >= 255 or length != len(payload):
+            return tagged(UNKNOWNERROR_REPLIES[client_id], tag)
+        if not store.push(receiver_id, client_id, payload):  # Buffer size and memory limit
+            return tagged(BUFFERFULL_REPLIES[client_id], tag)
+        if receiver_id in credits:
+            # Receiver is subscribed, hand it over right away
+            start_delivery(receiver_id)
+        return tagged(POSITIVEACK_REPLIES[client_id], tag)
+
+    elif packet_type == DATA and packet_message == FRAGMENT:
+        receiver_id, tag, payload = fragment_body(message)
+        message_id, index, count, length = FRAGMENT_INFO.unpack_from(payload)
+        if length != len(payload) - FRAGMENT_INFO.size or index >= count:
+            return None if tag == NO_REPLY_TAG else tagged(UNKNOWNERROR_REPLIES[client_id], tag)
+        key = (client_id, receiver_id, message_id)
+        if not store.push(receiver_id, client_id | FRAGMENT_FLAG, payload):
+            refused[key] = True
+            if len(refused) > REFUSED_LIMIT:
+                del refused[next(iter(refused))]
+        elif receiver_id in credits:
+            start_delivery(receiver_id)
+        if tag == NO_REPLY_TAG:
+            return None
+        if refused.pop(key, False):
+            return tagged(BUFFERFULL_REPLIES[client_id], tag)
+        return tagged(POSITIVEACK_REPLIES[client_id], tag)
+
+    return UNKNOWNERROR_REPLIES[client_id]
+
+
+def commit_for(message, response):
+    # With a journal, a POSITIVEACK may only go out once the message is on disk.
+    # Only for PUSHes stored here, a forwarded one was committed by its owner.
+    if store.journal is not None and response[0] == CONTROL and response[1] == POSITIVEACK and shard_of(message[3], workers) == worker_id:
+        return store.journal.commit()
+    return None
+
+
+def on_peer_message(op, source, body):
+    if op == OP_REQUEST:
+        return handle_packet(body, source)
+    elif op == OP_NOTIFY:
+        handle_packet(body, source)
+    elif op == OP_DISASSOCIATE:
+        disassociate(body[0], source)
+    elif op == OP_DELIVER:
+        spawn(deliver_local(source, body))
+    elif op == OP_RETURN:
+        store.pushback(body[2], data_payload(body))
+    return None
+
+
+async def forward(owner_id, message):
+    # Hand a packet to the worker owning `owner_id`, returns its reply frame
+    shard = shard_of(owner_id, workers)
+    if shard == worker_id:
+        return handle_packet(message, worker_id)
+    if message[0] == CONTROL and message[1] == SUBSCRIBE:  # no reply
+        await links.notify(shard, OP_NOTIFY, message)
+        return None
+    return await links.request(shard, message)
+
+
+async def forwarded_reply(client_id, reply):
+    # The reply to a plain PUSH sent on with request_nowait()
+    try:
+        return await reply
+    except ConnectionError as e:
+        log.warning("Forwarding for client %s failed: %s", client_id, e)
+        return UNKNOWNERROR_REPLIES[client_id]
+
+
+async def reply_when_forwarded(outbox, message):
+    # A tagged PUSH or fragment for another worker: its reply (if any) goes
+    # out whenever it comes back, without holding up the packets read after it
+    response = await forward(message[3], message)
+    if response is not None:
+        await outbox.put(response)
+
+
+def over_rate_limit(client_id, message, over_rate):
+    # Whether the rate limiter refuses a PUSH, tagged PUSH or fragment. Once
+    # one fragment of a message is refused, the rest up to its next answered
+    # fragment are refused too, without spending tokens, and that answer says
+    # so. Messages are told apart in `over_rate` as fragments of several may
+    # arrive interleaved.
+    if message[1] != FRAGMENT:
+        return not limiter.allow(client_id)
+    key = (message[3], message[6:8])
+    if key in over_rate:
+        limiter.limited += 1
+    elif limiter.allow(client_id):
+        return False
+    if message[4:6] == NO_REPLY_TAG:
+        over_rate[key] = True
+        if len(over_rate) > REFUSED_LIMIT:
+            del over_rate[next(iter(over_rate))]
+    else:
+        over_rate.pop(key, None)
+    return True
 
 
 async def handle_connection(websocket):
-    print("New client connected")
+    log.info("New client connected: %s", websocket.remote_address)
     client_id = None
+    associated_id = None
+    outbox = Outbox(lambda frame: send(websocket, frame))
+    over_rate = {}  # {(receiver id, message id): True} messages with a fragment refused by the rate limiter since their last answered one
     try:
         async for message in websocket:
+            if trace.enabled:
+                trace.record("<", message)
             # Parse the packet type and message
             packet_type = message[0]  # First byte is the packet type
             packet_message = message[1]  # Second byte is the message type
+            client_id = message[2]  # Extract id (1 byte)
 
-            if packet_type == 0:  # MANAGEMENT packet
-                if packet_message == 0:  # ASSOCIATE
-                    print("Received raw message:", message)
-                    client_id = message[2]  # Extract id (1 byte)
-                    if client_id in sessions:
-                        response = struct.pack('!BBB', 0, 3, client_id)  # UNKNOWNERROR
-                        print("Raw response:", response)
-                        await websocket.send(response)
-                        #await websocket.close()  # Forcefully close the new connection
-                    else:
-                        sessions[client_id] = websocket
-                        response = struct.pack('!BBB', 0, 1, client_id)  # ASSOCIATIONSUCCESS
-                        print("Raw response:", response)
-                        await websocket.send(response)
-                else:
-                    print("Received raw message:", message)
-                    client_id = message[2]  # Extract id (1 byte)
-                    response = struct.pack('!BBB', 0,3,client_id) # UNKNOWNERROR
-                    print("Raw response:", response)
-                    await websocket.send(response)
-                    
-            elif packet_type == 1:  # CONTROL packet
-                if packet_message == 0:  # GET
-                    print("Received raw message:", message)
-                    client_id = message[2]  # Extract id (1 byte)
-                    if client_id not in sessions:
-                        response = struct.pack('!BBB', 0, 2, client_id)  # ASSOCIATIONFAILED
-                        print("Raw response:", response)
-                    elif not buffers[client_id]:
-                        response = struct.pack('!BBB', 1, 1, client_id)  # BUFFEREMPTY
-                        print("Raw response:", response)
-                    else:
-                        message_payload = buffers[client_id].pop(0)
-                        sender_id = message_payload[0]
-                        message_payload = message_payload[3:]
-                        response = struct.pack('!BBBBB', 2, 0, client_id, sender_id, len(message_payload)) + message_payload  # GETRESPONSE
-                        print("Raw response:", response)
-                    await websocket.send(response)
-                else:
-                    print("Received raw message:", message)
-                    client_id = message[2]  # Extract id (1 byte)
-                    response = struct.pack('!BBB', 0,3,client_id) # UNKNOWNERROR
-                    print("Raw response:", response)
-                    await websocket.send(response)
-
-            elif packet_type == 2:  # DATA packet
-                if packet_message == 1:  # PUSH
-                    client_id = message[2]  # Extract id (1 byte)
-                    print("Received raw message:", message)
-                    if client_id not in sessions:
-                        response = struct.pack('!BBB', 0, 2, client_id)  # ASSOCIATIONFAILED
-                    else:
-                        receiver_id = message[3]  # Extract receiver_id (1 bytes)
-                        length = message[4] 
-                        payload = message[5:]  # Extract payload (variable length)
-                        if length < 255:
-                            if length == len(payload):
-                                if len(buffers[receiver_id]) < 100:  # Buffer size limit
-                                    buffers[receiver_id].append(message[2:])
-                                    response = struct.pack('!BBB', 1, 2, client_id)  # POSITIVEACK
-                                else:
-                                    response = struct.pack('!BBB', 1, 3, client_id)  # BUFFERFULL
-                            else:
-                                response = struct.pack('!BBB', 0,3,client_id) # UNKNOWNERROR
+            if packet_type == MANAGEMENT and packet_message == ASSOCIATE:
+                response = await forward(client_id, message)
+                if response[1] == ASSOCIATIONSUCCESS:
+                    sessions[client_id] = websocket
+                    associated_id = client_id
+            elif (packet_type, packet_message) in NEEDS_SESSION:
+                if client_id not in sessions:
+                    response = ASSOCIATIONFAILED_REPLIES[client_id]
+                elif packet_type == DATA:
+                    if len(message) < DATA_HEADERS[packet_message]:
+                        response = UNKNOWNERROR_REPLIES[client_id]
+                    elif limiter.enabled and over_rate_limit(client_id, message, over_rate):
+                        if packet_message == PUSH:
+                            response = RATELIMITED_REPLIES[client_id]
+                        elif packet_message == FRAGMENT and message[4:6] == NO_REPLY_TAG:
+                            response = None
                         else:
-                            response = struct.pack('!BBB', 0,3,client_id) # UNKNOWNERROR
-                        print("Raw response:", response)
-                        await websocket.send(response)
+                            response = tagged(RATELIMITED_REPLIES[client_id], message[4:6])
+                    elif (shard := shard_of(message[3], workers)) == worker_id:
+                        response = handle_packet(message, worker_id)
+                    elif packet_message != PUSH:
+                        spawn(reply_when_forwarded(outbox, message))
+                        continue
+                    elif (reply := links.request_nowait(shard, message)) is not None:
+                        # The receiver's owner keeps its mailbox. The reply
+                        # keeps its place among this client's replies while
+                        # the packets after it are read.
+                        outbox.put_pending(asyncio.ensure_future(forwarded_reply(client_id, reply)))
+                        continue
+                    else:
+                        # First packet for that worker, or its link is backed up
+                        response = await forward(message[3], message)
                 else:
-                    print("Received raw message:", message)
-                    client_id = message[2]  # Extract id (1 byte)
-                    response = struct.pack('!BBB', 0,3,client_id) # UNKNOWNERROR
-                    print("Raw response:", response)
-                    await websocket.send(response)
+                    response = await forward(client_id, message)
+            else:
+                response = UNKNOWNERROR_REPLIES[client_id]
+
+            if response is not None:
+                await outbox.put(response, commit_for(message, response))
 
     except Exception as e:
-        print(f"Error: {e}")
+        log.warning("Error on client %s: %s", client_id, e)
     finally:
-        if client_id in sessions:
-            del sessions[client_id]
-        print("Client disconnected")
+        if associated_id is not None and sessions.get(associated_id) is websocket:
+            del sessions[associated_id]
+            shard = shard_of(associated_id, workers)
+            if shard == worker_id:
+                disassociate(associated_id, worker_id)
+            else:
+                await links.notify(shard, OP_DISASSOCIATE, bytes([associated_id]))
+        log.info("Client %s disconnected", client_id)
 
-async def start_server():
-    async with websockets.serve(handle_connection, '', 12345):
-        print("WebSocket server started on ws://localhost:12345")
-        await asyncio.Future()  # Run forever
+def collect_metrics():
+    labels = {"worker": worker_id}
+    stats = store.stats()
+    def counter(name, help_text, value):
+        return (name, "counter", help_text, [(name, labels, value)])
+    def gauge(name, help_text, value):
+        return (name, "gauge", help_text, [(name, labels, value)])
+    metrics = [
+        gauge("relay_connections", "Clients connected to this worker", len(sessions)),
+        gauge("relay_mailboxes", "Receivers with queued messages", stats["mailboxes"]),
+        gauge("relay_messages_held", "Messages queued", stats["messages_held"]),
+        gauge("relay_bytes_held", "Bytes charged against the memory limit", stats["bytes_held"]),
+        histogram("relay_mailbox_depth", "Queued messages per receiver", map(len, store.mailboxes.values()), labels),
+        counter("relay_pushed_total", "Messages queued", stats["pushed"]),
+        counter("relay_popped_total", "Messages handed out by GET, GETBATCH or push delivery", stats["popped"]),
+        counter("relay_rejected_full_total", "PUSHes refused for a full mailbox", stats["rejected_full"]),
+        counter("relay_rejected_memory_total", "PUSHes refused for the memory limit", stats["rejected_memory"]),
+        counter("relay_evicted_messages_total", "Messages dropped with an evicted mailbox", stats["evicted_messages"]),
+        counter("relay_rate_limited_total", "PUSHes and fragments refused by the rate limiter", limiter.limited),
+        gauge("relay_event_loop_lag_seconds", "Latest event loop lag", lag.last),
+        gauge("relay_event_loop_lag_max_seconds", "Highest event loop lag since the previous scrape", lag.max),
+    ]
+    lag.max = lag.last
+    return metrics
+
+
+async def sweep_mailboxes():
+    # Periodically drop mailboxes of ids that never associated
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        store.evict_idle()
+        log.info("Mailboxes: %s", store.stats())
+
+async def start_server(port):
+    global links
+    if store.journal is not None:
+        recovered = store.recover()
+        log.warning("Recovered %d queued messages from %s", recovered, store.journal.root)
+    if workers > 1:
+        links = ShardLinks(port, worker_id, on_peer_message, commit_for)
+        await links.start()
+    if metrics_port is not None:
+        # One endpoint per worker
+        await MetricsServer(metrics_port + worker_id, collect_metrics).start()
+        spawn(lag.run())
+    async with websockets.serve(handle_connection, '', port, reuse_port=workers > 1):
+        if worker_id == 0:
+            print(f"WebSocket server started on ws://localhost:{port} with {workers} worker(s)")
+        if trace.enabled:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, trace.dump)
+        await sweep_mailboxes()  # Run forever
+
+def run_worker(index, args):
+    global worker_id, workers, store, trace, limiter, metrics_port
+    worker_id = index
+    workers = args.workers
+    journal = None
+    if args.journal:
+        # Ids are sharded by id % workers, so restart with the same --workers
+        journal = Journal(os.path.join(args.journal, f"worker-{index}-of-{workers}"), args.commit_interval)
+    store = MailboxStore(args.mailbox_limit, args.memory_limit, args.idle_timeout, journal)
+    trace = PacketTrace(args.trace_size, args.trace_sample)
+    limiter = RateLimiter(args.rate_limit, args.rate_burst)
+    metrics_port = args.metrics_port
+    setup_logging(args.log_level)
+    try:
+        asyncio.run(start_server(args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if journal is not None:
+            journal.close()
 
-# Run the server
-asyncio.run(start_server())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Messenger relay server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=1, help="processes sharing the port, client ids are sharded across them")
+    parser.add_argument("--mailbox-limit", type=int, default=MAILBOX_LIMIT, help="messages queued per receiver")
+    parser.add_argument("--memory-limit", type=int, default=MEMORY_LIMIT, help="bytes held across all receivers (per worker)")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="seconds before an unclaimed mailbox is evicted")
+    parser.add_argument("--journal", metavar="DIR", help="keep queued messages in an append-only log under DIR so they survive restarts")
+    parser.add_argument("--commit-interval", type=float, default=COMMIT_INTERVAL, help="least seconds between the starts of two journal commits")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="DEBUG, INFO, WARNING, ...")
+    parser.add_argument("--trace-size", type=int, default=TRACE_SIZE, help="packets kept in the trace ring buffer (dumped on SIGUSR1)")
+    parser.add_argument("--trace-sample", type=float, default=TRACE_SAMPLE, help="fraction of traced packets logged at DEBUG")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port (+ worker index)")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT, help="messages/s each sender may push, 0 for no limit")
+    parser.add_argument("--rate-burst", type=float, default=RATE_BURST, help="messages a sender may push at once")
+    args = parser.parse_args()
 
+    # Run the server
+    if args.workers <= 1:
+        args.workers = 1
+        run_worker(0, args)
+    else:
+        processes = [multiprocessing.Process(target=run_worker, args=(k, args), name=f"worker-{k}") for k in range(args.workers)]
+        for p in processes:
+            p.start()
+        # Stop the workers along with this process on SIGTERM too
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            for p in processes:
+                p.join()
+        except KeyboardInterrupt:
+            for p in processes:
+                p.terminate()
@@ -1,7 +1,12 @@
+import argparse
 import socket
 import time
 import struct
 import threading
+from congestion import ALGORITHMS, DEFAULT_CC
+from gbn import GoBackNSender, SEQ, WINDOW, MAX_WINDOW, DUPACK_THRESHOLD
+from sack import unpack_ack
+from selective import SelectiveRepeatSender
 
 DEBUG = 1
 TOTAL_PACKETS = 10000
@@ -14,87 +19,68 @@ CLIENT_IP = "127.0.0.1"
 CLIENT_PORT = 8000
 
 lock = threading.Lock()
-
-# Create UDP socket
-client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-# hope processing + RTT will not be greater than this 
-client_socket.settimeout(10.0)
-client_socket.bind((CLIENT_IP, CLIENT_PORT))
+packets_sent = 0
 
 # Send function
 def send_pckt(id):
+    global packets_sent
     payload = struct.pack("!I", id)
     client_socket.sendto(payload, (SERVER_IP, SERVER_PORT))
+    packets_sent += 1
     return id+1
 
-# Find out the parameters
-# First I will send and receive ack for 0, becaus thats the only weird case for which ack is not sent
-N = 0
-curr_seq = 0
-latest_recv = -1
-
-if DEBUG:  print("sending 0...")
-sent_zero = time.time()
-start = time.time()
-curr_seq = send_pckt(curr_seq)
-RTT = 0.1 # Default values
-service_time = 0.1 # Default values
-while True:
-    try:
-        packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-        got_zero = time.time()
-        RTT = got_zero - sent_zero
-    except Exception as e:
-        # The -1 ack problem 
-        sent_zero = time.time()
-        curr_seq=latest_recv+1
-        curr_seq = send_pckt(curr_seq)
-        continue
-    latest_recv+=1
-    break
-
-# Now find RTT and Service time
-# Send 10 packets and hope atleast 2 will return
-# RTT will be the time of first ack
-# Service time will be time of second ack - RTT
-
-t1 = time.time()
-for i in range(6):
-    if DEBUG: print("sending " ,curr_seq)
+def report(total, elapsed):
+    print(f"Time taken to send {total} packets = ", elapsed)
+    print("Throughput = ", total/elapsed)
+    print("Packets sent = ", packets_sent)
+    print("Retransmissions = ", packets_sent - total)
+
+# Original sender: probe RTT and service time once, then send at that fixed rate
+def rate_sender():
+    # Find out the parameters
+    # First I will send and receive ack for 0, becaus thats the only weird case for which ack is not sent
+    N = 0
+    curr_seq = 0
+    latest_recv = -1
+
+    if DEBUG:  print("sending 0...")
+    sent_zero = time.time()
+    start = time.time()
     curr_seq = send_pckt(curr_seq)
+    RTT = 0.1 # Default values
+    service_time = 0.1 # Default values
+    while True:
+        try:
+            packet, _ = client_socket.recvfrom(BUFFER_SIZE)
+            got_zero = time.time()
+            RTT = got_zero - sent_zero
+        except Exception as e:
+            # The -1 ack problem 
+            sent_zero = time.time()
+            curr_seq=latest_recv+1
+            curr_seq = send_pckt(curr_seq)
+            continue
+        latest_recv+=1
+        break
 
-# recv first ack
-try:
-    packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-except Exception as _:
-    if DEBUG: print("packet 1 not received!")
-    pass
-t2 = time.time()
-first_delay = t2 - got_zero
-# handle this packet
-ack_num = struct.unpack("!I", packet)[0]
-# print(ack_num)
-if(ack_num == latest_recv+1):
-    latest_recv+=1
-elif(ack_num < latest_recv):
-    print("this should not happen.")
-elif(ack_num == latest_recv):
-    curr_seq=ack_num+1
-elif(ack_num > latest_recv+1):
-    print("this should not happen.")
-
-if first_delay > RTT*1.01:
-    service_time = first_delay
-    
-else:
-    # recv second ack
+    # Now find RTT and Service time
+    # Send 10 packets and hope atleast 2 will return
+    # RTT will be the time of first ack
+    # Service time will be time of second ack - RTT
+
+    t1 = time.time()
+    for i in range(6):
+        if DEBUG: print("sending " ,curr_seq)
+        curr_seq = send_pckt(curr_seq)
+
+    # recv first ack
     try:
         packet, _ = client_socket.recvfrom(BUFFER_SIZE)
     except Exception as _:
-        if DEBUG: print("packet 2 not received!")
+        if DEBUG: print("packet 1 not received!")
         pass
-    t3 = time.time()
-    service_time = t3 - t2
+    t2 = time.time()
+    first_delay = t2 - got_zero
     # handle this packet
     ack_num = struct.unpack("!I", packet)[0]
     # print(ack_num)
@@ -106,77 +92,164 @@ else:
         curr_seq=ack_num+1
     elif(ack_num > latest_recv+1):
         print("this should not happen.")
-    
 
-# handle rest of the acks
-for i in range(4):
-    try:
-        packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-    except Exception as e:
-        if DEBUG: print("packet not recieved!")
-        break
-    ack_num = struct.unpack("!I", packet)[0]
-    print(f"ack for packet {ack_num} received!")
-    curr_seq = ack_num + 1
-    latest_recv = ack_num
+    if first_delay > RTT*1.01:
+        service_time = first_delay
     
-
-print(f"Calculated RTT: {RTT}, service_time: {service_time}")
-
-# updating timeout value to a better estimate
-client_socket.settimeout((RTT+service_time)*1.1)
-# Function to send packets every service_time time
-def spam():
-    global curr_seq
-    global latest_recv
-    while latest_recv < TOTAL_PACKETS:
-        with lock:
-            curr_seq = send_pckt(curr_seq)
-        # print("sending ", curr_seq)
-        time.sleep(service_time)
-
-p = threading.Thread(target=spam, daemon=False)
-p.start()
-
-last_recv_arr = [0.0 for _ in range(10100)] # Time of last ack received for any packet sent
-def update():
-    # Process rest of the packets
-    global curr_seq
-    global latest_recv
-    global last_recv_arr
-    while latest_recv < TOTAL_PACKETS:
+    else:
+        # recv second ack
         try:
             packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-        except Exception as e:
-            # Buffer full 
-            with lock: 
-                curr_seq=latest_recv+1
+        except Exception as _:
+            if DEBUG: print("packet 2 not received!")
+            pass
+        t3 = time.time()
+        service_time = t3 - t2
+        # handle this packet
         ack_num = struct.unpack("!I", packet)[0]
-        # print(ack_num, curr_seq - latest_recv - 1)
+        # print(ack_num)
         if(ack_num == latest_recv+1):
-            # Ideal case: Send the next in line
             latest_recv+=1
         elif(ack_num < latest_recv):
             print("this should not happen.")
         elif(ack_num == latest_recv):
-            # this happens when at least the latest_recv+1 gets dropped
-            # and some other pckt > latest_recv+1 was acked
-            # NOTE: We want to resend a number only the first time we receive an ack for it,
-            # Unless it has actually been dropped twice
-            # i.e. it has been more than an RTT since the last ack
-            curr_time = time.time()
-            if curr_time > last_recv_arr[ack_num+1] + RTT:
-                last_recv_arr[ack_num+1] = curr_time
-                with lock:
-                    curr_seq=ack_num+1
+            curr_seq=ack_num+1
         elif(ack_num > latest_recv+1):
             print("this should not happen.")
-t = threading.Thread(target=update, daemon=False)
-t.start()
-
-# Wait for threads to join
-p.join()
-t.join()
-end = time.time()
-print(f"Time taken to send {TOTAL_PACKETS} packets = ", (end - start))
-print("Throughput = ", TOTAL_PACKETS/(end-start))
+    
+
+    # handle rest of the acks
+    for i in range(4):
+        try:
+            packet, _ = client_socket.recvfrom(BUFFER_SIZE)
+        except Exception as e:
+            if DEBUG: print("packet not recieved!")
+            break
+        ack_num = struct.unpack("!I", packet)[0]
+        print(f"ack for packet {ack_num} received!")
+        curr_seq = ack_num + 1
+        latest_recv = ack_num
+    
+
+    print(f"Calculated RTT: {RTT}, service_time: {service_time}")
+
+    # updating timeout value to a better estimate
+    client_socket.settimeout((RTT+service_time)*1.1)
+    # Function to send packets every service_time time
+    def spam():
+        nonlocal curr_seq
+        nonlocal latest_recv
+        while latest_recv < TOTAL_PACKETS:
+            with lock:
+                curr_seq = send_pckt(curr_seq)
+            # print("sending ", curr_seq)
+            time.sleep(service_time)
+
+    p = threading.Thread(target=spam, daemon=False)
+    p.start()
+
+    last_recv_arr = [0.0 for _ in range(TOTAL_PACKETS + 100)] # Time of last ack received for any packet sent
+    def update():
+        # Process rest of the packets
+        nonlocal curr_seq
+        nonlocal latest_recv
+        while latest_recv < TOTAL_PACKETS:
+            try:
+                packet, _ = client_socket.recvfrom(BUFFER_SIZE)
+            except Exception as e:
+                # Buffer full 
+                with lock: 
+                    curr_seq=latest_recv+1
+            ack_num = struct.unpack("!I", packet)[0]
+            # print(ack_num, curr_seq - latest_recv - 1)
+            if(ack_num == latest_recv+1):
+                # Ideal case: Send the next in line
+                latest_recv+=1
+            elif(ack_num < latest_recv):
+                print("this should not happen.")
+            elif(ack_num == latest_recv):
+                # this happens when at least the latest_recv+1 gets dropped
+                # and some other pckt > latest_recv+1 was acked
+                # NOTE: We want to resend a number only the first time we receive an ack for it,
+                # Unless it has actually been dropped twice
+                # i.e. it has been more than an RTT since the last ack
+                curr_time = time.time()
+                if curr_time > last_recv_arr[ack_num+1] + RTT:
+                    last_recv_arr[ack_num+1] = curr_time
+                    with lock:
+                        curr_seq=ack_num+1
+            elif(ack_num > latest_recv+1):
+                print("this should not happen.")
+    t = threading.Thread(target=update, daemon=False)
+    t.start()
+
+    # Wait for threads to join
+    p.join()
+    t.join()
+    end = time.time()
+    report(TOTAL_PACKETS, end - start)
+
+
+# Sliding window sender, see gbn.py and congestion.py
+def window_sender(window, dupack_threshold, cc, selective=False):
+    if selective:
+        sender = SelectiveRepeatSender(TOTAL_PACKETS, window, cc=ALGORITHMS[cc](window))
+    else:
+        sender = GoBackNSender(TOTAL_PACKETS, window, dupack_threshold, cc=ALGORITHMS[cc](window))
+    start = time.time()
+    while not sender.done:
+        now = time.time()
+        seq = sender.next_packet(now)
+        while seq is not None:
+            send_pckt(seq)
+            seq = sender.next_packet(now)
+        client_socket.settimeout(max(sender.wakeup - now, 1e-4))
+        try:
+            packet = client_socket.recv(BUFFER_SIZE)
+        except socket.timeout:
+            timeouts = sender.timeouts
+            sender.on_timeout(time.time())
+            if DEBUG and sender.timeouts > timeouts: print(f"timeout, going back to {sender.base} (RTO {sender.rtt.rto:.3f})")
+            continue
+        if selective:
+            sender.on_ack(*unpack_ack(packet), time.time())
+        else:
+            sender.on_ack(SEQ.unpack(packet)[0], time.time())
+    report(TOTAL_PACKETS, time.time() - start)
+    print(f"Timeouts = {sender.timeouts}, fast retransmits = {sender.fast_retransmits}, "
+          f"SRTT = {sender.rtt.srtt}, RTO = {sender.rtt.rto}")
+    print(f"Bottleneck bandwidth = {sender.path.btl_bw}, min RTT = {sender.path.min_rtt}, cwnd = {sender.cwnd}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Client for server-gbn.py")
+    parser.add_argument("--sender", choices=("window", "sr", "rate"), default="window",
+                        help="sliding window Go-Back-N, selective repeat (server-gbn.py --selective-repeat), "
+                             "or the original probe-then-fixed-rate sender")
+    parser.add_argument("--cc", choices=sorted(ALGORITHMS), default=DEFAULT_CC,
+                        help="congestion control for the window and selective repeat senders")
+    parser.add_argument("--window", type=int,
+                        help=f"packets in flight with --cc fixed (default {WINDOW}), "
+                             f"the most in flight otherwise (default {MAX_WINDOW})")
+    parser.add_argument("--dupacks", type=int, default=DUPACK_THRESHOLD, help="duplicate ACKs that trigger a fast retransmit")
+    parser.add_argument("--packets", type=int, default=TOTAL_PACKETS)
+    parser.add_argument("--server", default=SERVER_IP)
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="server port")
+    parser.add_argument("--client-port", type=int, default=CLIENT_PORT)
+    parser.add_argument("--quiet", action="store_true", help="only print the results")
+    args = parser.parse_args()
+    TOTAL_PACKETS = args.packets
+    SERVER_IP, SERVER_PORT, CLIENT_PORT = args.server, args.port, args.client_port
+    DEBUG = not args.quiet
+
+    # Create UDP socket
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # hope processing + RTT will not be greater than this 
+    client_socket.settimeout(10.0)
+    client_socket.bind((CLIENT_IP, CLIENT_PORT))
+
+    if args.sender == "rate":
+        rate_sender()
+    else:
+        if args.window is None:
+            args.window = WINDOW if args.cc == "fixed" else MAX_WINDOW
+        window_sender(args.window, args.dupacks, args.cc, selective=args.sender == "sr")
@@ -0,0 +1,197 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from simulate import simulate
+
+# Runs the client against server-gbn.py for every row of the table in
+# report.md, or for every combination of the emulator settings given, once
+# per sender, and prints one markdown table. A sender is `rate` (the
+# original fixed-rate sender), `fixed:W` (sliding window of W packets), the
+# name of a congestion control algorithm in congestion.py, or `sr:<name>` for
+# selective repeat with that algorithm (the server then runs with
+# --selective-repeat).
+# Each run gets its own server on fresh ports, so runs can go in parallel
+# (--jobs), but runs sharing a core skew each other's timing: on real time the
+# default is one at a time. With --virtual the runs are simulate.py's instead,
+# in-process on virtual time, for every seed in --seeds, and --jobs defaults
+# to one per CPU. The rate sender has no virtual time version.
+# Settings can also come from a JSON file (--config) whose keys are the
+# options below, e.g. {"capacity": [10, 1000], "per": [0, 0.1],
+# "senders": ["aimd", "sr:bbr"], "virtual": true}; options given on the
+# command line win over the file.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# capacity (packets/s), RTT (s), PER, buffer (packets) of the rows in report.md
+GRID = [
+    (1000, 0.1, 0.0, 100),
+    (1000, 0.1, 0.0, 10),
+    (10, 1.0, 0.0, 1),
+    (10, 1.0, 0.1, 10),
+]
+DEFAULT_SETTINGS = (10, 1.0, 0.0, 1)  # server-gbn.py's defaults, for settings not swept
+SENDERS = "rate,fixed:32,aimd,cubic,bbr"
+RUN_SECONDS = 20  # packets per run are capacity * this, at most --packets
+SERVER_STARTUP = 1.0
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def number(pattern, text):
+    match = re.search(pattern + r"\s*=?\s*([0-9.eE+-]+)", text)
+    return float(match.group(1)) if match else None
+
+
+def run(capacity, rtt, per, buffer, packets, sender_args, timeout, server_args=()):
+    port, client_port = free_port(), free_port()
+    server = subprocess.Popen(
+        [sys.executable, "server-gbn.py", "--port", str(port), "--queue-size", str(buffer),
+         "--service-interval", str(1 / capacity), "--drop-probability", str(per), "--rtt", str(rtt), *server_args],
+        cwd=HERE, stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(SERVER_STARTUP)
+        client = subprocess.run(
+            [sys.executable, "EE23B137_EE23B130_CLIENT.py", "--quiet", "--packets", str(packets),
+             "--port", str(port), "--client-port", str(client_port)] + sender_args,
+            cwd=HERE, capture_output=True, text=True, timeout=timeout)
+        output = client.stdout
+    except subprocess.TimeoutExpired:
+        return None
+    finally:
+        server.kill()
+        server.wait()
+    return {
+        "throughput": number("Throughput", output),
+        "time": number(r"Time taken to send \d+ packets", output),
+        "sent": number("Packets sent", output),
+        "retransmissions": number("Retransmissions", output),
+    }
+
+
+def sender_args(name):
+    if name == "rate":
+        return ["--sender", "rate"]
+    if name.startswith("fixed:"):
+        return ["--sender", "window", "--cc", "fixed", "--window", name[len("fixed:"):]]
+    if name.startswith("sr:"):
+        return ["--sender", "sr", "--cc", name[len("sr:"):]]
+    return ["--sender", "window", "--cc", name]
+
+
+def simulate_args(name):
+    # simulate() keyword arguments for a sender, None for the rate sender
+    if name == "rate":
+        return None
+    if name.startswith("fixed:"):
+        return {"cc": "fixed", "window": int(name[len("fixed:"):])}
+    if name.startswith("sr:"):
+        return {"sender": "sr", "cc": name[len("sr:"):]}
+    return {"cc": name}
+
+
+def settings(args):
+    swept = [args.capacity, args.rtt, args.per, args.buffer]
+    if not any(swept):
+        return [GRID[row - 1] for row in args.rows]
+    return list(itertools.product(*(values or [default] for values, default in zip(swept, DEFAULT_SETTINGS))))
+
+
+def table_row(args, setting, name, seed):
+    # One line of the table, run in a worker process
+    capacity, rtt, per, buffer = setting
+    packets = min(args.packets, int(capacity * args.run_seconds))
+    if args.virtual:
+        kwargs = simulate_args(name)
+        result = None if kwargs is None else simulate(capacity, rtt, per, buffer, packets, seed=seed, **kwargs)
+        failed = "real time only" if kwargs is None else "not done in virtual time"
+    else:
+        server_args = ["--selective-repeat"] if name.startswith("sr:") else []
+        result = run(capacity, rtt, per, buffer, packets, sender_args(name), args.timeout, server_args)
+        failed = f"> {args.timeout} s timeout"
+    if result is None:
+        cells = [failed, "", "", ""]
+    else:
+        cells = [f"{result['throughput']:.2f}", f"{result['time']:.1f}", f"{result['retransmissions']:.0f}",
+                 f"{100 * result['retransmissions'] / result['sent']:.1f}"]
+    seed_cell = [str(seed)] if args.virtual else []
+    return "| " + " | ".join([f"{capacity:g}", f"{rtt:g}", f"{per * 100:g}", str(buffer), str(packets), name]
+                              + seed_cell + cells) + " |"
+
+
+def config_defaults(parser, path):
+    # The options in the JSON file at `path`, checked and converted the way
+    # they would be on the command line. Keys are option names, with - or _.
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        parser.error(f"{path}: expected a JSON object of {{option: value}}")
+    actions = {action.dest: action for action in parser._actions if action.dest not in ("help", "config")}
+    defaults = {}
+    for key, value in config.items():
+        action = actions.get(key.replace("-", "_"))
+        if action is None:
+            parser.error(f"{path}: unknown option {key!r}, expected one of {', '.join(sorted(actions))}")
+        if action.nargs == 0:  # a flag such as --virtual
+            if not isinstance(value, bool):
+                parser.error(f"{path}: {key} must be true or false, not {value!r}")
+            defaults[action.dest] = value
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float, list)):
+            parser.error(f"{path}: {key} must be a string, number or list, not {value!r}")
+        # A list is read like its comma separated form
+        text = ",".join(map(str, value)) if isinstance(value, list) else str(value)
+        try:
+            defaults[action.dest] = action.type(text) if action.type else text
+        except ValueError:
+            parser.error(f"{path}: invalid value for {key}: {value!r}")
+    return defaults
+
+
+def main(args):
+    seeds = args.seeds if args.virtual else [None]
+    runs = [(setting, name, seed) for setting in settings(args) for name in args.senders for seed in seeds]
+    seed_column = ["Seed"] if args.virtual else []
+    columns = ["Capacity (pps)", "RTT (s)", "PER (%)", "Buffer", "Packets", "Sender"] + seed_column + \
+              ["Throughput (pps)", "Time (s)", "Retransmissions", "Loss (%)"]
+    print("| " + " | ".join(columns) + " |")
+    print("|" + "---|" * len(columns))
+    jobs = args.jobs or (os.cpu_count() if args.virtual else 1)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        for line in pool.map(table_row, itertools.repeat(args), *zip(*runs)):
+            print(line, flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the a2 senders over the report.md grid or a sweep of emulator settings")
+    parser.add_argument("--config", help="JSON file with any of the options below, as {option: value}")
+    parser.add_argument("--senders", type=lambda s: s.split(","), default=SENDERS.split(","),
+                        help=f"comma separated senders (default {SENDERS})")
+    parser.add_argument("--rows", type=lambda s: [int(r) for r in s.split(",")], default=list(range(1, len(GRID) + 1)),
+                        help="comma separated rows of the report.md table to run, from 1")
+    floats = lambda s: [float(v) for v in s.split(",")]
+    ints = lambda s: [int(v) for v in s.split(",")]
+    parser.add_argument("--capacity", type=floats, help="sweep these capacities (packets/s) instead of the report rows")
+    parser.add_argument("--rtt", type=floats, help="sweep these RTTs (s)")
+    parser.add_argument("--per", type=floats, help="sweep these drop probabilities (0 to 1)")
+    parser.add_argument("--buffer", type=ints, help="sweep these buffer sizes (packets)")
+    parser.add_argument("--packets", type=int, default=10000, help="most packets per run")
+    parser.add_argument("--run-seconds", type=float, default=RUN_SECONDS, help="packets per run are capacity * this")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a run is given up")
+    parser.add_argument("--virtual", action="store_true", help="run simulate.py on virtual time instead of the real programs")
+    parser.add_argument("--seeds", type=ints, default=[0], help="comma separated seeds for the drops with --virtual")
+    parser.add_argument("--jobs", type=int, help="runs at a time (default 1, or one per CPU with --virtual)")
+    args = parser.parse_args()
+    if args.config:
+        parser.set_defaults(**config_defaults(parser, args.config))
+        args = parser.parse_args()
+    main(args)
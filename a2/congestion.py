@@ -0,0 +1,257 @@
+import math
+from collections import deque
+
+# Congestion control for the a2 sender (gbn.py), picked by name from
+# ALGORITHMS. An algorithm decides how many packets may be in flight (`cwnd`)
+# and how fast they leave (`pacing_rate`, packets/s, None for back to back).
+# The window given to the sender is an upper bound for every algorithm but
+# Fixed, which just uses it. The sender calls:
+#   on_ack(sender, acked, now)   ACK for `acked` new packets; sender.path has
+#                                the current bandwidth and min RTT estimates
+#   on_loss(sender, now, timeout)  fast retransmit (timeout False) or timeout
+#
+# Path keeps the estimates every algorithm can use, updated on every ACK:
+# the bottleneck bandwidth as the highest delivery rate seen over the last
+# BW_WINDOW round trips, and the min RTT over the last MIN_RTT_WINDOW seconds.
+# A delivery rate sample is the number of packets acked between sending a
+# packet and getting its ACK, over that time or the time it took to send
+# them if longer, so ACKs that come in bunches do not look like bandwidth.
+# This is how BBR samples it.
+#
+# Fixed keeps a constant window. Aimd is Reno (slow start, then one more
+# packet per RTT, half on loss), Cubic grows the window as a cubic function
+# of the time since the last loss (RFC 9438), and Bbr ignores random loss and
+# paces at the estimated bandwidth with about two BDPs in flight, cycling its
+# pacing gain to look for more bandwidth (BBR v1). Aimd and Cubic pace at
+# WINDOW_PACING_GAIN * cwnd / srtt like Linux does, so a go back does not
+# dump the whole window onto the emulator's queue at once.
+
+INITIAL_CWND = 4
+MIN_CWND = 2
+WINDOW_PACING_GAIN = 1.2
+BW_WINDOW = 10  # round trips
+MIN_RTT_WINDOW = 10.0  # seconds
+
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+BBR_HIGH_GAIN = 2 / math.log(2)  # startup, doubles the delivery rate every round
+BBR_CWND_GAIN = 2
+BBR_GAIN_CYCLE = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+BBR_FULL_BW_GROWTH = 1.25  # startup ends after 3 rounds without this much growth
+BBR_FULL_BW_ROUNDS = 3
+BBR_PROBE_RTT_TIME = 0.2  # seconds spent at BBR_MIN_CWND to remeasure the min RTT
+BBR_MIN_CWND = 4
+
+
+class MaxFilter:
+    # Highest value over the last `window` (rounds or seconds), with a
+    # monotonic deque so each update is O(1) amortised
+    def __init__(self, window):
+        self.window = window
+        self.samples = deque()  # [(stamp, value)], values decreasing
+
+    def update(self, value, stamp):
+        while self.samples and self.samples[-1][1] <= value:
+            self.samples.pop()
+        self.samples.append((stamp, value))
+        while self.samples[0][0] <= stamp - self.window:
+            self.samples.popleft()
+
+    @property
+    def best(self):
+        return self.samples[0][1] if self.samples else None
+
+
+class Path:
+    def __init__(self):
+        self.bandwidth = MaxFilter(BW_WINDOW)
+        self.min_rtt = None
+        self.min_rtt_stamp = None
+        self.delivered = 0  # packets acked so far
+        self.delivered_time = None
+        self.first_sent_time = None  # send time of the packet acked last
+        self.round = 0  # round trips so far
+        self.next_round_delivered = 0
+        self.round_start = False  # this ACK started a new round
+        self.min_rtt_expired = False  # this ACK replaced a min RTT older than MIN_RTT_WINDOW
+
+    @property
+    def btl_bw(self):
+        return self.bandwidth.best
+
+    @property
+    def bdp(self):
+        if self.btl_bw is None or self.min_rtt is None:
+            return None
+        return self.btl_bw * self.min_rtt
+
+    def on_send(self, now):
+        # What is remembered with each packet to take a rate sample on its ACK
+        if self.delivered_time is None:
+            self.delivered_time = self.first_sent_time = now
+        return self.delivered, self.delivered_time, self.first_sent_time, now
+
+    def on_ack(self, acked, state, rtt, now):
+        # `state` is what on_send returned for the packet acked last, `rtt` its
+        # RTT if it was sent once
+        self.delivered += acked
+        self.delivered_time = now
+        prior_delivered, prior_time, first_sent_time, sent_time = state
+        self.first_sent_time = sent_time
+        self.round_start = prior_delivered >= self.next_round_delivered
+        if self.round_start:
+            self.round += 1
+            self.next_round_delivered = self.delivered
+        interval = max(now - prior_time, sent_time - first_sent_time)
+        if interval > 0:
+            self.bandwidth.update((self.delivered - prior_delivered) / interval, self.round)
+        self.min_rtt_expired = False
+        if rtt is not None:
+            self.min_rtt_expired = self.min_rtt is not None and now - self.min_rtt_stamp > MIN_RTT_WINDOW
+            if self.min_rtt is None or rtt <= self.min_rtt or self.min_rtt_expired:
+                self.min_rtt = rtt
+                self.min_rtt_stamp = now
+
+
+class Fixed:
+    def __init__(self, window):
+        self.cwnd = window
+        self.pacing_rate = None
+
+    def on_ack(self, sender, acked, now):
+        pass
+
+    def on_loss(self, sender, now, timeout):
+        pass
+
+
+class Aimd:
+    def __init__(self, window):
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = math.inf
+        self.pacing_rate = None
+
+    def pace(self, sender):
+        srtt = sender.rtt.srtt
+        self.pacing_rate = WINDOW_PACING_GAIN * self.cwnd / srtt if srtt else None
+
+    def on_ack(self, sender, acked, now):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += acked / self.cwnd
+        self.pace(sender)
+
+    def on_loss(self, sender, now, timeout):
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = 1 if timeout else self.ssthresh
+        self.pace(sender)
+
+
+class Cubic(Aimd):
+    def __init__(self, window):
+        super().__init__(window)
+        self.w_max = 0
+        self.epoch = None  # start of the current growth period
+        self.k = 0
+        self.w_est = 0  # what Reno would have by now, the window never falls below it
+
+    def on_ack(self, sender, acked, now):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+            self.pace(sender)
+            return
+        if self.epoch is None:
+            self.epoch = now
+            self.w_max = max(self.w_max, self.cwnd)
+            self.k = ((self.w_max - self.cwnd) / CUBIC_C) ** (1 / 3)
+            self.w_est = self.cwnd
+        rtt = sender.path.min_rtt or sender.rtt.srtt or 0
+        target = CUBIC_C * (now - self.epoch + rtt - self.k) ** 3 + self.w_max
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+        self.w_est += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * acked / self.cwnd
+        self.cwnd = max(self.cwnd + (target - self.cwnd) * acked / self.cwnd, self.w_est)
+        self.pace(sender)
+
+    def on_loss(self, sender, now, timeout):
+        self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * CUBIC_BETA, MIN_CWND)
+        self.cwnd = 1 if timeout else self.ssthresh
+        self.epoch = None
+        self.pace(sender)
+
+
+class Bbr:
+    STARTUP, DRAIN, PROBE_BW, PROBE_RTT = range(4)
+
+    def __init__(self, window):
+        self.cwnd = INITIAL_CWND
+        self.pacing_rate = None
+        self.state = Bbr.STARTUP
+        self.pacing_gain = BBR_HIGH_GAIN
+        self.cwnd_gain = BBR_HIGH_GAIN
+        self.full_bw = 0
+        self.full_bw_rounds = 0
+        self.cycle_index = 0
+        self.cycle_stamp = None
+        self.probe_rtt_done = None
+
+    def on_ack(self, sender, acked, now):
+        path = sender.path
+        if path.btl_bw is None or path.min_rtt is None:
+            self.cwnd += acked
+            return
+        if self.state == Bbr.STARTUP and path.round_start:
+            if path.btl_bw >= self.full_bw * BBR_FULL_BW_GROWTH:
+                self.full_bw = path.btl_bw
+                self.full_bw_rounds = 0
+            else:
+                self.full_bw_rounds += 1
+                if self.full_bw_rounds >= BBR_FULL_BW_ROUNDS:
+                    self.state = Bbr.DRAIN
+                    self.pacing_gain = 1 / BBR_HIGH_GAIN
+                    self.cwnd_gain = BBR_HIGH_GAIN
+        if self.state == Bbr.DRAIN and sender.in_flight <= path.bdp:
+            self.enter_probe_bw(now)
+        if self.state == Bbr.PROBE_BW and now - self.cycle_stamp > path.min_rtt:
+            self.cycle_index = (self.cycle_index + 1) % len(BBR_GAIN_CYCLE)
+            self.cycle_stamp = now
+            self.pacing_gain = BBR_GAIN_CYCLE[self.cycle_index]
+        if self.state != Bbr.PROBE_RTT and path.min_rtt_expired:
+            # The min RTT had not been seen for a while: drain the queue to see it again
+            self.state = Bbr.PROBE_RTT
+            self.pacing_gain = 1
+            self.probe_rtt_done = now + max(BBR_PROBE_RTT_TIME, path.min_rtt)
+        if self.state == Bbr.PROBE_RTT and now >= self.probe_rtt_done:
+            self.enter_probe_bw(now)
+        self.pacing_rate = self.pacing_gain * path.btl_bw
+        if self.state == Bbr.PROBE_RTT:
+            self.cwnd = BBR_MIN_CWND
+        else:
+            self.cwnd = max(self.cwnd_gain * path.bdp, BBR_MIN_CWND)
+
+    def enter_probe_bw(self, now):
+        self.state = Bbr.PROBE_BW
+        self.cwnd_gain = BBR_CWND_GAIN
+        self.cycle_index = 0
+        self.cycle_stamp = now
+        self.pacing_gain = BBR_GAIN_CYCLE[0]
+
+    def on_loss(self, sender, now, timeout):
+        # Random loss says nothing about the bottleneck; only a timeout
+        # (everything in flight gone) starts over from a small window
+        if timeout:
+            self.cwnd = BBR_MIN_CWND
+
+
+ALGORITHMS = {
+    "fixed": Fixed,
+    "aimd": Aimd,
+    "cubic": Cubic,
+    "bbr": Bbr,
+}
+# For the client and simulate.py. A fixed window only suits the paths whose
+# BDP it fits; the server-gbn.py defaults (10 pps, RTT 1 s, buffer 1) are not
+# one of them.
+DEFAULT_CC = "aimd"
@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import random
+from collections import deque
+from sack import MAX_BLOCKS, RangeSet
+
+# Core of the a2 link emulator, without sockets or a clock so the same code
+# runs against real time (server-gbn.py) and virtual time.
+#
+# Scheduler is a timer heap: call_at(when, callback, *args) and
+# run_until(now) runs everything due by `now` in time order, each callback
+# seeing the time it was scheduled for rather than the time it actually ran,
+# so the link is paced from deadlines and late wakeups do not add up.
+#
+# Link is what server-gbn.py used to do with a thread per packet and two
+# sleeping threads, as timers: a packet arriving at time t waits in the delay line until
+# t + rtt, is dropped with probability drop_probability, and otherwise joins
+# the FIFO buffer of queue_size packets, or is dropped if it is full. The
+# link takes a packet from the buffer whenever it is idle and is then busy
+# for service_interval. Taking a packet is when the receiver sees it: it only
+# accepts the next one in order and answers every packet with a cumulative
+# ACK for the last one it has, except while it has nothing (there is no ACK
+# for -1).
+# With selective_repeat the receiver also keeps packets that come after a
+# hole, up to reorder_window past the last in-order one, and every ACK
+# carries SACK blocks for them (sack.py), -1 included. send_ack(base, blocks,
+# addr) gets an empty block list in Go-Back-N mode.
+
+QUEUE_SIZE = 1  # B, max buffer size in packets
+PACKET_SERVICE_INTERVAL = 0.1  # 1/C, inverse of the link capacity
+DROP_PROBABILITY = 0.0  # PER, probability of a drop before the queue
+RTT = 1  # delay before the queue, in seconds
+REORDER_WINDOW = 4096  # packets past the last in-order one a selective repeat receiver keeps
+
+
+class Scheduler:
+    def __init__(self):
+        self.timers = []  # heap of (when, order, callback, args)
+        self.order = itertools.count()  # keeps timers due at the same time in FIFO order
+
+    def call_at(self, when, callback, *args):
+        heapq.heappush(self.timers, (when, next(self.order), callback, args))
+
+    @property
+    def next_time(self):
+        return self.timers[0][0] if self.timers else None
+
+    def run_until(self, now):
+        timers = self.timers
+        while timers and timers[0][0] <= now:
+            when, _, callback, args = heapq.heappop(timers)
+            callback(when, *args)
+
+
+class Link:
+    def __init__(self, scheduler, send_ack, queue_size=QUEUE_SIZE, service_interval=PACKET_SERVICE_INTERVAL,
+                 drop_probability=DROP_PROBABILITY, rtt=RTT, rng=None, log=None,
+                 selective_repeat=False, reorder_window=REORDER_WINDOW):
+        self.scheduler = scheduler
+        self.send_ack = send_ack  # send_ack(ack, blocks, addr)
+        self.queue_size = queue_size
+        self.service_interval = service_interval
+        self.drop_probability = drop_probability
+        self.rtt = rtt
+        self.random = rng.random if rng is not None else random.random
+        self.log = log  # log(message), or None to stay quiet
+        # Every packet is delayed by the same rtt, so the delay line is a FIFO
+        # with one timer, for the packet at its head
+        self.delay_line = deque()  # (time at the queue, seq, addr)
+        self.buffer = deque()  # FIFO of (seq, addr), at most queue_size
+        self.busy_until = float("-inf")  # the link is serving a packet until then
+        self.base = -1  # last in-order received packet
+        self.selective_repeat = selective_repeat
+        self.reorder_window = reorder_window
+        self.held = RangeSet()  # packets after a hole, selective repeat only
+        self.received = 0
+        self.dropped = 0  # by drop_probability
+        self.overflowed = 0  # buffer full
+        self.served = 0
+
+    def receive(self, now, seq, addr):
+        self.received += 1
+        if not self.delay_line:
+            self.scheduler.call_at(now + self.rtt, self.arrive)
+        self.delay_line.append((now + self.rtt, seq, addr))
+        if self.log:
+            self.log(f"Received Packet {seq}, expected at queue at {now + self.rtt:.3f}")
+
+    def arrive(self, now):
+        _, seq, addr = self.delay_line.popleft()
+        if self.delay_line:
+            self.scheduler.call_at(self.delay_line[0][0], self.arrive)
+        if self.drop_probability and self.random() < self.drop_probability:
+            self.dropped += 1
+            if self.log:
+                self.log(f"Packet {seq} dropped before entering queue!")
+        elif now >= self.busy_until and not self.buffer:
+            self.serve(now, seq, addr)
+        elif len(self.buffer) < self.queue_size:
+            if not self.buffer:
+                self.scheduler.call_at(self.busy_until, self.next_packet)
+            self.buffer.append((seq, addr))
+        else:
+            self.overflowed += 1
+            if self.log:
+                self.log(f"Packet {seq} dropped due to full buffer!")
+
+    def serve(self, now, seq, addr):
+        self.served += 1
+        self.busy_until = now + self.service_interval
+        if seq == self.base + 1:
+            self.base = seq
+            if self.held and self.held.first()[0] == seq + 1:
+                self.base = self.held.first()[1] - 1
+                self.held.discard_below(self.base + 1)
+        elif self.selective_repeat and self.base + 1 < seq <= self.base + self.reorder_window:
+            self.held.add(seq, seq + 1)
+        if self.selective_repeat:
+            self.send_ack(self.base, self.sack_blocks(seq), addr)
+        elif self.base >= 0:
+            self.send_ack(self.base, (), addr)
+        if self.log:
+            self.log(f"Processed Packet {seq} at {now:.6f}, Sent Cumulative ACK {self.base}")
+
+    def sack_blocks(self, seq):
+        latest = self.held.covering(seq)
+        if latest is None:
+            return self.held.lowest(MAX_BLOCKS)
+        return [latest] + [block for block in self.held.lowest(MAX_BLOCKS) if block != latest][:MAX_BLOCKS - 1]
+
+    def next_packet(self, now):
+        self.serve(now, *self.buffer.popleft())
+        if self.buffer:
+            self.scheduler.call_at(self.busy_until, self.next_packet)
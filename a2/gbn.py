@@ -0,0 +1,180 @@
+import struct
+from congestion import Fixed, Path
+
+# Go-Back-N sender engine for the a2 client. It keeps no socket and no clock:
+# the caller passes in the current time with every call, sends whatever
+# next_packet() hands out, feeds every ACK to on_ack() and calls on_timeout()
+# once `deadline` has passed without one.
+#
+# Packets 0..total-1 go out within a window of `window` unacknowledged
+# packets. server-gbn.py acks cumulatively (the highest seq it has taken in
+# order) after serving each packet and throws away anything out of order, so
+# a lost packet shows up as duplicate ACKs for the one before it.
+# There is a single retransmission timer, for the oldest unacked packet. When
+# it expires, or after DUPACK_THRESHOLD duplicate ACKs (fast retransmit),
+# sending goes back to that packet. Only one fast retransmit is done per
+# window: the copies still in flight keep producing duplicate ACKs after it.
+# The timeout comes from RttEstimator (Jacobson/Karels, RFC 6298), sampled
+# only on packets that were sent once (Karn) and doubled on every timeout
+# until new data is acked again. In Go-Back-N everything up to the highest
+# seq sent is a retransmission after a timeout, so waiting for the next
+# sample as RFC 6298 does would keep the timeout backed off for a whole window.
+#
+# How much of the window is used and how fast packets leave is up to the
+# congestion control algorithm `cc` (congestion.py), Fixed(window) unless
+# given: the window is then only an upper bound. While the algorithm paces,
+# next_packet() holds packets back until their send time and `wakeup` says
+# when to call again.
+
+WINDOW = 32  # packets in flight
+MAX_WINDOW = 4096  # upper bound for the adaptive congestion control algorithms
+PACING_SLACK = 0.004  # seconds of sending a late wakeup may catch up on
+DUPACK_THRESHOLD = 3
+INITIAL_RTO = 3.0  # seconds, until the first sample; above the emulator's 1 s RTT
+MIN_RTO = 0.2
+MAX_RTO = 60.0
+RTT_GAIN = 1 / 8  # alpha
+RTTVAR_GAIN = 1 / 4  # beta
+
+SEQ = struct.Struct('!I')  # a data packet and a cumulative ACK are both just a seq
+
+
+class RttEstimator:
+    def __init__(self, initial=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None
+        self.latest = None
+        self.rto = initial
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += RTTVAR_GAIN * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += RTT_GAIN * (rtt - self.srtt)
+        self.latest = rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.reset()
+
+    def reset(self):
+        # Drops the backoff once the path is known to work again
+        if self.srtt is not None:
+            self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.max_rto)
+
+
+class GoBackNSender:
+    def __init__(self, total, window=WINDOW, dupack_threshold=DUPACK_THRESHOLD, rtt=None, cc=None):
+        self.total = total
+        self.window = window
+        self.dupack_threshold = dupack_threshold
+        self.rtt = RttEstimator() if rtt is None else rtt
+        self.cc = Fixed(window) if cc is None else cc
+        self.path = Path()
+        self.base = 0  # oldest unacked seq
+        self.next_seq = 0  # next seq to send
+        self.high = 0  # one past the highest seq sent so far
+        self.sent_at = {}  # {seq: send time} of packets sent exactly once, for RTT samples
+        self.delivery = {}  # {seq: Path.on_send() state} of the last copy sent, for rate samples
+        self.deadline = None  # when the retransmission timer fires, None while nothing is in flight
+        self.next_send = None  # when pacing lets the next packet go
+        self.dupacks = 0
+        self.recover = -1  # no fast retransmit until this seq is acked
+        self.sent = 0
+        self.retransmitted = 0
+        self.timeouts = 0
+        self.fast_retransmits = 0
+
+    @property
+    def done(self):
+        return self.base >= self.total
+
+    @property
+    def in_flight(self):
+        return self.next_seq - self.base
+
+    @property
+    def cwnd(self):
+        return max(1, min(int(self.cc.cwnd), self.window))
+
+    @property
+    def wakeup(self):
+        # When something is due: the retransmission timer, or the next paced
+        # packet if the window has room for it
+        if self.next_seq < self.total and self.in_flight < self.cwnd and self.next_send is not None:
+            return min(self.next_send, self.deadline) if self.deadline is not None else self.next_send
+        return self.deadline
+
+    def next_packet(self, now):
+        # Seq to send now, None while the window is full, pacing holds the
+        # next one back or everything is out
+        if self.next_seq >= self.total or self.in_flight >= self.cwnd:
+            return None
+        if self.next_send is not None and now < self.next_send:
+            return None
+        rate = self.cc.pacing_rate
+        # Timeouts on the socket are whole milliseconds: a packet sent late
+        # does not push back the ones after it, up to PACING_SLACK
+        self.next_send = max(self.next_send or now, now - PACING_SLACK) + 1 / rate if rate else None
+        seq = self.next_seq
+        self.next_seq += 1
+        self.sent += 1
+        if seq < self.high:
+            self.retransmitted += 1
+            self.sent_at.pop(seq, None)
+        else:
+            self.high = seq + 1
+            self.sent_at[seq] = now
+        self.delivery[seq] = self.path.on_send(now)
+        if self.deadline is None:
+            self.deadline = now + self.rtt.rto
+        return seq
+
+    def on_ack(self, ack, now):
+        if ack >= self.high:
+            return  # not for anything sent by this sender
+        if ack >= self.base:
+            acked = ack + 1 - self.base
+            sent = self.sent_at.get(ack)
+            rtt = None if sent is None else now - sent
+            if rtt is not None:
+                self.rtt.sample(rtt)
+            else:
+                self.rtt.reset()
+            self.path.on_ack(acked, self.delivery[ack], rtt, now)
+            for seq in range(self.base, ack + 1):
+                self.sent_at.pop(seq, None)
+                self.delivery.pop(seq, None)
+            self.base = ack + 1
+            # Copies sent before a go back can be acked after it
+            self.next_seq = max(self.next_seq, self.base)
+            self.dupacks = 0
+            self.deadline = now + self.rtt.rto if self.next_seq > self.base else None
+            self.cc.on_ack(self, acked, now)
+        elif ack == self.base - 1:
+            self.dupacks += 1
+            if self.dupacks == self.dupack_threshold and self.base > self.recover:
+                self.fast_retransmits += 1
+                self.recover = self.high - 1
+                self.go_back(now)
+                self.cc.on_loss(self, now, False)
+
+    def on_timeout(self, now):
+        if self.deadline is None or now < self.deadline:
+            return
+        self.timeouts += 1
+        self.rtt.backoff()
+        self.recover = self.high - 1
+        self.go_back(now)
+        self.cc.on_loss(self, now, True)
+
+    def go_back(self, now):
+        self.next_seq = self.base
+        self.dupacks = 0
+        self.deadline = now + self.rtt.rto
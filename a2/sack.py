@@ -0,0 +1,85 @@
+import bisect
+import struct
+
+# Selective acknowledgements, used when server-gbn.py runs with
+# --selective-repeat. An ACK is then the last in-order seq (-1 before packet 0
+# is in, so signed) followed by up to MAX_BLOCKS blocks of packets the
+# receiver holds beyond it, each as first seq and one past the last. As in
+# RFC 2018 the first block is the one holding the packet that triggered the
+# ACK, the others are the lowest ones, where the holes to repair are.
+# Plain Go-Back-N ACKs stay a bare 4-byte seq.
+
+ACK_HEADER = struct.Struct('!iB')  # last in-order seq, block count
+BLOCK = struct.Struct('!II')  # first seq, one past the last
+MAX_BLOCKS = 4
+
+
+def pack_ack(base, blocks):
+    packet = bytearray(ACK_HEADER.size + BLOCK.size * len(blocks))
+    ACK_HEADER.pack_into(packet, 0, base, len(blocks))
+    for i, (start, end) in enumerate(blocks):
+        BLOCK.pack_into(packet, ACK_HEADER.size + BLOCK.size * i, start, end)
+    return packet
+
+
+def unpack_ack(packet):
+    # (last in-order seq, [(start, end)])
+    base, count = ACK_HEADER.unpack_from(packet)
+    return base, [BLOCK.unpack_from(packet, ACK_HEADER.size + BLOCK.size * i) for i in range(count)]
+
+
+class RangeSet:
+    # Sorted, disjoint [start, end) ranges of seqs. Adding a range costs
+    # O(log n) plus the ranges it merges with.
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __contains__(self, seq):
+        i = bisect.bisect_right(self.starts, seq) - 1
+        return i >= 0 and seq < self.ends[i]
+
+    def add(self, start, end):
+        # Adds [start, end) and returns the parts of it that were not in yet
+        if start >= end:
+            return []
+        lo = bisect.bisect_left(self.ends, start)  # first range that ends at or after start
+        hi = bisect.bisect_right(self.starts, end)  # ranges before hi start at or before end
+        new = []
+        position = start
+        for i in range(lo, hi):
+            if self.starts[i] > position:
+                new.append((position, self.starts[i]))
+            position = max(position, self.ends[i])
+        if position < end:
+            new.append((position, end))
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+        return new
+
+    def covering(self, seq):
+        # The range holding seq, None if there is none
+        i = bisect.bisect_right(self.starts, seq) - 1
+        if i >= 0 and seq < self.ends[i]:
+            return self.starts[i], self.ends[i]
+        return None
+
+    def first(self):
+        return (self.starts[0], self.ends[0]) if self.starts else None
+
+    def discard_below(self, seq):
+        # Drops everything below seq
+        i = bisect.bisect_right(self.ends, seq)
+        del self.starts[:i]
+        del self.ends[:i]
+        if self.starts and self.starts[0] < seq:
+            self.starts[0] = seq
+
+    def lowest(self, count):
+        return list(zip(self.starts[:count], self.ends[:count]))
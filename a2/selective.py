@@ -0,0 +1,155 @@
+import heapq
+from collections import OrderedDict
+from congestion import Fixed, Path
+from gbn import RttEstimator, WINDOW, PACING_SLACK
+from sack import RangeSet
+
+# Selective repeat sender engine, the counterpart of server-gbn.py
+# --selective-repeat. It is driven like GoBackNSender (gbn.py), except that
+# on_ack() also takes the SACK blocks of the ACK, and it takes the same
+# congestion control algorithms.
+#
+# The ACKs say exactly which packets are in, so only the holes are sent
+# again. A packet is taken as lost once a packet sent after it is acked: the
+# emulator never reorders, so this is RACK (RFC 8985) without a reordering
+# window, and it also catches a retransmission that was lost again. When the
+# retransmission timer expires everything in flight is taken as lost. The
+# congestion control hears about loss once per window, as in gbn.py. New
+# packets stay within `window` of the oldest unacked one, so the receiver's
+# reorder window must be at least that big.
+
+
+class SelectiveRepeatSender:
+    def __init__(self, total, window=WINDOW, rtt=None, cc=None):
+        self.total = total
+        self.window = window
+        self.rtt = RttEstimator() if rtt is None else rtt
+        self.cc = Fixed(window) if cc is None else cc
+        self.path = Path()
+        self.base = 0  # oldest unacked seq
+        self.high = 0  # one past the highest seq sent so far
+        self.acked = RangeSet()  # seqs acked so far, at or above base
+        self.outstanding = OrderedDict()  # {seq: send time} in flight, in the order they were sent
+        self.lost = []  # heap of seqs to send again
+        self.sent_at = {}  # {seq: send time} of packets sent exactly once, for RTT samples
+        self.delivery = {}  # {seq: Path.on_send() state} of the last copy sent, for rate samples
+        self.deadline = None  # when the retransmission timer fires, None while nothing is in flight
+        self.next_send = None  # when pacing lets the next packet go
+        self.recover = -1  # no congestion response to loss until this seq is acked
+        self.sent = 0
+        self.retransmitted = 0
+        self.timeouts = 0
+        self.fast_retransmits = 0  # losses found from SACKs, as recovery episodes
+
+    @property
+    def done(self):
+        return self.base >= self.total
+
+    @property
+    def in_flight(self):
+        return len(self.outstanding)
+
+    @property
+    def cwnd(self):
+        return max(1, min(int(self.cc.cwnd), self.window))
+
+    @property
+    def has_data(self):
+        return bool(self.lost) or self.high < min(self.total, self.base + self.window)
+
+    @property
+    def wakeup(self):
+        if self.has_data and self.in_flight < self.cwnd and self.next_send is not None:
+            return min(self.next_send, self.deadline) if self.deadline is not None else self.next_send
+        return self.deadline
+
+    def next_packet(self, now):
+        # Seq to send now, holes first, None while the window is full, pacing
+        # holds the next one back or there is nothing to send
+        if self.in_flight >= self.cwnd or not self.has_data:
+            return None
+        if self.next_send is not None and now < self.next_send:
+            return None
+        while self.lost:
+            seq = heapq.heappop(self.lost)
+            # A copy taken as lost can still be acked (after a timeout)
+            if seq >= self.base and seq not in self.acked and seq not in self.outstanding:
+                self.retransmitted += 1
+                self.sent_at.pop(seq, None)
+                break
+        else:
+            if self.high >= min(self.total, self.base + self.window):
+                return None
+            seq = self.high
+            self.high += 1
+            self.sent_at[seq] = now
+        rate = self.cc.pacing_rate
+        self.next_send = max(self.next_send or now, now - PACING_SLACK) + 1 / rate if rate else None
+        self.sent += 1
+        self.outstanding[seq] = now
+        self.delivery[seq] = self.path.on_send(now)
+        if self.deadline is None:
+            self.deadline = now + self.rtt.rto
+        return seq
+
+    def on_ack(self, ack, blocks, now):
+        newly = self.acked.add(self.base, min(ack + 1, self.high))
+        for start, end in blocks:
+            newly += self.acked.add(max(start, self.base), min(end, self.high))
+        if not newly:
+            return
+        acked = 0
+        latest = None  # (send time, seq) of the newly acked copy sent last
+        for start, end in newly:
+            acked += end - start
+            for seq in range(start, end):
+                sent = self.outstanding.pop(seq, None)
+                if sent is not None and (latest is None or sent > latest[0]):
+                    latest = (sent, seq)
+        if latest is not None:
+            sent, seq = latest
+            first = self.sent_at.get(seq)
+            rtt = None if first is None else now - first
+            if rtt is not None:
+                self.rtt.sample(rtt)
+            else:
+                self.rtt.reset()
+            self.path.on_ack(acked, self.delivery[seq], rtt, now)
+            self.detect_losses(sent, now)
+        for start, end in newly:
+            for seq in range(start, end):
+                self.sent_at.pop(seq, None)
+                self.delivery.pop(seq, None)
+        first = self.acked.first()
+        if first is not None and first[0] == self.base:
+            self.base = first[1]
+            self.acked.discard_below(self.base)
+        self.deadline = now + self.rtt.rto if self.outstanding else None
+        self.cc.on_ack(self, acked, now)
+
+    def detect_losses(self, sent, now):
+        # Everything still in flight that was sent before `sent` is lost
+        lost = False
+        while self.outstanding:
+            seq, sent_at = next(iter(self.outstanding.items()))
+            if sent_at >= sent:
+                break
+            del self.outstanding[seq]
+            heapq.heappush(self.lost, seq)
+            lost = True
+        if lost and self.base > self.recover:
+            self.fast_retransmits += 1
+            self.recover = self.high - 1
+            self.cc.on_loss(self, now, False)
+
+    def on_timeout(self, now):
+        if self.deadline is None or now < self.deadline:
+            return
+        self.timeouts += 1
+        self.rtt.backoff()
+        for seq in self.outstanding:
+            heapq.heappush(self.lost, seq)
+        self.outstanding.clear()
+        self.recover = self.high - 1
+        self.deadline = now + self.rtt.rto
+        self.cc.on_loss(self, now, True)
@@ -1,95 +1,79 @@
+import argparse
+import select
 import socket
-import time
 import struct
-import threading
-import queue
-import random
+import time
+from emulator import Scheduler, Link, QUEUE_SIZE, PACKET_SERVICE_INTERVAL, DROP_PROBABILITY, RTT, REORDER_WINDOW
+from sack import pack_ack
 
 # Configuration
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 12345
 BUFFER_SIZE = 1024
-QUEUE_SIZE = 1  #B, Max buffer size
-PACKET_SERVICE_INTERVAL = 0.1  #1/C, Inverse of the link capacity, packet processing rate (FIFO)
-DROP_PROBABILITY = 0.0  #PER, Probability of packet drop before entering the queue
-RTT = 1  #Round-trip time (RTT)
-
-# Create UDP socket
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-server_socket.bind((SERVER_IP, SERVER_PORT))
-
-# Data structures
-received_packets = set()  # Track received sequence numbers
-delayed_packets = queue.PriorityQueue()  # Priority queue for delay handling
-processing_queue = queue.Queue(maxsize=QUEUE_SIZE)  # FIFO buffer
-base = -1  # Last in-order received packet
-
-lock = threading.Lock()
-
-# Function to delay packets independently
-def delay_packet(seq_num, client_addr, recv_time):
-    expected_departure_time = recv_time + RTT 
-    delayed_packets.put((expected_departure_time, seq_num, client_addr))
-    print(f"Packet {seq_num} added to delay queue, expected at {expected_departure_time:.3f}")
-
-# Function to process delayed packets and add to queue
-def process_delayed_packets():
-    global base
-    while True:
-        delay_time, seq_num, client_addr = delayed_packets.get()
-
-        # Ensure we don't process before its due time
-        sleep_time = max(0, delay_time - time.time())
-        time.sleep(sleep_time)
-
-        # Simulate random drop before entering queue
-        if random.random() < DROP_PROBABILITY:
-            print(f"Packet {seq_num} dropped before entering queue!")
-            continue
-
-        # Add packet to processing queue (FIFO)
-        if not processing_queue.full():
-            processing_queue.put((seq_num, client_addr))
-            print(f"Packet {seq_num} added to queue at {time.time():.3f}")
-        else:
-            print(f"Packet {seq_num} dropped due to full buffer!")
-
-# Function to process queue and acknowledge packets
-def serve_packets():
-    global base
-    while True:
-        seq_num, client_addr = processing_queue.get()
-        print("time of getting ", time.time())
-        with lock:
-            if seq_num == base+1:
-                received_packets.add(seq_num)
-
-            # Update cumulative ACK base
-            while base + 1 in received_packets:
-                base += 1
-
-            # Send cumulative ACK
-            try:
-                ack_packet = struct.pack("!I", base)
-                server_socket.sendto(ack_packet, client_addr)
-                print(f"Processed Packet {seq_num}, Sent Cumulative ACK {base}")
-            except struct.error:
-                print(f"Error: Unable to pack ACK for base {base}")
-
-        time.sleep(PACKET_SERVICE_INTERVAL)  # Processing rate
-
-# Start packet processing threads
-threading.Thread(target=process_delayed_packets, daemon=True).start()
-threading.Thread(target=serve_packets, daemon=True).start()
-
-print(f"Server listening on {SERVER_IP}:{SERVER_PORT}")
-
-while True:
-    packet, client_addr = server_socket.recvfrom(BUFFER_SIZE)
-    recv_time = time.time()
-    seq_num = struct.unpack("!I", packet)[0]
-
-    print(f"Received Packet {seq_num}, adding to delay line")
-
-    # Delay packet independently
-    threading.Thread(target=delay_packet, args=(seq_num, client_addr, recv_time), daemon=True).start()
+READ_BATCH = 256  # packets read before the timers get another look
+RECEIVE_BUFFER = 4 * 1024 * 1024  # socket buffer, so a whole window sent at once is not lost before the emulator sees it
+
+SEQ = struct.Struct("!I")
+
+# One thread runs everything: packets are read as soon as the socket has
+# them, and the delay line, drops and FIFO service are timers on the
+# emulator's scheduler (emulator.py). The loop sleeps in select() until the
+# next timer is due or a packet comes in; select() takes microsecond
+# timeouts where epoll and socket timeouts round up to milliseconds.
+# Per-packet output only with --verbose, printing is slower than the rest.
+
+
+def serve(args):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    server_socket.bind((SERVER_IP, args.port))
+    server_socket.setblocking(False)
+
+    sendto, pack = server_socket.sendto, SEQ.pack
+
+    def send_ack(base, blocks, client_addr):
+        sendto(pack_ack(base, blocks) if args.selective_repeat else pack(base), client_addr)
+
+    scheduler = Scheduler()
+    link = Link(scheduler, send_ack, args.queue_size, args.service_interval, args.drop_probability, args.rtt,
+                log=print if args.verbose else None,
+                selective_repeat=args.selective_repeat, reorder_window=args.reorder_window)
+    packet = bytearray(BUFFER_SIZE)
+    clock = time.monotonic
+    receive, recvfrom_into, unpack_from = link.receive, server_socket.recvfrom_into, SEQ.unpack_from
+    print(f"Server listening on {SERVER_IP}:{args.port}", flush=True)
+    try:
+        while True:
+            scheduler.run_until(clock())
+            due = scheduler.next_time
+            if not select.select([server_socket], [], [], None if due is None else max(0, due - clock()))[0]:
+                continue
+            now = clock()
+            for _ in range(READ_BATCH):
+                try:
+                    size, client_addr = recvfrom_into(packet)
+                except BlockingIOError:
+                    break
+                if size == SEQ.size:
+                    receive(now, unpack_from(packet)[0], client_addr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Received {link.received}, dropped {link.dropped}, buffer full {link.overflowed}, "
+              f"served {link.served}, last in-order {link.base}, CPU time {time.process_time():.2f} s")
+        server_socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Go-Back-N link emulator")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="B, buffer size in packets")
+    parser.add_argument("--service-interval", type=float, default=PACKET_SERVICE_INTERVAL, help="1/C in seconds")
+    parser.add_argument("--drop-probability", type=float, default=DROP_PROBABILITY, help="PER, 0 to 1")
+    parser.add_argument("--rtt", type=float, default=RTT, help="delay before the queue in seconds")
+    parser.add_argument("--selective-repeat", action="store_true",
+                        help="keep packets after a hole and send SACK blocks (sack.py) with every ACK")
+    parser.add_argument("--reorder-window", type=int, default=REORDER_WINDOW,
+                        help="packets past the last in-order one kept with --selective-repeat")
+    parser.add_argument("--verbose", action="store_true", help="print every packet")
+    serve(parser.parse_args())
@@ -0,0 +1,92 @@
+import argparse
+import random
+from congestion import ALGORITHMS, DEFAULT_CC
+from emulator import Scheduler, Link, QUEUE_SIZE, PACKET_SERVICE_INTERVAL, DROP_PROBABILITY, RTT
+from gbn import GoBackNSender, WINDOW, MAX_WINDOW, DUPACK_THRESHOLD
+from selective import SelectiveRepeatSender
+
+# Runs the client's window or selective repeat sender against the emulator
+# in one process on virtual time: the same Link as server-gbn.py and the same
+# sender engines as the client, with no sockets and no sleeping. Time jumps
+# from one event (a timer of the link, or the sender's wakeup) to the next,
+# and drops come from a random.Random(seed), so a run takes a fraction of a
+# second and gives the same result every time for the same seed.
+#
+# What it leaves out is the real run's overhead: ACKs arrive at the instant
+# the link serves a packet, and the sender wakes up exactly when it asks to,
+# not on the next millisecond. The original rate sender is threads and sleeps
+# and has no engine to run here.
+
+VIRTUAL_TIME_LIMIT = 3600.0  # seconds of virtual time before a run is given up
+
+
+def simulate(capacity=1 / PACKET_SERVICE_INTERVAL, rtt=RTT, per=DROP_PROBABILITY, buffer=QUEUE_SIZE, packets=10000,
+             sender="window", cc=DEFAULT_CC, window=None, dupack_threshold=DUPACK_THRESHOLD, seed=0,
+             limit=VIRTUAL_TIME_LIMIT):
+    # Result of one run as a dict like bench-senders.py's, None if the sender
+    # is not done within `limit` seconds of virtual time
+    if window is None:
+        window = WINDOW if cc == "fixed" else MAX_WINDOW
+    selective = sender == "sr"
+    scheduler = Scheduler()
+    acks = []
+    link = Link(scheduler, lambda base, blocks, addr: acks.append((base, blocks)), buffer, 1 / capacity, per, rtt,
+                rng=random.Random(seed), selective_repeat=selective)
+    if selective:
+        engine = SelectiveRepeatSender(packets, window, cc=ALGORITHMS[cc](window))
+    else:
+        engine = GoBackNSender(packets, window, dupack_threshold, cc=ALGORITHMS[cc](window))
+    now = 0.0
+    while not engine.done:
+        seq = engine.next_packet(now)
+        while seq is not None:
+            link.receive(now, seq, None)
+            seq = engine.next_packet(now)
+        now = max(now, min(t for t in (engine.wakeup, scheduler.next_time) if t is not None))
+        if now > limit:
+            return None
+        scheduler.run_until(now)
+        for base, blocks in acks:
+            if selective:
+                engine.on_ack(base, blocks, now)
+            else:
+                engine.on_ack(base, now)
+        acks.clear()
+        engine.on_timeout(now)
+    return {
+        "throughput": packets / now,
+        "time": now,
+        "sent": engine.sent,
+        "retransmissions": engine.retransmitted,
+        "timeouts": engine.timeouts,
+        "fast_retransmits": engine.fast_retransmits,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an a2 sender against the emulator on virtual time")
+    parser.add_argument("--capacity", type=float, default=1 / PACKET_SERVICE_INTERVAL, help="link capacity (packets/s)")
+    parser.add_argument("--rtt", type=float, default=RTT, help="delay before the queue (s)")
+    parser.add_argument("--per", type=float, default=DROP_PROBABILITY, help="drop probability before the queue")
+    parser.add_argument("--buffer", type=int, default=QUEUE_SIZE, help="buffer size (packets)")
+    parser.add_argument("--packets", type=int, default=10000)
+    parser.add_argument("--sender", choices=("window", "sr"), default="window",
+                        help="sliding window Go-Back-N or selective repeat")
+    parser.add_argument("--cc", choices=sorted(ALGORITHMS), default=DEFAULT_CC)
+    parser.add_argument("--window", type=int,
+                        help=f"packets in flight with --cc fixed (default {WINDOW}), "
+                             f"the most in flight otherwise (default {MAX_WINDOW})")
+    parser.add_argument("--dupacks", type=int, default=DUPACK_THRESHOLD, help="duplicate ACKs that trigger a fast retransmit")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the drops")
+    parser.add_argument("--limit", type=float, default=VIRTUAL_TIME_LIMIT, help="virtual seconds before giving up")
+    args = parser.parse_args()
+    result = simulate(args.capacity, args.rtt, args.per, args.buffer, args.packets, args.sender, args.cc,
+                      args.window, args.dupacks, args.seed, args.limit)
+    if result is None:
+        print(f"Not done after {args.limit:g} s of virtual time")
+    else:
+        print(f"Time taken to send {args.packets} packets = ", result["time"])
+        print("Throughput = ", result["throughput"])
+        print("Packets sent = ", result["sent"])
+        print("Retransmissions = ", result["retransmissions"])
+        print(f"Timeouts = {result['timeouts']}, fast retransmits = {result['fast_retransmits']}")
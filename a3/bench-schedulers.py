@@ -0,0 +1,127 @@
+import argparse
+import importlib.util
+import os
+import random
+import time
+from schedulers import SCHEDULERS
+
+# Compares the schedulers in schedulers.py on virtual time: the clients of
+# test.py (one flow per port, each sending at its own fixed rate) into a
+# link of server-wfq.py's CAPACITY and BUFFER_SIZE, with the flow weights of
+# server-wfq.py and of server-wfq-3b.py. For each it reports the time spent
+# in enqueue and dequeue per packet, the throughput of every flow, Jain's
+# fairness index of throughput / weight (1 is perfectly weighted-fair; every
+# flow here sends more than its share) and the largest queueing delay of
+# every flow, from arrival until the packet has been sent.
+# A second table times the schedulers alone with thousands of flows.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUN_SECONDS = 600
+ARRIVAL_JITTER = 0.005  # seconds a client's packet may be late, so the clients do not move in lockstep with the link
+SCALE_LOAD = 2.0  # arrivals as a multiple of capacity, for the flow count table
+SCALE_BUFFER_PER_FLOW = 10
+SCALE_MAX_WEIGHT = 8
+
+
+def load(filename):
+    # A script of this directory as a module, for its constants
+    spec = importlib.util.spec_from_file_location(filename.replace("-", "_")[:-3], os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def simulate(scheduler_class, capacity, weights, buffer_size, arrivals):
+    # Sends `arrivals` [(time, flow)] through the scheduler on a link that
+    # takes 1 / capacity per packet; returns the seconds spent in the
+    # scheduler and [(flow, arrival, departure)] of every packet sent
+    scheduler = scheduler_class(capacity, weights, buffer_size)
+    sent = []
+    spent = 0
+    free_at = 0.0  # the link is sending until then
+    for arrival, flow in arrivals + [(float("inf"), None)]:
+        while scheduler and free_at <= arrival:
+            start = time.perf_counter()
+            packet_flow, packet_arrival = scheduler.dequeue(free_at)
+            spent += time.perf_counter() - start
+            free_at += 1 / capacity
+            sent.append((packet_flow, packet_arrival, free_at))
+        if flow is None:
+            break
+        free_at = max(free_at, arrival)
+        start = time.perf_counter()
+        scheduler.enqueue(arrival, flow, arrival)
+        spent += time.perf_counter() - start
+    return spent, sent
+
+
+def jain(values):
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def client_mix(run_seconds, seed):
+    # test.py's clients: (port, packets per second), each starting 1 ms
+    # after the previous one
+    rng = random.Random(seed)
+    arrivals = []
+    for i, (port, speed) in enumerate(load("test.py").PORTS):
+        count = int(run_seconds * speed)
+        arrivals += [(i * 0.001 + k / speed + rng.uniform(0, ARRIVAL_JITTER), port) for k in range(count)]
+    return sorted(arrivals)
+
+
+def compare(args):
+    server = load("server-wfq.py")
+    weight_sets = [("server-wfq.py", server.FLOW_WEIGHTS), ("server-wfq-3b.py", load("server-wfq-3b.py").FLOW_WEIGHTS)]
+    arrivals = client_mix(args.run_seconds, args.seed)
+    flows = sorted({flow for _, flow in arrivals})
+    print(f"test.py mix for {args.run_seconds:g} s, capacity {server.CAPACITY} pps, buffer {server.BUFFER_SIZE} packets")
+    print()
+    print("| Scheduler | Weights | µs/packet | Throughput per flow (pps) | Fairness index | Max delay per flow (s) |")
+    print("|---|---|---|---|---|---|")
+    for label, weights in weight_sets:
+        for name in args.schedulers:
+            spent, sent = simulate(SCHEDULERS[name], server.CAPACITY, weights, server.BUFFER_SIZE, arrivals)
+            done = [(flow, arrival, departure) for flow, arrival, departure in sent if departure <= args.run_seconds]
+            throughput = {flow: sum(1 for f, _, _ in done if f == flow) / args.run_seconds for flow in flows}
+            delay = {flow: max((d - a for f, a, d in done if f == flow), default=0) for flow in flows}
+            fairness = jain([throughput[flow] / weights[flow] for flow in flows])
+            print(f"| {name} | {label} ({'/'.join(str(weights[flow]) for flow in flows)}) | {spent / len(arrivals) * 1e6:.1f} | "
+                  + " / ".join(f"{throughput[flow]:.2f}" for flow in flows) + f" | {fairness:.4f} | "
+                  + " / ".join(f"{delay[flow]:.2f}" for flow in flows) + " |", flush=True)
+
+
+def scale(args):
+    print()
+    print(f"{args.packets} packets at {SCALE_LOAD:g}x capacity over random flows with weights 1 to {SCALE_MAX_WEIGHT}, "
+          f"{SCALE_BUFFER_PER_FLOW} packets of buffer per flow, µs per packet:")
+    print()
+    print("| Flows | " + " | ".join(args.schedulers) + " |")
+    print("|---|" + "---|" * len(args.schedulers))
+    capacity = 1000
+    for count in args.flows:
+        rng = random.Random(args.seed)
+        weights = {flow: rng.randint(1, SCALE_MAX_WEIGHT) for flow in range(count)}
+        arrivals = [(k / (SCALE_LOAD * capacity), rng.randrange(count)) for k in range(args.packets)]
+        # Starts from a full buffer, as if it had been running for a while
+        buffer_size = count * SCALE_BUFFER_PER_FLOW
+        fill = [(0.0, rng.randrange(count)) for _ in range(buffer_size)]
+        cells = []
+        for name in args.schedulers:
+            spent, sent = simulate(SCHEDULERS[name], capacity, weights, buffer_size, fill + arrivals)
+            cells.append(f"{spent / (len(fill) + args.packets) * 1e6:.1f}")
+        print(f"| {count} | " + " | ".join(cells) + " |", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the a3 packet schedulers on virtual time")
+    parser.add_argument("--schedulers", type=lambda s: s.split(","), default=list(SCHEDULERS),
+                        help="comma separated schedulers (default all)")
+    parser.add_argument("--run-seconds", type=float, default=RUN_SECONDS, help="virtual seconds of the test.py mix")
+    parser.add_argument("--flows", type=lambda s: [int(v) for v in s.split(",")], default=[10, 1000, 10000],
+                        help="flow counts for the scaling table")
+    parser.add_argument("--packets", type=int, default=50000, help="arrivals per run of the scaling table")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    compare(args)
+    scale(args)
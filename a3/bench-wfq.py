@@ -0,0 +1,88 @@
+import argparse
+import heapq
+import random
+import time
+from wfq import WFQScheduler
+
+# Cost per packet of the WFQ scheduler core (wfq.py) against the buffer
+# server-wfq.py used to have (a heap, with a linear scan for the largest tag
+# and a heapify on every drop), for more and more flows. Packets arrive at
+# LOAD times the capacity, spread over the flows at random and with random
+# weights, so the buffer stays full and every arrival pushes one out. Time
+# is virtual: each step is an arrival and, on average, 1/LOAD departures.
+
+CAPACITY = 1000  # packets per second
+LOAD = 2.0
+BUFFER_PER_FLOW = 10
+MAX_WEIGHT = 8
+
+
+class ScanWFQ:
+    # The old server-wfq.py buffer, without the socket
+    def __init__(self, capacity, weights, buffer_size):
+        self.capacity = capacity
+        self.weights = weights
+        self.buffer_size = buffer_size
+        self.virtual_time = 0
+        self.last_vft = {flow: [0] for flow in weights}
+        self.buffer = []
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def enqueue(self, now, flow, packet):
+        last_vft = self.last_vft[flow][-1]
+        vft = max(self.virtual_time, last_vft) + 1 / (self.capacity * self.weights[flow])
+        self.last_vft[flow].append(vft)
+        heapq.heappush(self.buffer, (vft, (packet, flow)))
+        if len(self.buffer) > self.buffer_size:
+            index_max = max(range(len(self.buffer)), key=self.buffer.__getitem__)
+            vft, (packet, flow) = self.buffer.pop(index_max)
+            self.last_vft[flow].pop(-1)
+            heapq.heapify(self.buffer)
+            return flow, packet
+        return None
+
+    def dequeue(self, now):
+        vft, (packet, flow) = heapq.heappop(self.buffer)
+        self.virtual_time = vft
+        return flow, packet
+
+
+def run(scheduler_class, flows, packets, seed):
+    rng = random.Random(seed)
+    weights = {flow: rng.randint(1, MAX_WEIGHT) for flow in range(flows)}
+    scheduler = scheduler_class(CAPACITY, weights, flows * BUFFER_PER_FLOW)
+    arrivals = [rng.randrange(flows) for _ in range(flows * BUFFER_PER_FLOW + packets)]
+    now = 0.0
+    for flow in arrivals[:flows * BUFFER_PER_FLOW]:  # fill the buffer first
+        scheduler.enqueue(now, flow, b"")
+    departures = 0.0
+    start = time.perf_counter()
+    for flow in arrivals[flows * BUFFER_PER_FLOW:]:
+        now += 1 / (LOAD * CAPACITY)
+        scheduler.enqueue(now, flow, b"")
+        departures += 1 / LOAD
+        while departures >= 1 and scheduler:
+            scheduler.dequeue(now)
+            departures -= 1
+    return (time.perf_counter() - start) / packets
+
+
+def main(args):
+    print("| Flows | Buffer | wfq.py (µs/packet) | Linear scan (µs/packet) |")
+    print("|---|---|---|---|")
+    for flows in args.flows:
+        core = run(WFQScheduler, flows, args.packets, args.seed)
+        scan = run(ScanWFQ, flows, args.packets, args.seed) if flows <= args.scan_max else None
+        scan_cell = f"{scan * 1e6:.1f}" if scan is not None else "not run"
+        print(f"| {flows} | {flows * BUFFER_PER_FLOW} | {core * 1e6:.1f} | {scan_cell} |", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-packet cost of the WFQ scheduler core against the old linear scan")
+    parser.add_argument("--flows", type=lambda s: [int(v) for v in s.split(",")], default=[3, 100, 1000, 10000])
+    parser.add_argument("--packets", type=int, default=20000, help="arrivals timed per run")
+    parser.add_argument("--scan-max", type=int, default=1000, help="most flows to run the linear scan for")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
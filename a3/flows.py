@@ -0,0 +1,117 @@
+from array import array
+from collections import OrderedDict
+
+# Flow table for the WFQ servers. A flow is whatever sends from one
+# (ip, port), created on its first packet and numbered with a small integer
+# (its slot) that the schedulers use as the flow. The weight and the
+# counters of every flow live in arrays indexed by slot, so a packet costs
+# one dict lookup for its slot and array reads from then on. Slots of flows
+# that have sent nothing for `timeout` seconds and have nothing queued are
+# reused.
+#
+# Weights come from a policy: rules of (ip, port, weight), '*' matching
+# anything, the first match winning and DEFAULT_WEIGHT if none does. A
+# policy file has one rule per line, '#' starting a comment:
+#   # ip       port  weight
+#   *          5001  8
+#   10.0.0.2   *     4
+# set_weight() puts a rule at the top, for control messages (see
+# server-wfq.py), and applies it to the flows that exist.
+
+MAX_FLOWS = 1024
+FLOW_TIMEOUT = 30.0  # seconds without a packet before an idle flow is removed
+DEFAULT_WEIGHT = 1
+
+
+def parse_rule(ip, port, weight):
+    weight = float(weight)
+    if weight <= 0:
+        raise ValueError(f"weight must be positive, not {weight:g}")
+    return ip, port if port == "*" else int(port), weight
+
+
+def load_policy(filename):
+    rules = []
+    with open(filename) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 3:
+                raise ValueError(f"{filename}:{number}: expected 'ip port weight'")
+            rules.append(parse_rule(*fields))
+    return rules
+
+
+class FlowTable:
+    def __init__(self, policy=(), max_flows=MAX_FLOWS, timeout=FLOW_TIMEOUT, default_weight=DEFAULT_WEIGHT):
+        self.policy = list(policy)
+        self.timeout = timeout
+        self.default_weight = default_weight
+        self.slots = {}  # {(ip, port): slot}
+        self.free = list(range(max_flows - 1, -1, -1))  # free slots, lowest last
+        self.recent = OrderedDict()  # slots in use, least recently active first
+        self.addresses = [None] * max_flows
+        self.weights = array('d', [0.0]) * max_flows
+        self.last_seen = array('d', [0.0]) * max_flows
+        self.queued = array('q', [0]) * max_flows
+        self.received = array('q', [0]) * max_flows
+        self.sent = array('q', [0]) * max_flows
+        self.dropped = array('q', [0]) * max_flows
+
+    def __len__(self):
+        return len(self.slots)
+
+    def weight_for(self, address):
+        ip, port = address
+        for rule_ip, rule_port, weight in self.policy:
+            if rule_ip in ("*", ip) and rule_port in ("*", port):
+                return weight
+        return self.default_weight
+
+    def lookup(self, address, now):
+        # Slot of the flow sending from `address`, created if new; None when
+        # the table is full
+        slot = self.slots.get(address)
+        if slot is None:
+            if not self.free:
+                return None
+            slot = self.free.pop()
+            self.slots[address] = slot
+            self.addresses[slot] = address
+            self.weights[slot] = self.weight_for(address)
+            self.queued[slot] = self.received[slot] = self.sent[slot] = self.dropped[slot] = 0
+        self.recent[slot] = None
+        self.recent.move_to_end(slot)
+        self.last_seen[slot] = now
+        self.received[slot] += 1
+        return slot
+
+    def expire(self, now):
+        # Removes flows idle for `timeout`; returns their slots, for the
+        # scheduler to forget
+        expired = []
+        while self.recent:
+            slot = next(iter(self.recent))
+            if self.last_seen[slot] > now - self.timeout:
+                break
+            if self.queued[slot]:
+                # Still has packets waiting, so not idle
+                self.last_seen[slot] = now
+                self.recent.move_to_end(slot)
+                continue
+            del self.recent[slot]
+            del self.slots[self.addresses[slot]]
+            self.addresses[slot] = None
+            self.free.append(slot)
+            expired.append(slot)
+        return expired
+
+    def set_weight(self, ip, port, weight):
+        # Puts a rule at the top of the policy, replacing any for the same
+        # ip and port, and gives its weight to the flows it matches
+        rule_ip, rule_port, weight = parse_rule(ip, port, weight)
+        self.policy = [(rule_ip, rule_port, weight)] + [rule for rule in self.policy if rule[:2] != (rule_ip, rule_port)]
+        for (flow_ip, flow_port), slot in self.slots.items():
+            if rule_ip in ("*", flow_ip) and rule_port in ("*", flow_port):
+                self.weights[slot] = weight
@@ -0,0 +1,287 @@
+import bisect
+import heapq
+import itertools
+from collections import deque
+from wfq import WFQScheduler
+
+# Packet schedulers for server-wfq.py, picked by name from SCHEDULERS. They
+# all take (capacity, weights, buffer_size), with weights indexed by flow
+# ({flow: weight}, or the weights of a flows.FlowTable, which can change
+# while the flow is running), and are driven the same way, with the current
+# time passed in:
+#   enqueue(now, flow, packet)  adds a packet; returns the (flow, packet)
+#                               dropped to make room, if any
+#   dequeue(now)                (flow, packet) to send next, None if empty
+#   forget(flow)                a flow with nothing queued has gone away
+#   len(scheduler)              packets waiting
+#
+# WFQ (wfq.py) and SCFQ keep one buffer in finish tag order and push out the
+# largest tag on overflow. WFQ tags against GPS virtual time, SCFQ (Golestani,
+# 1994) against the finish tag of the packet last sent, which needs no GPS
+# simulation. WF2Q+ (Bennett and Zhang, 1997) only sends packets GPS would
+# have started by now, so no flow gets ahead of its GPS service by more than
+# a packet. DRR (Shreedhar and Varghese, 1995) visits the backlogged flows in
+# turn and sends `weight` packets from each, in O(1). WF2Q+ and DRR keep a
+# FIFO per flow and on overflow drop from the one longest for its weight.
+# StrictPriority sends the highest weight first, FIFO within a weight, and
+# drops from the lowest.
+
+
+class SCFQScheduler(WFQScheduler):
+    class clock_class:
+        # Virtual time is the finish tag of the packet last sent
+        def __init__(self, capacity, weights):
+            self.capacity = capacity
+            self.weights = weights
+            self.time = 0.0
+            self.last_finish = {}
+
+        def tag(self, now, flow, size=1):
+            start = max(self.time, self.last_finish.get(flow, 0))
+            finish = start + size / (self.capacity * self.weights[flow])
+            self.last_finish[flow] = finish
+            return start, finish
+
+        def untag(self, flow, start):
+            self.last_finish[flow] = start
+
+        def forget(self, flow):
+            self.last_finish.pop(flow, None)
+
+    def dequeue(self, now):
+        if self.buffer:
+            self.clock.time = self.buffer.min()[0]
+        return super().dequeue(now)
+
+
+class FlowQueues:
+    # A FIFO per flow sharing buffer_size packets. On overflow the last packet
+    # of the flow with the most packets for its weight is dropped; subclasses
+    # hear about flows that get a first packet (activate) and flows whose
+    # only packet is dropped (deactivate).
+    def __init__(self, capacity, weights, buffer_size):
+        self.capacity = capacity
+        self.weights = weights
+        self.buffer_size = buffer_size
+        self.queues = {}  # {flow: deque of packets}
+        self.size = 0
+        self.longest = []  # heap of (-packets / weight, flow), some stale
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size
+
+    def enqueue(self, now, flow, packet):
+        queue = self.queues.get(flow)
+        if queue is None:
+            queue = self.queues[flow] = deque()
+        queue.append(packet)
+        self.size += 1
+        if len(queue) == 1:
+            self.activate(now, flow)
+        heapq.heappush(self.longest, (-len(queue) / self.weights[flow], flow))
+        if len(self.longest) > 2 * len(self.queues) + 64:
+            # Stale entries pile up while nothing overflows
+            self.longest = [(-len(q) / self.weights[f], f) for f, q in self.queues.items() if q]
+            heapq.heapify(self.longest)
+        if self.size <= self.buffer_size:
+            return None
+        while True:
+            key, victim = heapq.heappop(self.longest)
+            queue = self.queues.get(victim)
+            if not queue:
+                continue
+            current = -len(queue) / self.weights[victim]
+            if key == current:
+                break
+            heapq.heappush(self.longest, (current, victim))  # the weight changed
+        dropped = queue.pop()
+        self.size -= 1
+        self.dropped += 1
+        if queue:
+            heapq.heappush(self.longest, (-len(queue) / self.weights[victim], victim))
+        else:
+            self.deactivate(victim)
+        return victim, dropped
+
+    def pop(self, flow):
+        self.size -= 1
+        return self.queues[flow].popleft()
+
+    def forget(self, flow):
+        self.queues.pop(flow, None)
+
+    def activate(self, now, flow):
+        pass
+
+    def deactivate(self, flow):
+        pass
+
+
+class WF2QPlusScheduler(FlowQueues):
+    # Tags are only kept for the packet at the head of each flow. A flow's
+    # rate is its share of capacity over the weights of all the flows seen,
+    # and the virtual time advances by 1 / capacity per packet sent, or jumps
+    # to the smallest start tag when no head is eligible.
+    def __init__(self, capacity, weights, buffer_size):
+        super().__init__(capacity, weights, buffer_size)
+        self.flow_weights = {}  # {flow: weight} of every flow seen, as last used
+        self.total_weight = 0
+        self.time = 0.0  # virtual time
+        self.last_finish = {}  # {flow: finish tag of its last packet sent or at the head}
+        self.heads = {}  # {flow: (start, finish, serial)} of the head packet
+        self.serial = itertools.count()
+        self.waiting = []  # heap of (start, serial, flow), heads not eligible yet
+        self.eligible = []  # heap of (finish, serial, flow)
+
+    def set_head(self, flow, start):
+        weight = self.weights[flow]
+        self.total_weight += weight - self.flow_weights.get(flow, 0)
+        self.flow_weights[flow] = weight
+        finish = start + self.total_weight / (self.capacity * weight)
+        serial = next(self.serial)
+        self.heads[flow] = (start, finish, serial)
+        self.last_finish[flow] = finish
+        if start <= self.time:
+            heapq.heappush(self.eligible, (finish, serial, flow))
+        else:
+            heapq.heappush(self.waiting, (start, serial, flow))
+
+    def activate(self, now, flow):
+        self.set_head(flow, max(self.time, self.last_finish.get(flow, 0)))
+
+    def deactivate(self, flow):
+        # The head was dropped unsent: the flow's tags go back to before it
+        start, _, _ = self.heads.pop(flow)
+        self.last_finish[flow] = start
+
+    def forget(self, flow):
+        super().forget(flow)
+        self.total_weight -= self.flow_weights.pop(flow, 0)
+        self.last_finish.pop(flow, None)
+
+    def valid(self, entry):
+        _, serial, flow = entry
+        head = self.heads.get(flow)
+        return head is not None and head[2] == serial
+
+    def dequeue(self, now):
+        if not self.size:
+            return None
+        while self.eligible and not self.valid(self.eligible[0]):
+            heapq.heappop(self.eligible)
+        if not self.eligible:
+            while not self.valid(self.waiting[0]):
+                heapq.heappop(self.waiting)
+            self.time = max(self.time, self.waiting[0][0])
+        while self.waiting and self.waiting[0][0] <= self.time:
+            entry = heapq.heappop(self.waiting)
+            if self.valid(entry):
+                start, serial, flow = entry
+                heapq.heappush(self.eligible, (self.heads[flow][1], serial, flow))
+        while not self.valid(self.eligible[0]):
+            heapq.heappop(self.eligible)
+        _, _, flow = heapq.heappop(self.eligible)
+        _, finish, _ = self.heads.pop(flow)
+        packet = self.pop(flow)
+        self.time += 1 / self.capacity
+        if self.queues[flow]:
+            self.set_head(flow, finish)
+        return flow, packet
+
+
+class DRRScheduler(FlowQueues):
+    # Each visit gives a flow `weight` packets of credit (the quantum, as
+    # every packet counts as one), and it sends while it has credit left
+    def __init__(self, capacity, weights, buffer_size):
+        super().__init__(capacity, weights, buffer_size)
+        self.active = deque()  # backlogged flows in visiting order, some emptied by drops
+        self.listed = set()  # flows in self.active
+        self.deficit = {}
+        self.current = None  # flow being visited
+
+    def activate(self, now, flow):
+        if flow not in self.listed:
+            self.listed.add(flow)
+            self.active.append(flow)
+            self.deficit[flow] = 0
+
+    def forget(self, flow):
+        super().forget(flow)
+        if flow not in self.listed:
+            self.deficit.pop(flow, None)
+
+    def dequeue(self, now):
+        if not self.size:
+            return None
+        while True:
+            flow = self.active[0]
+            if not self.queues.get(flow):
+                self.active.popleft()
+                self.listed.discard(flow)
+                self.deficit.pop(flow, None)
+                self.current = None
+                continue
+            if self.current != flow:
+                self.current = flow
+                self.deficit[flow] += self.weights[flow]
+            if self.deficit[flow] >= 1:
+                break
+            # Out of credit: on to the next flow
+            self.active.rotate(-1)
+            self.current = None
+        self.deficit[flow] -= 1
+        packet = self.pop(flow)
+        if not self.queues[flow]:
+            # Credit is not kept while a flow has nothing to send
+            self.active.popleft()
+            self.listed.discard(flow)
+            self.current = None
+        return flow, packet
+
+
+class StrictPriorityScheduler:
+    def __init__(self, capacity, weights, buffer_size):
+        self.weights = weights
+        self.buffer_size = buffer_size
+        self.levels = {}  # {weight: deque of (flow, packet)}
+        self.order = []  # weights, highest first
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size
+
+    def enqueue(self, now, flow, packet):
+        weight = self.weights[flow]
+        if weight not in self.levels:
+            self.levels[weight] = deque()
+            bisect.insort(self.order, weight, key=lambda w: -w)
+        self.levels[weight].append((flow, packet))
+        self.size += 1
+        if self.size <= self.buffer_size:
+            return None
+        self.size -= 1
+        self.dropped += 1
+        for weight in reversed(self.order):
+            if self.levels[weight]:
+                return self.levels[weight].pop()
+
+    def dequeue(self, now):
+        for weight in self.order:
+            if self.levels[weight]:
+                self.size -= 1
+                return self.levels[weight].popleft()
+        return None
+
+    def forget(self, flow):
+        pass
+
+
+SCHEDULERS = {
+    "wfq": WFQScheduler,
+    "wf2q+": WF2QPlusScheduler,
+    "scfq": SCFQScheduler,
+    "drr": DRRScheduler,
+    "priority": StrictPriorityScheduler,
+}
@@ -1,73 +1,81 @@
+import argparse
 import socket
 import threading
 import time
 import heapq
+from flows import FlowTable, load_policy
+from wfq import GPSClock
 
 # Server parameters
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 4000
 CAPACITY = 10  # packets per second
 PACKET_SIZE = 1024
-BUFFER_SIZE = 1000 # Max queue size
-FLOW_WEIGHTS = {5001: 8, 5002: 1, 5003: 1}  # weights for each flow
-SIZE_CNT = [0,0,0]
+BUFFER_SIZE = 1000 # Max queue size, per flow
+FLOW_WEIGHTS = {5001: 8, 5002: 1, 5003: 1}  # weights for client ports, unless --policy is given
 
 class WFQServer:
-    def __init__(self):
+    def __init__(self, policy=None):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((SERVER_IP, SERVER_PORT))
-        self.virtual_time = 0  # System virtual time
-        self.last_vft = {port: 0 for port in FLOW_WEIGHTS}  # Last VFT for each flow
+        if policy is None:
+            policy = [("*", port, weight) for port, weight in FLOW_WEIGHTS.items()]
+        # Every (ip, port) that sends is a flow, numbered from 0 (flows.py)
+        self.flows = FlowTable(policy)
+        self.clock = GPSClock(CAPACITY, self.flows.weights)  # GPS virtual time (wfq.py)
         self.lock = threading.Lock()
+        self.packet_ready = threading.Condition(self.lock)  # notified when a packet joins the buffer
         self.buffer = [] # [(vft, (data, flow_num))]
 
     def compute_vft(self, flow, arrival_time):
-        weight = FLOW_WEIGHTS[flow]
-        last_vft = self.last_vft[flow]
-        vft = max(arrival_time, last_vft) + 1 / (CAPACITY * weight)
-        self.last_vft[flow] = vft
+        # Finish tag against GPS virtual time at arrival_time
+        start, vft = self.clock.tag(arrival_time, flow)
         return vft
-    def find_flow_ind(self,flow):
-        flow_ind = 0
-        for key in FLOW_WEIGHTS.keys():
-            if key == flow:
-                break
-            else:
-                flow_ind+=1
-        return flow_ind
     
-    def enqueue_packet(self, packet, flow):
+    def enqueue_packet(self, packet, addr):
         with self.lock:
-            flow_ind = self.find_flow_ind(flow)
-            vft = self.compute_vft(flow, self.virtual_time)
-            if SIZE_CNT[flow_ind] < BUFFER_SIZE:
+            now = time.monotonic()
+            for flow in self.flows.expire(now):
+                self.clock.forget(flow)
+            flow_ind = self.flows.lookup(addr, now)
+            if flow_ind is not None and self.flows.queued[flow_ind] < BUFFER_SIZE:
+                # Only packets that are kept get a tag
+                vft = self.compute_vft(flow_ind, now)
                 # Drop the packet with the highest VFT
                 # since we are removing the last element
                 # the tree does not change so you don't
                 # need to heapify.
-                heapq.heappush(self.buffer, (vft, (packet, flow)))
-                SIZE_CNT[flow_ind]+=1
-                print(f"received on {flow_ind} at {self.virtual_time}, vft = {vft}", flush=True)
+                heapq.heappush(self.buffer, (vft, (packet, flow_ind)))
+                self.packet_ready.notify()
+                self.flows.queued[flow_ind]+=1
+                print(f"received on {flow_ind} at {self.clock.time}, vft = {vft}", flush=True)
                 # heapify is O(n), we don't want that
                 # heapq.heapify(self.buffer)
+            elif flow_ind is not None:
+                self.flows.dropped[flow_ind]+=1
             
 
     def serve_packets(self):
+        # Paced from a deadline, 1/CAPACITY after the previous departure,
+        # so oversleeping does not add up; starts over from now after idling
+        next_departure = time.monotonic()
         while True:
-            self.lock.acquire()
-            if self.buffer:
-                vft, (packet, flow) = heapq.heappop(self.buffer)
-                self.lock.release()
-                time.sleep(1/CAPACITY)
-                flow_ind = self.find_flow_ind(flow)
-                SIZE_CNT[flow_ind]-=1
-                # print(self.buffer)
-                self.virtual_time = vft
-                client_addr = ("127.0.0.1", flow)
-                self.sock.sendto(packet, client_addr)
-                print(flow_ind, " ", vft)
-            else:
-                self.lock.release()
+            with self.packet_ready:
+                if not self.buffer:
+                    # Sleep until the receive thread adds a packet
+                    while not self.buffer:
+                        self.packet_ready.wait()
+                    next_departure = max(next_departure, time.monotonic())
+                vft, (packet, flow_ind) = heapq.heappop(self.buffer)
+            next_departure += 1 / CAPACITY
+            time.sleep(max(next_departure - time.monotonic(), 0))
+            with self.lock:
+                self.flows.queued[flow_ind]-=1
+                self.flows.sent[flow_ind]+=1
+                client_addr = self.flows.addresses[flow_ind]
+            # print(self.buffer)
+            self.sock.sendto(packet, client_addr)
+            print(flow_ind, " ", vft)
             
 
     def start(self):
@@ -77,10 +85,11 @@ class WFQServer:
         threading.Thread(target=self.serve_packets, daemon=True).start()
         while True:
             data, addr = self.sock.recvfrom(PACKET_SIZE)
-            flow_port = addr[1]  # Extract client port number from address tuple
-            if flow_port in FLOW_WEIGHTS:
-                self.enqueue_packet(data, flow_port)
+            self.enqueue_packet(data, addr)
 
 if __name__ == "__main__":
-    server = WFQServer()
+    parser = argparse.ArgumentParser(description="Weighted fair queueing server with a buffer per flow")
+    parser.add_argument("--policy", help="file of 'ip port weight' rules, '*' for any (default FLOW_WEIGHTS)")
+    args = parser.parse_args()
+    server = WFQServer(load_policy(args.policy) if args.policy else None)
     server.start()
\ No newline at end of file
@@ -1,7 +1,9 @@
+import argparse
 import socket
 import threading
 import time
-import heapq
+from flows import FlowTable, load_policy, MAX_FLOWS, FLOW_TIMEOUT
+from schedulers import SCHEDULERS
 
 # Server parameters
 SERVER_IP = "127.0.0.1"
@@ -9,67 +11,102 @@ SERVER_PORT = 4000
 CAPACITY = 10  # packets per second
 PACKET_SIZE = 1024
 BUFFER_SIZE = 10 # Max queue size
-FLOW_WEIGHTS = {5001: 1, 5002: 1, 5003: 1}  # weights for each flow
+FLOW_WEIGHTS = {5001: 1, 5002: 1, 5003: 1}  # weights for client ports, unless --policy is given
+CONTROL_PORT = 4001
+
+# Every (ip, port) that sends is a flow (flows.py), with its weight from the
+# policy file or FLOW_WEIGHTS, 1 otherwise. Text commands on CONTROL_PORT,
+# answered with "ok ..." or "error ...":
+#   weight <ip|*> <port|*> <weight>   sets the weight of matching flows, now and later
+#   flows                             one line per flow: ip port weight queued received sent dropped
 
 class WFQServer:
-    def __init__(self):
+    def __init__(self, scheduler="wfq", policy=None, max_flows=MAX_FLOWS, flow_timeout=FLOW_TIMEOUT):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((SERVER_IP, SERVER_PORT))
-        self.virtual_time = 0  # System virtual time
-        self.last_vft = {port: [0] for port in FLOW_WEIGHTS}  # Last VFT for each flow
+        self.control = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.control.bind((SERVER_IP, CONTROL_PORT))
+        if policy is None:
+            policy = [("*", port, weight) for port, weight in FLOW_WEIGHTS.items()]
+        self.flows = FlowTable(policy, max_flows, flow_timeout)
+        # Decides which packet goes next and which one to drop when the
+        # buffer is full (schedulers.py); WFQ against GPS virtual time by default
+        self.scheduler = SCHEDULERS[scheduler](CAPACITY, self.flows.weights, BUFFER_SIZE)
         self.lock = threading.Lock()
-        self.buffer = [] # Acts as a heap, contains: [(vft, (data, flow_num))]
+        self.packet_ready = threading.Condition(self.lock)  # notified when a packet joins the buffer
 
-    def compute_vft(self, flow, arrival_time):
-        # Function to compute vft of packet that arrived
-        weight = FLOW_WEIGHTS[flow]
-        last_vft = self.last_vft[flow][-1]
-        vft = max(arrival_time, last_vft) + 1 / (CAPACITY * weight)
-        self.last_vft[flow].append(vft)
-        return vft
-    
-    def enqueue_packet(self, packet, flow):
+    def enqueue_packet(self, packet, addr):
         # Function to add packet to queue and handle dropping
         with self.lock:
-            vft = self.compute_vft(flow, self.virtual_time)
-            # Insert in order of vft
-            heapq.heappush(self.buffer, (vft, (packet, flow)))
-            if len(self.buffer) > BUFFER_SIZE:
-                # Treat the 'heap' as list
-                # Find index of max vft packet
-                # Drop that packet
-                # Re-heapify the list
-                index_max = max(range(len(self.buffer)), key=self.buffer.__getitem__)
-                vft, (packet, flow) = self.buffer.pop(index_max)
-                self.last_vft[flow].pop(-1)
-                heapq.heapify(self.buffer)
+            now = time.monotonic()
+            for flow in self.flows.expire(now):
+                self.scheduler.forget(flow)
+            flow = self.flows.lookup(addr, now)
+            if flow is None:
+                return  # too many flows
+            self.flows.queued[flow] += 1
+            dropped = self.scheduler.enqueue(now, flow, packet)
+            if dropped is not None:
+                self.flows.queued[dropped[0]] -= 1
+                self.flows.dropped[dropped[0]] += 1
+            self.packet_ready.notify()
             
     def serve_packets(self):
         # Function to serve packets
+        # Each packet leaves 1/CAPACITY after the previous one, counted from
+        # a deadline rather than from when the sleep ended, so oversleeping
+        # does not add up. After the link goes idle it starts over from now.
+        next_departure = time.monotonic()
         while True:
-            self.lock.acquire()
-            if self.buffer:
-                # Pop from top of heap
-                vft, (packet, flow) = heapq.heappop(self.buffer)
-                self.lock.release()
-                time.sleep(1/CAPACITY)
-                # print(self.buffer)
-                self.virtual_time = vft
-                client_addr = ("127.0.0.1", flow)
-                self.sock.sendto(packet, client_addr)
-            else:
-                self.lock.release()
-            
+            with self.packet_ready:
+                if not self.scheduler:
+                    # Sleep until the receive thread adds a packet
+                    while not self.scheduler:
+                        self.packet_ready.wait()
+                    next_departure = max(next_departure, time.monotonic())
+                flow, packet = self.scheduler.dequeue(time.monotonic())
+                # A flow with packets queued does not expire
+                self.flows.queued[flow] -= 1
+                self.flows.sent[flow] += 1
+                client_addr = self.flows.addresses[flow]
+            next_departure += 1 / CAPACITY
+            time.sleep(max(next_departure - time.monotonic(), 0))
+            self.sock.sendto(packet, client_addr)
+
+    def serve_control(self):
+        while True:
+            data, addr = self.control.recvfrom(PACKET_SIZE)
+            command = data.decode(errors="replace").split()
+            with self.lock:
+                try:
+                    if command[:1] == ["weight"] and len(command) == 4:
+                        self.flows.set_weight(*command[1:])
+                        reply = "ok"
+                    elif command == ["flows"]:
+                        flows = self.flows
+                        reply = "ok\n" + "".join(
+                            f"{ip} {port} {flows.weights[flow]:g} {flows.queued[flow]} {flows.received[flow]} "
+                            f"{flows.sent[flow]} {flows.dropped[flow]}\n" for (ip, port), flow in flows.slots.items())
+                    else:
+                        reply = "error: expected 'weight <ip> <port> <weight>' or 'flows'"
+                except ValueError as e:
+                    reply = f"error: {e}"
+            self.control.sendto(reply.encode(), addr)
 
     def start(self):
         # Server enqueued packets on another thread
         threading.Thread(target=self.serve_packets, daemon=True).start()
+        threading.Thread(target=self.serve_control, daemon=True).start()
         while True:
             data, addr = self.sock.recvfrom(PACKET_SIZE)
-            flow_port = addr[1]  # Extract client port number from address tuple
-            if flow_port in FLOW_WEIGHTS:
-                self.enqueue_packet(data, flow_port)
+            self.enqueue_packet(data, addr)
 
 if __name__ == "__main__":
-    server = WFQServer()
+    parser = argparse.ArgumentParser(description="Weighted fair queueing server")
+    parser.add_argument("--scheduler", choices=sorted(SCHEDULERS), default="wfq", help="scheduling discipline")
+    parser.add_argument("--policy", help="file of 'ip port weight' rules, '*' for any (default FLOW_WEIGHTS)")
+    parser.add_argument("--max-flows", type=int, default=MAX_FLOWS)
+    parser.add_argument("--flow-timeout", type=float, default=FLOW_TIMEOUT, help="seconds before an idle flow is removed")
+    args = parser.parse_args()
+    server = WFQServer(args.scheduler, load_policy(args.policy) if args.policy else None, args.max_flows, args.flow_timeout)
     server.start()
\ No newline at end of file
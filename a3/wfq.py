@@ -0,0 +1,214 @@
+import heapq
+import itertools
+
+# Scheduler core for the WFQ servers, without sockets or threads: the caller
+# passes in the current time.
+#
+# GPSClock is the virtual time of the fluid GPS server the tags refer to. It
+# advances at 1 / (sum of the weights of the flows GPS is serving) per second,
+# so a packet of flow f tagged 1 / (CAPACITY * w_f) past its start takes as
+# long in GPS as it would at f's share of CAPACITY. A flow is served by GPS
+# until the clock reaches the finish tag of its last packet. Those finish tags
+# are kept in a heap, so moving the clock forward costs O(log n) for each
+# flow that goes idle on the way.
+#
+# MinMaxHeap gives both the smallest and the largest item in O(1) and removes
+# either in O(log n) (Atkinson et al., 1986). WFQScheduler keeps its buffer
+# in one: packets leave in finish tag order, and on overflow the packet with
+# the largest finish tag is pushed out.
+
+
+class GPSClock:
+    def __init__(self, capacity, weights):
+        self.capacity = capacity
+        self.weights = weights  # {flow: weight}, or flows.FlowTable.weights
+        self.time = 0.0  # virtual time
+        self.updated = None  # real time self.time is for
+        self.last_finish = {}  # {flow: finish tag of its last packet}
+        self.finishes = []  # heap of (finish tag, flow), some stale
+        self.active = {}  # {flow: weight} of the flows GPS is serving
+        self.active_weight = 0
+
+    def advance(self, now):
+        # Moves the virtual time forward to real time `now`
+        if self.updated is not None:
+            elapsed = now - self.updated
+            while self.active and elapsed > 0:
+                finish, flow = self.finishes[0]
+                if flow not in self.active or self.last_finish.get(flow) != finish:
+                    heapq.heappop(self.finishes)
+                    continue
+                needed = (finish - self.time) * self.active_weight
+                if needed > elapsed:
+                    self.time += elapsed / self.active_weight
+                    break
+                # The flow's last packet finishes in GPS before `now`
+                heapq.heappop(self.finishes)
+                elapsed -= needed
+                self.time = finish
+                self.active_weight -= self.active.pop(flow)
+        self.updated = now
+        return self.time
+
+    def tag(self, now, flow, size=1):
+        # (start, finish) tags for a packet of flow arriving at `now`
+        self.advance(now)
+        start = max(self.time, self.last_finish.get(flow, 0))
+        finish = start + size / (self.capacity * self.weights[flow])
+        self.set_finish(flow, finish)
+        return start, finish
+
+    def untag(self, flow, start):
+        # Undoes tag() for the last packet of flow, when it is dropped
+        self.set_finish(flow, start)
+
+    def set_finish(self, flow, finish):
+        self.last_finish[flow] = finish
+        if finish > self.time:
+            if flow not in self.active:
+                # Counted with the weight it had then, in case that changes
+                self.active[flow] = self.weights[flow]
+                self.active_weight += self.active[flow]
+            heapq.heappush(self.finishes, (finish, flow))
+        elif flow in self.active:
+            self.active_weight -= self.active.pop(flow)
+        if not self.active:
+            self.active_weight = 0  # no rounding left over
+
+    def forget(self, flow):
+        # Drops all state of a flow that has gone away
+        if flow in self.active:
+            self.active_weight -= self.active.pop(flow)
+        self.last_finish.pop(flow, None)
+
+
+class MinMaxHeap:
+    # Items on even levels are the smallest of their subtree, items on odd
+    # levels the largest
+    def __init__(self):
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def min(self):
+        return self.items[0]
+
+    def max(self):
+        return max(self.items[:3]) if len(self.items) > 1 else self.items[0]
+
+    def push(self, item):
+        items = self.items
+        items.append(item)
+        i = len(items) - 1
+        if i == 0:
+            return
+        parent = (i - 1) // 2
+        if is_min_level(i):
+            if items[i] > items[parent]:
+                items[i], items[parent] = items[parent], items[i]
+                self.bubble_up(parent, max_level=True)
+            else:
+                self.bubble_up(i, max_level=False)
+        else:
+            if items[i] < items[parent]:
+                items[i], items[parent] = items[parent], items[i]
+                self.bubble_up(parent, max_level=False)
+            else:
+                self.bubble_up(i, max_level=True)
+
+    def pop_min(self):
+        return self.remove(0)
+
+    def pop_max(self):
+        items = self.items
+        if len(items) <= 2:
+            return items.pop()
+        return self.remove(1 if items[1] >= items[2] else 2)
+
+    def remove(self, i):
+        items = self.items
+        last = items.pop()
+        if i == len(items):
+            return last
+        item, items[i] = items[i], last
+        self.trickle_down(i)
+        return item
+
+    def bubble_up(self, i, max_level):
+        # Moves items[i] up through its grandparents on the same kind of level
+        items = self.items
+        while i > 2:
+            grandparent = ((i - 1) // 2 - 1) // 2
+            if (items[i] > items[grandparent]) if max_level else (items[i] < items[grandparent]):
+                items[i], items[grandparent] = items[grandparent], items[i]
+                i = grandparent
+            else:
+                break
+
+    def trickle_down(self, i):
+        items = self.items
+        size = len(items)
+        max_level = not is_min_level(i)
+        while True:
+            first_child = 2 * i + 1
+            if first_child >= size:
+                return
+            # The smallest (largest) child or grandchild
+            best = first_child
+            for j in itertools.chain(range(first_child + 1, min(first_child + 2, size)),
+                                     range(4 * i + 3, min(4 * i + 7, size))):
+                if (items[j] > items[best]) if max_level else (items[j] < items[best]):
+                    best = j
+            if not ((items[best] > items[i]) if max_level else (items[best] < items[i])):
+                return
+            items[i], items[best] = items[best], items[i]
+            if best <= first_child + 1:
+                return
+            parent = (best - 1) // 2
+            if (items[best] < items[parent]) if max_level else (items[best] > items[parent]):
+                items[best], items[parent] = items[parent], items[best]
+            i = best
+
+
+def is_min_level(i):
+    return (i + 1).bit_length() % 2 == 1
+
+
+class WFQScheduler:
+    clock_class = GPSClock  # where the tags come from
+
+    def __init__(self, capacity, weights, buffer_size):
+        self.clock = self.clock_class(capacity, weights)
+        self.buffer_size = buffer_size
+        self.buffer = MinMaxHeap()  # (finish tag, order, start tag, flow, packet)
+        self.order = itertools.count()  # FIFO among equal tags
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def enqueue(self, now, flow, packet):
+        # Adds a packet, pushing out the one with the largest finish tag if
+        # the buffer is full; returns the (flow, packet) dropped, if any
+        start, finish = self.clock.tag(now, flow)
+        self.buffer.push((finish, next(self.order), start, flow, packet))
+        if len(self.buffer) <= self.buffer_size:
+            return None
+        # The largest finish tag is always the last packet of its flow
+        _, _, start, flow, packet = self.buffer.pop_max()
+        self.clock.untag(flow, start)
+        self.dropped += 1
+        return flow, packet
+
+    def forget(self, flow):
+        # For a flow with nothing queued that will not come back (its number
+        # may be given to a new one)
+        self.clock.forget(flow)
+
+    def dequeue(self, now):
+        # (flow, packet) with the smallest finish tag, None if empty
+        if not self.buffer:
+            return None
+        _, _, _, flow, packet = self.buffer.pop_min()
+        return flow, packet